@@ -1,220 +1,163 @@
-import pygame
-import multiprocessing
-from multiprocessing import shared_memory
+import random
 import time
-from queue import Empty
-import sys
 import env
-import animals
-
-
-#ui conf
-grid_pixel_size = env.tab_size * env.cell_size
-window_width = grid_pixel_size
-window_height = grid_pixel_size + 100 #extra space for text
-FPS = 30
-
-#colors
-bg_color = (30, 20, 40)
-grid_color = (25, 50, 70)
-text_color = (200, 230, 255)
-
-class Display:
-    def __init__(self, cmd_queue, display_queue):
-        pygame.init()
-        self.screen = pygame.display.set_mode((window_width, window_height))  #screen creation
-        pygame.display.set_caption("circle of life") #screen title
-        self.clock = pygame.time.Clock()
-        self.running = True
-        
-        #queues for comm
-        self.cmd_queue = cmd_queue #sending the comms to env
-        self.display_queue = display_queue  #receiving frames from env
-        
-        #actual state of the game
-        self.grid_data = bytes([env.empty] * env.number_bytes)
-        self.counts = {'grass': 0, 'passive_prey': 0, 'active_prey': 0, 'predator': 0} #counter
-        self.raining = False
-        self.drought = False
-        
-        #fonts definition
-        self.font = pygame.font.SysFont("Times New Roman", 16, bold=True)
-        self.font_small = pygame.font.SysFont("Times New Roman", 14)
-        
-        #loading the assets
-        self.images = {}
-        self.load_asset(env.grass, "grass.png", (34, 139, 34))
-        self.load_asset(env.passive_prey, "prey.png", (200, 200, 200))
-        self.load_asset(env.active_prey, "prey_active.png", (255, 255, 0))
-        self.load_asset(env.predator, "predator.png", (220, 20, 60))
-
-    def load_asset(self, key, path, color):
-        """load image or create colored squares if it doesn"t load as expected"""
-        try:
-            img = pygame.image.load(path) #loading img into memory
-            self.images[key] = pygame.transform.scale(img, (env.cell_size, env.cell_size)) #resizing the image to the actual size of the cells + saving
-        except:
-            surf = pygame.Surface((env.cell_size, env.cell_size))
-            surf.fill(color)
-            pygame.draw.rect(surf, (0, 0, 0), surf.get_rect(), 1) #drawing a border in black
-            self.images[key] = surf #saving
-
-    def run(self):
-        """main display loop"""
-        print("<DISPLAY> starting...")
-        
-        while self.running:
-            #handling events
-            for event in pygame.event.get(): #events : mouse click or pressing some keys
-                if event.type == pygame.QUIT:
-                    self.running = False
-                    self.cmd_queue.put("quit") #stopping the simulation
-                
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE:
-                        self.running = False
-                        self.cmd_queue.put("quit")
-                    
-                    elif event.key == pygame.K_SPACE:
-                        #drought on/off
-                        self.cmd_queue.put("drought")
-                    
-                    elif event.key == pygame.K_r:
-                        #rain on/off
-                        self.cmd_queue.put("rain")
-            
-            #updating the data on the display
-            try:
-                while True:
-                    frame_latest = self.display_queue.get_nowait() #get item: if empty-> it crashes
-                    self.grid_data = frame_latest['grid'] #updating data (no previous crash)
-                    self.counts = frame_latest['counts']
-                    self.raining = frame_latest['raining']
-                    self.drought = frame_latest['drought']
-            except Empty: #if the crash was cause by an empty queue
-                pass #we continue
-
-            #drawing
-            self.draw_grid()
-            self.draw_ui()
-            
-            pygame.display.flip() #flipping the buffer: taking everything in the buffer and showing it onto the screen
-            self.clock.tick(FPS) #if loop is fast, we cap the execution with a delay
-
-        pygame.quit()
-
-    def draw_grid(self):
-        """drawing the grid"""
-        self.screen.fill(bg_color) #filling with background color
-        
-        for i in range(env.number_bytes):
-            val = self.grid_data[i] #wholives there
-
-            #calculating 2D position with 1D
-            x = (i % env.tab_size) * env.cell_size
-            y = (i // env.tab_size) * env.cell_size
-
-            #drawing
-            if val in self.images:
-                self.screen.blit(self.images[val], (x, y))
-            
-            #grid lines
-            pygame.draw.rect(self.screen, grid_color, (x, y, env.cell_size, env.cell_size), 1) #1 is thickness
-
-    def draw_ui(self):
-        """drawing the status panel"""
-        y_offset = env.tab_size * env.cell_size #starting position for the panel, where the grid ends
-        
-        #filling with background color
-        pygame.draw.rect(self.screen, (20, 20, 20), (0, y_offset, window_width, 100))
-        
-        if self.drought:
-            status_text = "status: drought -> no grass growth right now"
-            status_color = (255, 100, 100)
-        elif self.raining:
-            status_text = "status: raining -> fast grass growth"
-            status_color = (100, 200, 255)
-        else:
-            status_text = "status: normal"
-            status_color = (200, 255, 200)
-        
-        surf_status = self.font.render(status_text, True, status_color) #rendering the text
-        self.screen.blit(surf_status, (10, y_offset + 10)) #pushing the text-image
-        
-        #counting
-        total_prey = self.counts['passive_prey'] + self.counts['active_prey']
-        pop_text = (f"grass: {self.counts['grass']}  |  " f"prey: {total_prey}  |  " f"predators: {self.counts['predator']}")
-        surf_pop = self.font_small.render(pop_text, True, (200, 200, 200))
-        self.screen.blit(surf_pop, (10, y_offset + 40))
-        
-        # Controls
-        controls = "<SPACE> toggle drought  |  <R> toggle rain  |  <ESC> QUIT"
-        surf_controls = self.font_small.render(controls, True, (150, 150, 150))
-        self.screen.blit(surf_controls, (10, y_offset + 65))
-
-
-def main(): 
-    print("Circle game")
-    print("-" * 40)
-    print()
-
-    #sync
-    grid_lock = multiprocessing.Lock() #mutual exclusion lock creation
-    cmd_queue = multiprocessing.Queue() # display-> env
-    display_queue = multiprocessing.Queue()  # env ->display
-
-    #env process
-    env_proc = env.EnvProcess(grid_lock) #lock to env
-    p_env = multiprocessing.Process(target=env_proc.run, args=(cmd_queue, display_queue), daemon=True) #daemon=True for child process, ends when parent process ends
-    p_env.start()
-    
-    #waiting for shared_mem
-    time.sleep(1)
-
-    #initial population
-    print("spawning initial population...")
-    procs = []
-    
-    #preys
-    for _ in range(20):
-        p = multiprocessing.Process(target=animals.run_animal, args=(env.passive_prey, grid_lock), daemon=True)
-        p.start()
-        procs.append(p)
-
-    #predators
-    for _ in range(6):
-        p = multiprocessing.Process(target=animals.run_animal, args=(env.predator, grid_lock), daemon=True)
-        p.start()
-        procs.append(p)
-
-    print(f"started {len(procs)} animals")
-    print("\ndisplay charging...")
-
-    #running display in the main process(required by pygame)
-    display = Display(cmd_queue, display_queue)
-    try:
-        display.run() #staying here until player quits
-    
-    except KeyboardInterrupt:
-        pass
+import protocol
+from grid import open_grid
+from neighbourhood import Neighbourhood
+from stats import StatsPage, TimedLock, stats_name
+from table import AnimalTable, table_name
+
+
+#moves: up, down, left, right
+moves = [(0, -1), (0, 1), (-1, 0), (1, 0)]
+
 
+def ask_spawn_position(kind):
+    """asking env for a free cell (env puts us on it), None if the spawn is refused"""
+    try:
+        with protocol.Client() as client:
+            status, positions = client.spawn(kind, 1)
+    except (OSError, protocol.ProtocolError):
+        return None
+    return positions[0] if positions else None
+
+
+def neighbour(pos, width, height):
+    """random neighbour cell of pos, pos itself when walking into a wall"""
+    dx, dy = random.choice(moves)
+    x = pos % width + dx
+    y = pos // width + dy
+    if 0 <= x < width and 0 <= y < height:
+        return y * width + x
+    return pos
+
+
+class World:
+    """what an animal process works on: the grid, the animal table and its stats row, attached once
+    (a pooled worker keeps them from one animal to the next, see supervisor.py)"""
+
+    def __init__(self, grid_lock, stopping=None):
+        self.stopping = stopping #multiprocessing.Event of the worker pool: the animal leaves between two ticks
+        self.shared = open_grid(env.shared_mem_name) #shape and layout come from the segment header
+        self.table = AnimalTable(table_name(env.shared_mem_name)) #our record: energy, age (env clamps the energy)
+        self.page = StatsPage(stats_name(env.shared_mem_name))
+        self.stats = self.page.claim("animal") #None once every row is taken: no timing then
+        self.lock = grid_lock if self.stats is None else TimedLock(grid_lock, self.stats)
+        self.sight = Neighbourhood(self.shared.width, self.shared.height, env.sense_radius)
+
+    def close(self):
+        self.stats = self.lock = None
+        self.table.close()
+        self.page.close()
+        self.shared.close()
+
+
+def run_animal(kind, grid_lock, birth_queue=None, start_pos=None, settings=None):
+    """one animal = one process living on the shared grid, env (or the parent) already put it on its cell.
+    grid_lock is a locks.StripedLock, each step only locks the bands it touches.
+    settings: env.configured, a forkserver child does not inherit them"""
+    if settings:
+        env.configure(**settings)
+    if start_pos is None:
+        pos = ask_spawn_position(kind)
+        if pos is None:
+            return
+    else:
+        pos = start_pos
+
+    world = World(grid_lock)
+    try:
+        live(world, kind, pos, birth_queue)
     finally:
-        print("\nshutting down the game and cleaning...")
-        p_env.terminate()
-        for p in procs:
-            if p.is_alive():
-                p.terminate()
-        
-        #cleanup
-        try:
-            s = shared_memory.SharedMemory(name=env.shared_mem_name)
-            s.close()
-            s.unlink()
-        except:
-            pass
-        print("cleanup complete")
-        sys.exit()
-
-
-if __name__ == "__main__":
-    main()
+        world.close()
+
+
+def live(world, kind, pos, birth_queue=None):
+    """the life of one animal standing on pos, returns when it dies (starved or eaten) or the pool stops.
+    births go to birth_queue as ("birth", kind, cell, id, time.monotonic()), the newborn already placed"""
+    shared, table, grid_lock, sight = world.shared, world.table, world.lock, world.sight
+    grid = shared.buf
+    prey = kind == env.passive_prey
+    mine = (env.passive_prey, env.active_prey) if prey else (env.predator,)
+    food = env.grass if prey else env.active_prey
+
+    with grid_lock.cells(pos):
+        if grid[pos] not in mine: #eaten before being born (env frees the record)
+            return
+        slot = int(table.index[pos]) #written by whoever placed us
+        if slot < 0: #placed by a protocol client
+            slot = int(table.allocate([pos], kind, env.energy_start)[0])
+            if slot < 0: #table full: the animal leaves the grid before living
+                shared.set(pos, env.empty)
+                return
+        ident = int(table.id[slot])
+
+    while True:
+        time.sleep(env.animal_tick)
+        if world.stopping is not None and world.stopping.is_set(): #left on its cell, holding no lock
+            return
+        energy = float(table.energy[slot]) - env.cost_move
+
+        #the move is drawn first so only the bands of both cells get locked
+        target = neighbour(pos, shared.width, shared.height)
+        if energy < env.h_lim: #hungry: heading for the nearest food in sight (read without the lock, checked below)
+            found = sight.nearest(shared.cells, [pos], food)
+            if found[0] >= 0:
+                step_x, step_y = sight.step_towards([pos], found)
+                target = pos + int(step_y[0]) * shared.width + int(step_x[0])
+        with grid_lock.cells(pos, target):
+            if grid[pos] not in mine or table.id[slot] != ident: #a predator took our cell
+                return
+            if energy <= 0:
+                shared.set(pos, env.empty)
+                table.release([slot])
+                return
+
+            wanted = grid[target]
+
+            #food on the way is eaten, hungry or not. a band with no record left for us is not entered
+            if target != pos and (wanted == env.empty or wanted == food) and table.can_move(pos, target):
+                old = pos
+                pos = target
+                shared.set(old, env.empty)
+                slot = table.move(slot, old, pos)
+                if wanted == food:
+                    energy = min(energy + env.food_gain, env.energy_max)
+
+                #reproduction: the newborn takes the cell we just left
+                if energy > env.r_lim and birth_queue is not None and table.room([old])[0]:
+                    energy -= env.energy_start
+                    shared.set(old, kind)
+                    born = int(table.allocate([old], kind, env.energy_start)[0])
+                    birth_queue.put(("birth", kind, old, int(table.id[born]), time.monotonic()))
+
+            table.energy[slot] = energy
+            table.age[slot] += 1
+            if prey and energy < env.h_lim:
+                shared.set(pos, env.active_prey)
+            else:
+                shared.set(pos, kind)
+
+
+def spawn_population(kind, n, supervisor):
+    """n animals placed by env in one request on a single connection, then handed to the worker pool"""
+    try:
+        with protocol.Client() as client:
+            status, positions = client.spawn(kind, n)
+    except (OSError, protocol.ProtocolError) as e:
+        print(f"<ANIMALS> spawn refused: {e}")
+        return 0
+    for pos in positions:
+        supervisor.place(kind, pos)
+    return len(positions)
+
+
+def adopt_population(grid_lock, supervisor):
+    """a worker for every animal already on the grid (resumed from a checkpoint)"""
+    shared = open_grid(env.shared_mem_name)
+    with grid_lock:
+        found = [(pos, code) for pos, code in enumerate(shared.buf) if code in (env.passive_prey, env.active_prey, env.predator)]
+    shared.close()
+    for pos, code in found:
+        supervisor.place(env.predator if code == env.predator else env.passive_prey, pos)
+    return len(found)
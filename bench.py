@@ -0,0 +1,329 @@
+from contextlib import redirect_stdout
+import multiprocessing
+import subprocess
+import argparse
+import resource
+import random
+import json
+import time
+import sys
+import io
+import os
+import env
+import animals
+import headless
+import supervisor
+import main as game
+import numpy as np
+from grid import SharedGrid, PackedGrid
+from frames import FrameRing, frames_name
+from locks import StripedLock
+from stats import TimedLock
+
+
+#default matrix stays small for CI, --full goes up to 2000x2000 and 100k animals
+sizes = [20, 200]
+populations = [26, 1000]
+full_sizes = [20, 200, 1000, 2000]
+full_populations = [26, 1000, 10000, 100000]
+
+
+def percentile(values, p):
+    """p-th percentile of a list, 0 if empty"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench_case(case):
+    """one grid size / population in a fresh process, so the peak rss is its own"""
+    size, population, seconds, packed = case
+    env.configure(shared_mem_name=f"CircleBench{os.getpid()}", PORT=0) #PORT 0: any free port
+
+    preys = population * 20 // 26
+    lock = TimedLock(StripedLock(size, size, 1), samples=True) #env adds its stats row to it
+    env_proc = env.EnvProcess(lock, "batch", preys, population - preys, size, size)
+    env_proc.realtime = False
+    env_proc.packed = packed
+
+    try:
+        setup_start = time.perf_counter()
+        env_proc.create_grid()
+        env_proc.listen()
+        setup_time = time.perf_counter() - setup_start
+
+        #ticks: the whole env loop
+        lock.waits.clear()
+        lock.holds.clear()
+        start = time.perf_counter()
+        env_proc.loop(None, max_seconds=seconds)
+        tick_time = time.perf_counter() - start
+        ticks = env_proc.ticks #the frames below tick too
+        holds = list(lock.holds)
+        waits = list(lock.waits)
+
+        #frames: one tick between two frames so each carries a real delta, only send_frame timed
+        built = 0
+        frame_time = 0.0
+        end = time.perf_counter() + seconds / 2
+        while built == 0 or time.perf_counter() < end:
+            env_proc.tick()
+            start = time.perf_counter()
+            env_proc.send_frame()
+            frame_time += time.perf_counter() - start
+            built += 1
+        animals_end = env_proc.engine.count
+    finally:
+        env_proc.cleanup()
+
+    return {
+        'size': f"{size}x{size}",
+        'population': population,
+        'setup_s': round(setup_time, 4),
+        'ticks_per_s': round(ticks / tick_time, 1),
+        'frames_per_s': round(built / frame_time, 1),
+        'lock_hold_mean_ms': round(1000 * sum(holds) / max(len(holds), 1), 4),
+        'lock_hold_p99_ms': round(1000 * percentile(holds, 99), 4),
+        'lock_hold_max_ms': round(1000 * max(holds, default=0.0), 4),
+        'lock_wait_mean_ms': round(1000 * sum(waits) / max(len(waits), 1), 4),
+        'animals_end': animals_end,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def lock_worker(name, grid_lock, seconds, seed, results):
+    """one animal-like writer: random moves, each under the locks of the two cells only"""
+    grid = SharedGrid(name)
+    rng = random.Random(seed)
+    moves = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pos = rng.randrange(grid.size)
+        target = animals.neighbour(pos, grid.width, grid.height)
+        with grid_lock.cells(pos, target):
+            here = grid.buf[pos]
+            there = grid.buf[target]
+            grid.set(pos, there)
+            grid.set(target, here)
+        moves += 1
+    grid.close()
+    results.put(moves)
+
+
+def bench_locks(size, workers, stripes, seconds):
+    """moves per second for this many writer processes sharing this many stripes"""
+    name = f"CircleLocks{os.getpid()}"
+    grid_lock = StripedLock(size, size, stripes)
+    grid = SharedGrid(name, size, size, create=True, n_bands=grid_lock.n_stripes)
+    try:
+        filled = random.sample(range(grid.size), grid.size // 3)
+        grid.set_many(filled, env.grass)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=lock_worker, args=(name, grid_lock, seconds, seed, results)) for seed in range(workers)]
+        for p in procs:
+            p.start()
+        moves = sum(results.get() for _ in procs)
+        for p in procs:
+            p.join()
+    finally:
+        grid.close()
+        grid.unlink()
+    return moves / seconds
+
+
+def main_locks(args):
+    """global lock vs striped locks from 1 to N writer processes"""
+    max_workers = args.workers or os.cpu_count() or 1
+    size = (args.sizes or [200])[0]
+    counts = sorted({2 ** i for i in range(max_workers.bit_length()) if 2 ** i <= max_workers} | {max_workers})
+    print(f"grid {size}x{size}, {args.stripes} stripes, {os.cpu_count()} cores")
+    print(f"{'workers':>8}  {'global moves/s':>15}  {'striped moves/s':>16}  {'speedup':>8}")
+    for workers in counts:
+        single = bench_locks(size, workers, 1, args.seconds)
+        striped = bench_locks(size, workers, args.stripes, args.seconds)
+        print(f"{workers:>8}  {single:>15.0f}  {striped:>16.0f}  {striped / single:>8.2f}")
+        if args.json:
+            with open(args.json, "a") as f:
+                f.write(json.dumps({'bench': 'locks', 'size': size, 'workers': workers, 'stripes': args.stripes, 'global_moves_per_s': round(single), 'striped_moves_per_s': round(striped), 'timestamp': time.time()}) + "\n")
+
+
+def timed(function, seconds):
+    """mean seconds per call of function, called for about seconds (after a first call, caches warm)"""
+    function()
+    calls = 0
+    start = time.perf_counter()
+    while calls == 0 or time.perf_counter() - start < seconds:
+        function()
+        calls += 1
+    return (time.perf_counter() - start) / calls
+
+
+def bench_layout(size, population, seconds, packed):
+    """the grid operations of a tick on one layout, same random grid for both: microseconds per call"""
+    name = f"CircleLayout{os.getpid()}"
+    grid = (PackedGrid if packed else SharedGrid)(name, size, size, create=True)
+    rng = np.random.default_rng(0)
+    try:
+        codes = rng.choice([env.empty, env.grass], grid.size, p=[0.7, 0.3]).astype(np.uint8)
+        codes[rng.choice(grid.size, population, replace=False)] = rng.choice([env.passive_prey, env.predator], population)
+        grid.load(codes)
+        positions = np.sort(rng.choice(grid.size, population, replace=False))
+        values = grid.cells[positions]
+        each = seconds / 6
+        return {
+            'layout': "packed" if packed else "bytes",
+            'size': f"{size}x{size}",
+            'segment_mb': round(grid.shm.size / 2 ** 20, 3),
+            'snapshot_mb': round(grid.capture().nbytes / 2 ** 20, 3),
+            'counts_us': round(1e6 * timed(grid.counts, each), 1),
+            'gather_us': round(1e6 * timed(lambda: grid.cells[positions], each), 1),
+            'set_many_us': round(1e6 * timed(lambda: grid.set_many(positions, values), each), 1),
+            'empty_us': round(1e6 * timed(lambda: grid.where(env.empty), each), 1),
+            'neighbours_us': round(1e6 * timed(lambda: grid.neighbours(env.grass), each), 1),
+            'decode_us': round(1e6 * timed(lambda: np.array(grid.snapshot()), each), 1),
+        }
+    finally:
+        grid.close()
+        grid.unlink()
+
+
+def main_layouts(args):
+    """byte per cell vs bit planes: grid operations, then the whole batch engine"""
+    bench_sizes = args.sizes or (full_sizes if args.full else sizes)
+    population = (args.populations or [1000])[0]
+    columns = ['layout', 'size', 'segment_mb', 'snapshot_mb', 'counts_us', 'gather_us', 'set_many_us', 'empty_us', 'neighbours_us', 'decode_us', 'ticks_per_s', 'frames_per_s']
+    print(f"{population} animals (moves: set_many of {population} cells)")
+    print("  ".join(f"{c:>13}" for c in columns))
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for size in bench_sizes:
+            n = min(population, size * size // 2)
+            for packed in (False, True):
+                result = bench_layout(size, n, args.seconds, packed)
+                ticks = pool.apply(bench_case, ((size, n, args.seconds, packed),))
+                result.update(population=n, ticks_per_s=ticks['ticks_per_s'], frames_per_s=ticks['frames_per_s'])
+                print("  ".join(f"{str(result[c]):>13}" for c in columns))
+                if args.json:
+                    result['bench'] = 'layouts'
+                    result['timestamp'] = time.time()
+                    with open(args.json, "a") as f:
+                        f.write(json.dumps(result) + "\n")
+
+
+def bench_startup(engine, start_method, population):
+    """launch to first frame, the way main.py starts (display excepted). default segment names and port:
+    forkserver children don't see module settings, nothing else may run meanwhile"""
+    preys = population * 20 // 26
+    args = game.parse_args(["--engine", engine, "--start-method", start_method, "--preys", str(preys), "--predators", str(population - preys), "--width", "100", "--height", "100"])
+    game.launch_time = time.monotonic()
+    sim = game.Simulation(args)
+    try:
+        if not sim.start():
+            return None
+        frames = FrameRing(frames_name(env.shared_mem_name))
+        while frames.read() is None:
+            time.sleep(0.001)
+        first_frame = time.monotonic() - game.launch_time
+        frames.close()
+    finally:
+        sim.stop()
+    return {'engine': engine, 'start_method': start_method, 'population': population, 'env_ready_s': round(sim.env_ready, 3), 'animals_started_s': round(sim.populated, 3), 'first_frame_s': round(first_frame, 3)}
+
+
+def main_startup(args):
+    """startup time of each engine and start method"""
+    #what every worker paid when it imported the display modules
+    command = "import time; start = time.perf_counter(); import pygame; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", command], capture_output=True, text=True, env=dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT="1"))
+    if result.returncode == 0:
+        print(f"import pygame: {float(result.stdout.split()[-1]):.3f}s per process importing it")
+
+    population = (args.populations or [26])[0]
+    columns = ['engine', 'start_method', 'population', 'env_ready_s', 'animals_started_s', 'first_frame_s']
+    print("  ".join(f"{c:>17}" for c in columns))
+    for engine in ("batch", "process"):
+        for start_method in ("fork", "forkserver"):
+            result = bench_startup(engine, start_method, population)
+            if result is None:
+                print(f"{engine} ({start_method}): env did not start")
+                continue
+            print("  ".join(f"{str(result[c]):>17}" for c in columns))
+            if args.json:
+                result['bench'] = 'startup'
+                result['timestamp'] = time.time()
+                with open(args.json, "a") as f:
+                    f.write(json.dumps(result) + "\n")
+
+
+def bench_births(spare, lives, seconds):
+    """birth latency of the process engine through a prey boom (low r_lim), in this process: a daemon pool
+    process could not start the animal workers"""
+    env.configure(shared_mem_name=f"CircleBench{os.getpid()}", PORT=0, r_lim=12, energy_start=5)
+    with redirect_stdout(io.StringIO()):
+        summary = headless.run_headless("process", 20, 6, seconds=seconds, realtime=True, width=30, height=30, stripes=4, seed=1, spare_workers=spare, worker_lives=lives)
+    return summary['births']
+
+
+def main_births(args):
+    """worker pool against a fresh process per animal (no spare worker, one life each: spawn per birth)"""
+    columns = ['mode', 'births', 'mean_ms', 'p99_ms', 'max_ms', 'waited']
+    print("  ".join(f"{c:>16}" for c in columns))
+    for mode, spare, lives in (("spawn per birth", 0, 1), ("pool", supervisor.default_spare, supervisor.default_max_lives)):
+        result = bench_births(spare, lives, max(args.seconds, 5.0))
+        result['mode'] = mode
+        print("  ".join(f"{str(result[c]):>16}" for c in columns))
+        if args.json:
+            result['bench'] = 'births'
+            result['timestamp'] = time.time()
+            with open(args.json, "a") as f:
+                f.write(json.dumps(result) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tick throughput benchmark (headless, batch engine)")
+    parser.add_argument("--full", action="store_true", help="grids up to 2000x2000 and populations up to 100k")
+    parser.add_argument("--sizes", type=int, nargs="+", default=None, help="grid sides to bench")
+    parser.add_argument("--populations", type=int, nargs="+", default=None, help="populations to bench")
+    parser.add_argument("--seconds", type=float, default=2.0, help="time spent on each measure")
+    parser.add_argument("--json", default=None, help="append results to this file as json lines")
+    parser.add_argument("--locks", action="store_true", help="lock scaling instead: global lock vs striped locks, 1 to N writer processes")
+    parser.add_argument("--workers", type=int, default=None, help="max writer processes for --locks (default: cores)")
+    parser.add_argument("--stripes", type=int, default=64, help="stripes for --locks")
+    parser.add_argument("--startup", action="store_true", help="startup time instead: launch to env ready, animals started and first frame")
+    parser.add_argument("--layouts", action="store_true", help="grid layouts instead: one byte per cell vs bit planes (--packed), grid operations and ticks")
+    parser.add_argument("--births", action="store_true", help="birth latency of the process engine instead: worker pool vs spawn per birth")
+    args = parser.parse_args()
+
+    if args.locks:
+        main_locks(args)
+        return
+    if args.startup:
+        main_startup(args)
+        return
+    if args.layouts:
+        main_layouts(args)
+        return
+    if args.births:
+        main_births(args)
+        return
+
+    bench_sizes = args.sizes or (full_sizes if args.full else sizes)
+    bench_populations = args.populations or (full_populations if args.full else populations)
+
+    #populations that don't fit (more than half the cells) are skipped
+    cases = [(s, p, args.seconds, False) for s in bench_sizes for p in bench_populations if p <= s * s // 2]
+
+    columns = ['size', 'population', 'setup_s', 'ticks_per_s', 'frames_per_s', 'lock_hold_mean_ms', 'lock_hold_p99_ms', 'lock_hold_max_ms', 'lock_wait_mean_ms', 'animals_end', 'peak_rss_mb']
+    print("  ".join(f"{c:>17}" for c in columns))
+
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(bench_case, cases):
+            print("  ".join(f"{str(result[c]):>17}" for c in columns))
+            if args.json:
+                result['timestamp'] = time.time()
+                with open(args.json, "a") as f:
+                    f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import selectors
+import socket
+import struct
+import zlib
+import numpy as np
+from frames import Frame, count_names
+
+
+#frames streamed by env to remote viewers over tcp
+#  on connect the server sends: magic, version, width, height
+#  then frames: header (payload size, kind, sequence number, counts, raining, drought) + payload
+#  keyframe payload: the whole grid, zlib compressed
+#  delta payload: positions (uint32) then values (uint8) of the cells changed since the previous sequence number
+#each client holds at most one frame in flight: a frame published while the previous one is still being
+#sent is dropped for that client, which gets a keyframe once it catches up. env never waits on a viewer
+magic = b"CBRD"
+version = 1
+hello = struct.Struct("<4sHII")
+frame_header = struct.Struct("<IBQ4qBB")
+keyframe = 0
+delta = 1
+max_payload = 1 << 30
+send_buffer = 65536 #kernel buffer of a viewer socket: a bigger one would queue stale frames for slow viewers
+
+
+def parse_address(text, host="localhost"):
+    """"host:port" or "port" -> (host, port)"""
+    if ":" in text:
+        host, port = text.rsplit(":", 1)
+        return host, int(port)
+    return host, int(text)
+
+
+class Viewer:
+    """server side of one remote viewer"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.outbox = bytearray()
+        self.seq = 0 #last frame queued for it
+        self.dropped = 0
+
+    def flush(self):
+        """sending what the socket takes, True once everything is gone"""
+        while self.outbox:
+            try:
+                sent = self.sock.send(self.outbox)
+            except BlockingIOError:
+                return False
+            del self.outbox[:sent]
+        return True
+
+
+class BroadcastServer:
+    """env side: accepts viewers and sends every published frame to the ones keeping up"""
+
+    def __init__(self, host, port, width, height):
+        self.hello = hello.pack(magic, version, width, height)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(16)
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        self.viewers = {} #socket -> Viewer
+        self.selector = None
+        self.dropped = 0 #frames not sent to a slow viewer
+        self.sent = 0
+        self.seq = 0 #latest frame published
+
+    def attach(self, selector):
+        """env's selector, the data of each key is (stats metric, callback) like env's own sockets"""
+        self.selector = selector
+        selector.register(self.sock, selectors.EVENT_READ, ('accept', self.accept))
+
+    def detach(self):
+        """the selector is going away: viewers are dropped, frames are not sent anymore"""
+        for conn in list(self.viewers):
+            self.drop(conn)
+        self.selector.unregister(self.sock)
+        self.selector = None
+
+    def accept(self):
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except BlockingIOError:
+                return
+            conn.setblocking(False)
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+            viewer = self.viewers[conn] = Viewer(conn)
+            viewer.outbox += self.hello
+            self.selector.register(conn, selectors.EVENT_READ, ('broadcast', lambda conn=conn: self.service(conn)))
+            self.send(viewer)
+            print(f"<BROADCAST> viewer connected from {addr[0]}:{addr[1]}")
+
+    def service(self, conn):
+        """a viewer socket is readable (closed, viewers send nothing) or writable (finishing a frame)"""
+        viewer = self.viewers.get(conn)
+        if viewer is None:
+            return
+        try:
+            if conn.recv(4096) == b"":
+                self.drop(conn)
+                return
+        except BlockingIOError:
+            pass
+        except ConnectionError:
+            self.drop(conn)
+            return
+        self.send(viewer)
+
+    def send(self, viewer):
+        """pushing the viewer's pending bytes, watching the socket for writability while some are left"""
+        try:
+            done = viewer.flush()
+        except (ConnectionError, OSError):
+            self.drop(viewer.sock)
+            return
+        events = selectors.EVENT_READ if done else selectors.EVENT_READ | selectors.EVENT_WRITE
+        key = self.selector.get_key(viewer.sock)
+        if key.events != events:
+            self.selector.modify(viewer.sock, events, key.data)
+
+    def drop(self, conn):
+        self.selector.unregister(conn)
+        del self.viewers[conn]
+        conn.close()
+
+    def publish(self, seq, cells, changed, counts, raining, drought):
+        """one frame for every viewer keeping up. cells: the published grid, changed: the positions that
+        changed since frame seq - 1 (None for a keyframe). each payload is encoded once, when first needed"""
+        self.seq = seq
+        if not self.viewers or self.selector is None:
+            return
+        key_msg = delta_msg = None
+        meta = (seq, *counts, raining, drought)
+        for viewer in list(self.viewers.values()):
+            if viewer.outbox: #still busy with an older frame, latest frame wins
+                viewer.dropped += 1
+                self.dropped += 1
+                continue
+            if changed is not None and viewer.seq == seq - 1:
+                if delta_msg is None:
+                    payload = changed.astype("<u4").tobytes() + cells[changed].tobytes()
+                    delta_msg = frame_header.pack(len(payload), delta, *meta) + payload
+                viewer.outbox += delta_msg
+            else:
+                if key_msg is None:
+                    payload = zlib.compress(np.ascontiguousarray(cells).tobytes(), 1)
+                    key_msg = frame_header.pack(len(payload), keyframe, *meta) + payload
+                viewer.outbox += key_msg
+            viewer.seq = seq
+            self.sent += 1
+            self.send(viewer)
+
+    def behind(self):
+        """some viewer was not sent the latest frame (just connected, or dropping frames)"""
+        return any(viewer.seq != self.seq for viewer in self.viewers.values())
+
+    def close(self):
+        for conn in list(self.viewers):
+            conn.close()
+        self.viewers = {}
+        self.sock.close()
+
+
+class FrameClient:
+    """viewer side: frames of a remote env, read like a frames.FrameRing"""
+
+    def __init__(self, host, port, timeout=5.0):
+        self.address = f"{host}:{port}"
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        data = b""
+        while len(data) < hello.size:
+            chunk = self.sock.recv(hello.size - len(data))
+            if not chunk:
+                raise ConnectionError(f"{self.address} closed the connection")
+            data += chunk
+        found, found_version, self.width, self.height = hello.unpack(data)
+        if found != magic:
+            raise ValueError(f"{self.address} is not a circle broadcast server")
+        if found_version != version:
+            raise ValueError(f"{self.address}: broadcast version {found_version}, expected {version}")
+        self.sock.setblocking(False)
+        self.inbox = bytearray()
+        self.cells = np.zeros(self.width * self.height, dtype=np.uint8)
+        self.changed = [] #positions applied since the last frame handed out, None: the whole grid
+        self.last_seq = 0
+        self.skipped = 0 #dropped by the server, or received behind a newer one
+        self.torn = 0
+        self.connected = True
+
+    def read(self):
+        """the latest frame if new ones arrived, None otherwise"""
+        while self.connected:
+            try:
+                data = self.sock.recv(1 << 20)
+            except BlockingIOError:
+                break
+            except ConnectionError:
+                data = b""
+            if not data:
+                self.connected = False
+                break
+            self.inbox += data
+
+        latest = None
+        offset = 0
+        while len(self.inbox) - offset >= frame_header.size:
+            size, kind, seq, grass, passive, active, predator, raining, drought = frame_header.unpack_from(self.inbox, offset)
+            if size > max_payload:
+                raise ValueError(f"{self.address}: frame of {size} bytes")
+            start = offset + frame_header.size
+            if len(self.inbox) - start < size:
+                break
+            payload = bytes(self.inbox[start:start + size])
+            if kind == keyframe:
+                self.cells[:] = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+                self.changed = None
+            else:
+                n = size // 5
+                positions = np.frombuffer(payload, dtype="<u4", count=n)
+                self.cells[positions] = np.frombuffer(payload, dtype=np.uint8, offset=4 * n)
+                if self.changed is not None:
+                    self.changed.append(positions)
+            if self.last_seq:
+                self.skipped += seq - self.last_seq - 1
+            if latest is not None:
+                self.skipped += 1 #applied, never shown
+            self.last_seq = seq
+            latest = (dict(zip(count_names, (grass, passive, active, predator))), bool(raining), bool(drought))
+            offset = start + size
+        del self.inbox[:offset]
+
+        if latest is None:
+            return None
+        changed = self.changed
+        if changed is not None:
+            changed = changed[0] if len(changed) == 1 else np.concatenate(changed) if changed else np.zeros(0, dtype=np.uint32)
+        self.changed = []
+        return Frame(self.last_seq, self.cells, changed, *latest)
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,169 @@
+import threading
+import pickle
+import struct
+import mmap
+import time
+import os
+import numpy as np
+
+
+#file layout (memory mapped):
+#  header (64 bytes): magic, version, width, height, latest complete slot (-1: none)
+#  two slots, written in turn so a crash in the middle of a checkpoint keeps the previous one:
+#    meta (64 bytes): generation, env tick, size of the state, seconds since epoch
+#    cells, padded to a whole chunk
+#    state: pickled dict (weather, tick, random states, animals), room reserved for one animal per cell
+#version 2: animals saved with their id and age (engine.snapshot_dtypes), more room for the state
+#a checkpoint only writes the chunks of cells that differ from what the slot already holds
+magic = b"CCKP"
+version = 2
+header_format = "<4sIIIq" #latest at offset 16
+latest_offset = 16
+meta_format = "<qqqd"
+chunk = 65536 #bytes, a multiple of the page size so dirty chunks can be flushed alone
+extra_state = 1 << 20 #random states and weather
+
+
+def padded(n, to=chunk):
+    return (n + to - 1) // to * to
+
+
+def animal_bytes():
+    """bytes of one animal in the state, from the arrays of a batch engine snapshot"""
+    from engine import snapshot_dtypes
+    return sum(np.dtype(dtype).itemsize for dtype in snapshot_dtypes.values())
+
+
+def layout(width, height):
+    """offset of each slot, cells and state offsets inside a slot, state capacity, total size"""
+    size = width * height
+    cells_offset = chunk #meta then cells, chunk aligned
+    state_offset = cells_offset + padded(size)
+    state_capacity = padded(animal_bytes() * size + extra_state)
+    slot_size = state_offset + state_capacity
+    slots = [chunk, chunk + slot_size]
+    return slots, cells_offset, state_offset, state_capacity, chunk + 2 * slot_size
+
+
+def shape(path):
+    """grid width and height of a checkpoint file"""
+    with open(path, "rb") as f:
+        found, file_version, width, height, latest = struct.unpack(header_format, f.read(struct.calcsize(header_format)))
+    if found != magic:
+        raise ValueError(f"{path} is not a circle checkpoint")
+    if file_version != version:
+        raise ValueError(f"{path}: checkpoint version {file_version}, expected {version}")
+    return width, height
+
+
+def load(path):
+    """the last complete checkpoint: (cells, state), None if the file holds none"""
+    width, height = shape(path)
+    slots, cells_offset, state_offset, state_capacity, total = layout(width, height)
+    with open(path, "rb") as f:
+        f.seek(latest_offset)
+        latest = struct.unpack("<q", f.read(8))[0]
+        if latest < 0:
+            return None
+        f.seek(slots[latest])
+        generation, tick, state_size, saved_at = struct.unpack(meta_format, f.read(struct.calcsize(meta_format)))
+        f.seek(slots[latest] + cells_offset)
+        cells = np.frombuffer(f.read(width * height), dtype=np.uint8).copy()
+        f.seek(slots[latest] + state_offset)
+        state = pickle.loads(f.read(state_size))
+    print(f"<CHECKPOINT> loaded generation {generation} (tick {tick}) from {path}")
+    return cells, state
+
+
+class Checkpointer:
+    """env side: the grid copy is taken by the caller under the lock (a memcpy), the diff against the file,
+    the writes and the flushes happen in a background thread while the simulation goes on"""
+
+    def __init__(self, path, width, height):
+        self.path = path
+        self.size = width * height
+        self.slots, self.cells_offset, self.state_offset, self.state_capacity, total = layout(width, height)
+
+        reuse = False
+        if os.path.exists(path):
+            try:
+                reuse = shape(path) == (width, height) and os.path.getsize(path) == total
+            except (ValueError, struct.error):
+                reuse = False
+        self.file = open(path, "r+b" if reuse else "w+b")
+        if not reuse:
+            self.file.truncate(total) #sparse, the state room costs nothing until used
+            self.file.write(struct.pack(header_format, magic, version, width, height, -1))
+            self.file.flush()
+        self.mm = mmap.mmap(self.file.fileno(), total)
+        self.latest = struct.unpack_from("<q", self.mm, latest_offset)[0]
+        self.generation = 0
+        if self.latest >= 0:
+            self.generation = struct.unpack_from(meta_format, self.mm, self.slots[self.latest])[0]
+
+        self.thread = None
+        self.saved = 0
+        self.skipped = 0 #asked while the previous one was still being written
+        self.last_dirty = 0 #bytes of cells written by the last checkpoint
+
+    def busy(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def save(self, cells, state, tick, decode=None):
+        """starting a checkpoint of this copy of the grid, False if the previous one is not finished. decode:
+        turns the copy into the cells one byte each, in the writer thread (a packed grid's planes)"""
+        if self.busy():
+            self.skipped += 1
+            return False
+        self.thread = threading.Thread(target=self.write, args=(cells, state, tick, decode), daemon=True)
+        self.thread.start()
+        return True
+
+    def write(self, cells, state, tick, decode=None):
+        if decode is not None:
+            cells = decode(cells)
+        slot = 0 if self.latest != 0 else 1 #never the latest complete one
+        base = self.slots[slot]
+        blob = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.state_capacity:
+            print(f"<CHECKPOINT> state of {len(blob)} bytes does not fit, checkpoint skipped")
+            return
+
+        #cells: only the chunks that changed since this slot was written
+        disk = np.ndarray((self.size,), dtype=np.uint8, buffer=self.mm, offset=base + self.cells_offset)
+        full = self.size // chunk * chunk
+        changed = (disk[:full].reshape(-1, chunk) != cells[:full].reshape(-1, chunk)).any(axis=1)
+        if full < self.size:
+            changed = np.append(changed, (disk[full:] != cells[full:]).any())
+        dirty = np.flatnonzero(changed)
+        for run in np.split(dirty, np.flatnonzero(np.diff(dirty) != 1) + 1) if len(dirty) else []:
+            start, stop = run[0] * chunk, min((run[-1] + 1) * chunk, self.size)
+            disk[start:stop] = cells[start:stop]
+            self.mm.flush(base + self.cells_offset + start, stop - start)
+        del disk
+
+        state_start = base + self.state_offset
+        self.mm[state_start:state_start + len(blob)] = blob
+        self.mm.flush(state_start - state_start % mmap.PAGESIZE, state_start % mmap.PAGESIZE + len(blob))
+
+        #meta then the header: the slot becomes the latest only once everything is on disk
+        generation = self.generation + 1
+        struct.pack_into(meta_format, self.mm, base, generation, tick, len(blob), time.time())
+        self.mm.flush(base, mmap.PAGESIZE)
+        struct.pack_into("<q", self.mm, latest_offset, slot)
+        self.mm.flush(0, mmap.PAGESIZE)
+        self.latest = slot
+        self.generation = generation
+        self.last_dirty = len(dirty) * chunk
+        self.saved += 1
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+
+    def close(self):
+        """waiting for the checkpoint being written, then unmapping"""
+        self.wait()
+        self.mm.close()
+        self.file.close()
+        print(f"<CHECKPOINT> {self.saved} checkpoints written to {self.path} (generation {self.generation})")
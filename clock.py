@@ -0,0 +1,73 @@
+import math
+
+
+#fixed-step simulation clock: the simulation only moves by whole ticks (env.animal_tick simulated seconds
+#each), the wall clock just tells how many of them are due. speed is simulated seconds per wall second,
+#unbounded: ticks back to back as fast as the cpu goes. frames are paced apart, on wall time
+unbounded = math.inf
+speeds = (1.0, 10.0, 100.0, unbounded) #display keys 1 to 4
+max_lag = 0.05 #seconds of wall time of late ticks caught up, slower ticks lower the actual speed instead
+
+
+class SimClock:
+    def __init__(self, tick_seconds, speed=1.0, now=0.0):
+        self.tick_seconds = tick_seconds
+        self.speed = speed
+        self.paused = False
+        self.steps = 0 #single steps asked while paused
+        self.ticks = 0
+        self.next_tick = now
+
+    @property
+    def interval(self):
+        """wall seconds between two ticks"""
+        return 0.0 if self.speed == unbounded else self.tick_seconds / self.speed
+
+    @property
+    def sim_time(self):
+        """simulated seconds since the start"""
+        return self.ticks * self.tick_seconds
+
+    def due(self, now):
+        """True if a tick has to run now"""
+        if self.paused:
+            return self.steps > 0
+        return now >= self.next_tick
+
+    def wait(self, now):
+        """wall seconds until the next tick is due, inf while paused"""
+        if self.paused:
+            return 0.0 if self.steps else math.inf
+        return max(0.0, self.next_tick - now)
+
+    def ticked(self, now):
+        """one tick ran"""
+        self.ticks += 1
+        if self.paused:
+            self.steps = max(0, self.steps - 1)
+        self.next_tick = max(self.next_tick + self.interval, now - max_lag)
+
+    def set_speed(self, speed, now):
+        """new pace, starting right away (a paused clock resumes)"""
+        if speed <= 0:
+            raise ValueError(f"speed must be positive, got {speed}")
+        self.speed = speed
+        self.paused = False
+        self.steps = 0
+        self.next_tick = now
+
+    def pause(self, now, paused=None):
+        """toggling (or setting) the pause, a resumed clock does not catch up the paused time"""
+        self.paused = not self.paused if paused is None else paused
+        self.steps = 0
+        self.next_tick = now
+
+    def step(self, n=1):
+        """n more ticks, the clock is paused first"""
+        self.paused = True
+        self.steps += n
+
+    def describe(self):
+        if self.paused:
+            return "paused"
+        return "unbounded" if self.speed == unbounded else f"x{self.speed:g}"
@@ -0,0 +1,364 @@
+import pygame
+import time
+import numpy as np
+import env
+import stats
+import clock
+from render import DirtyRenderer, DensityRenderer, Viewport
+
+#ui conf
+panel_height = 100 #extra space for text
+FPS = 30
+max_view = (1280, 800) #pixels of the grid area at most, bigger grids are panned and zoomed
+no_change = np.zeros(0, dtype=np.int64) #no new frame: only what was drawn over gets repainted
+
+#colors
+bg_color = (15, 25, 40)
+grid_color = (30, 50, 70)
+text_color = (200, 230, 255)
+
+
+class Display:
+    def __init__(self, cmd_conn, frames, cell_size=env.cell_size, stats_page=None, table=None, clock_keys=True):
+        #geometry comes from the segment header
+        self.width = frames.width
+        self.height = frames.height
+        self.cell_size = cell_size
+        self.view_width = min(self.width * cell_size, max_view[0])
+        self.view_height = min(self.height * cell_size, max_view[1])
+        self.window_width = self.view_width
+        self.window_height = self.view_height + panel_height
+        self.viewport = Viewport(self.width, self.height, self.view_width, self.view_height, cell_size)
+        if self.view_width < self.width * cell_size or self.view_height < self.height * cell_size:
+            self.viewport.fit() #starting with the whole grid in view
+
+        pygame.init()
+        self.screen = pygame.display.set_mode((self.window_width, self.window_height))  #screen creation
+        pygame.display.set_caption("circle of life") #screen title
+        self.clock = pygame.time.Clock()
+        self.running = True
+        
+        #comm
+        self.cmd_conn = cmd_conn #sending the comms to env, None when replaying a recording or watching a remote env
+        self.frames = frames  #frames published by env in shared memory, a recording.Replay or a broadcast.FrameClient
+        self.replay = hasattr(frames, 'seek')
+        self.grid_changed = None #positions changed by the last frame read, None: unknown
+        self.started = None #launch time (time.monotonic), the first frame tells how long the startup took
+
+        #stats page of every process (see stats.py), shown over the grid with <S>
+        self.stats_page = stats_page
+        self.stats = stats_page.claim("display") if stats_page is not None else None
+        self.show_stats = False
+        self.stats_lines = []
+        self.stats_refresh = 0.0
+
+        #animal table (see table.py): energy heatmap instead of the sprites with <E>
+        self.table = table
+        self.show_energy = False
+        
+        #actual state of the game
+        self.grid_data = bytes([env.empty]) * (self.width * self.height)
+        self.counts = {'grass': 0, 'passive_prey': 0, 'active_prey': 0, 'predator': 0} #counter
+        self.raining = False
+        self.drought = False
+        self.speed = 1.0 #what we asked env's clock for (see clock.py)
+        self.paused = False
+        self.clock_keys = clock_keys #False: pause, step and speed keys off (animal processes keep their own pace)
+        
+        #fonts definition
+        self.font = pygame.font.SysFont("Times New Roman", 16, bold=True)
+        self.font_small = pygame.font.SysFont("Times New Roman", 14)
+        self.font_mono = pygame.font.SysFont("Courier New", 13)
+        
+        #loading the assets
+        self.assets = {env.grass: ("grass.png", (34, 139, 34)), env.passive_prey: ("prey.png", (200, 200, 200)),
+                       env.active_prey: ("prey_active.png", (255, 255, 0)), env.predator: ("predator.png", (220, 20, 60))}
+        self.sprites = {} #cell size -> images
+        self.images = self.sprites_of(cell_size)
+
+        #zoomed in: only the cells in view that changed are redrawn, zoomed out: one density image of the view
+        self.sprite_renderer = None
+        self.density_renderer = DensityRenderer(self.screen, self.viewport, {code: color for code, (path, color) in self.assets.items()}, bg_color)
+        self.renderer = None
+        self.view_key = None
+        self.dragging = False
+
+    def sprites_of(self, size):
+        """the images at this cell size, loaded once"""
+        if size not in self.sprites:
+            self.sprites[size] = {key: self.load_asset(path, color, size) for key, (path, color) in self.assets.items()}
+        return self.sprites[size]
+
+    def load_asset(self, path, color, size):
+        """load image or create colored squares if it doesn"t load as expected"""
+        try:
+            img = pygame.image.load(path) #loading img into memory
+            return pygame.transform.scale(img, (size, size)) #resizing the image to the actual size of the cells
+        except:
+            surf = pygame.Surface((size, size))
+            surf.fill(color)
+            if size > 2:
+                pygame.draw.rect(surf, (0, 0, 0), surf.get_rect(), 1) #drawing a border in black
+            return surf
+
+    def run(self):
+        """main display loop"""
+        print("<DISPLAY> starting...")
+        
+        while self.running:
+            #handling events
+            for event in pygame.event.get(): #events : mouse click or pressing some keys
+                if event.type == pygame.QUIT:
+                    self.running = False
+                    self.send("quit") #stopping the simulation
+
+                elif event.type == pygame.WINDOWEXPOSED:
+                    self.invalidate() #the window manager lost our pixels
+
+                elif event.type == pygame.MOUSEWHEEL:
+                    x, y = pygame.mouse.get_pos()
+                    if y < self.view_height:
+                        self.viewport.zoom(2.0 ** event.y, x, y)
+
+                elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                    self.dragging = event.pos[1] < self.view_height
+
+                elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+                    self.dragging = False
+
+                elif event.type == pygame.MOUSEMOTION and self.dragging:
+                    self.viewport.pan(-event.rel[0], -event.rel[1])
+                
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_ESCAPE:
+                        self.running = False
+                        self.send("quit")
+
+                    elif event.key == pygame.K_s and self.stats_page is not None:
+                        self.show_stats = not self.show_stats
+                        if not self.show_stats:
+                            self.invalidate() #repainting what the overlay covered
+
+                    elif event.key == pygame.K_e and self.table is not None:
+                        self.show_energy = not self.show_energy
+                        if not self.show_energy:
+                            self.invalidate() #back to the sprites
+
+                    elif event.key in (pygame.K_EQUALS, pygame.K_PLUS, pygame.K_KP_PLUS):
+                        self.viewport.zoom(2.0)
+
+                    elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                        self.viewport.zoom(0.5)
+
+                    elif event.key == pygame.K_f:
+                        self.viewport.fit()
+
+                    elif self.replay:
+                        self.replay_key(event.key)
+
+                    elif event.key in (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN):
+                        dx = {pygame.K_LEFT: -1, pygame.K_RIGHT: 1}.get(event.key, 0)
+                        dy = {pygame.K_UP: -1, pygame.K_DOWN: 1}.get(event.key, 0)
+                        self.viewport.pan(dx * self.view_width / 4, dy * self.view_height / 4)
+                    
+                    elif event.key == pygame.K_SPACE:
+                        #drought on/off
+                        self.send("drought")
+                    
+                    elif event.key == pygame.K_r:
+                        #rain on/off
+                        self.send("rain")
+
+                    elif event.key in (pygame.K_p, pygame.K_n, pygame.K_1, pygame.K_2, pygame.K_3, pygame.K_4) and not self.clock_keys:
+                        pass
+
+                    elif event.key == pygame.K_p:
+                        self.paused = not self.paused
+                        self.send("pause")
+
+                    elif event.key == pygame.K_n:
+                        #one tick, pausing first
+                        self.paused = True
+                        self.send("step")
+
+                    elif event.key in (pygame.K_1, pygame.K_2, pygame.K_3, pygame.K_4):
+                        self.speed = clock.speeds[event.key - pygame.K_1]
+                        self.paused = False
+                        self.send(f"speed {self.speed}")
+            
+            #updating the data on the display: only the latest frame, read in place
+            frame = self.frames.read() #None if env didn't publish anything new
+            if frame is None:
+                self.grid_changed = no_change
+            if frame is not None:
+                if self.started is not None:
+                    print(f"<DISPLAY> first frame {time.monotonic() - self.started:.3f}s after launch")
+                    self.started = None
+                self.grid_data = frame.cells
+                self.grid_changed = frame.changed
+                self.counts = frame.counts
+                self.raining = frame.raining
+                self.drought = frame.drought
+
+            #drawing
+            draw_start = time.perf_counter_ns()
+            dirty = self.draw_energy() if self.show_energy else self.draw_grid()
+            dirty.extend(self.draw_ui())
+            if self.stats is not None:
+                self.stats.add('draw', time.perf_counter_ns() - draw_start)
+                self.stats.set('frames_skipped', self.frames.skipped)
+                self.stats.set('frames_torn', self.frames.torn)
+            
+            pygame.display.update(dirty) #pushing only the dirty rects onto the screen
+            self.clock.tick(FPS) #if loop is fast, we cap the execution with a delay
+
+        pygame.quit()
+
+    def send(self, cmd):
+        """command to env (nothing to send to a recording)"""
+        if self.cmd_conn is not None:
+            self.cmd_conn.send(cmd)
+
+    def replay_key(self, key):
+        """replay controls: pause, seek, speed"""
+        replay = self.frames
+        if key == pygame.K_SPACE:
+            replay.paused = not replay.paused
+        elif key == pygame.K_RIGHT:
+            replay.seek(replay.position + 10)
+        elif key == pygame.K_LEFT:
+            replay.seek(replay.position - 10)
+        elif key == pygame.K_HOME:
+            replay.seek(0)
+        elif key == pygame.K_UP:
+            replay.faster()
+        elif key == pygame.K_DOWN:
+            replay.slower()
+
+    def draw_grid(self):
+        """drawing the cells that changed since last frame, returns the dirty rects"""
+        self.update_view()
+        return self.renderer.draw(self.grid_data, self.grid_changed)
+
+    def update_view(self):
+        """the renderer of the current zoom, told where the view is when it moved"""
+        key = self.viewport.key()
+        if key == self.view_key:
+            return
+        self.view_key = key
+        size = self.viewport.sprite_size()
+        if size:
+            c0, r0, c1, r1 = self.viewport.visible()
+            self.images = self.sprites_of(size)
+            if self.sprite_renderer is None:
+                self.sprite_renderer = DirtyRenderer(self.screen, self.images, self.width, self.height, size, bg_color, grid_color, (self.view_width, self.view_height))
+            self.sprite_renderer.set_view(self.images, size, c0, r0, (self.view_width, self.view_height))
+            self.screen.fill(bg_color, (0, 0, self.view_width, self.view_height)) #past the last column when zoomed out
+            self.renderer = self.sprite_renderer
+        else:
+            if self.renderer is not self.density_renderer:
+                self.density_renderer.reset() #frames went by while sprites were drawn
+            self.density_renderer.invalidate()
+            self.renderer = self.density_renderer
+
+    def invalidate(self):
+        """next frame repaints the whole view, from the current grid: frames may have gone by without the
+        renderer (energy heatmap, stats overlay)"""
+        if self.renderer is self.density_renderer:
+            self.density_renderer.reset()
+        if self.renderer is not None:
+            self.renderer.invalidate()
+
+    def draw_energy(self):
+        """every animal colored by its energy (blue: starving, red: about to breed), grass dimmed.
+        one array for the cells in view (one cell out of step when zoomed out), scaled to the window by pygame"""
+        view = self.viewport
+        c0, r0, c1, r1 = view.visible()
+        step = max(1, int(1 / view.scale))
+        rows, cols = np.arange(r0, r1, step), np.arange(c0, c1, step)
+        positions = rows[:, None] * self.width + cols[None, :]
+        energy = self.table.energy_map(positions)
+        cells = np.frombuffer(self.grid_data, dtype=np.uint8)[positions]
+        rgb = np.empty((len(rows), len(cols), 3), dtype=np.uint8)
+        rgb[:] = bg_color
+        rgb[cells == env.grass] = (20, 60, 30)
+        animal = energy >= 0
+        level = np.clip(energy[animal] / env.energy_max, 0.0, 1.0)
+        rgb[animal, 0] = (255 * level).astype(np.uint8)
+        rgb[animal, 1] = (80 + 120 * (1 - np.abs(2 * level - 1))).astype(np.uint8)
+        rgb[animal, 2] = (255 * (1 - level)).astype(np.uint8)
+        surface = pygame.surfarray.make_surface(rgb.transpose(1, 0, 2)) #surfarray is x first
+        size = (max(1, round(len(cols) * step * view.scale)), max(1, round(len(rows) * step * view.scale)))
+        area = pygame.Rect(0, 0, self.view_width, self.view_height)
+        self.screen.set_clip(area)
+        self.screen.fill(bg_color, area)
+        self.screen.blit(pygame.transform.scale(surface, size), (round((c0 - view.x) * view.scale), round((r0 - view.y) * view.scale)))
+        self.screen.set_clip(None)
+        return [area]
+
+    def draw_ui(self):
+        """drawing the status panel"""
+        y_offset = self.view_height #starting position for the panel, where the grid view ends
+        
+        #filling with background color
+        panel = pygame.draw.rect(self.screen, (20, 20, 20), (0, y_offset, self.window_width, panel_height))
+        
+        if self.drought:
+            status_text = "status: drought -> no grass growth right now"
+            status_color = (255, 100, 100)
+        elif self.raining:
+            status_text = "status: raining -> fast grass growth"
+            status_color = (100, 200, 255)
+        else:
+            status_text = "status: normal"
+            status_color = (200, 255, 200)
+        
+        surf_status = self.font.render(status_text, True, status_color) #rendering the text
+        self.screen.blit(surf_status, (10, y_offset + 10)) #pushing the text-image
+        
+        #counting
+        total_prey = self.counts['passive_prey'] + self.counts['active_prey']
+        pop_text = (f"grass: {self.counts['grass']}  |  " f"prey: {total_prey}  |  " f"predators: {self.counts['predator']}  |  " f"skipped frames: {self.frames.skipped}")
+        if self.cmd_conn is not None and self.clock_keys:
+            pop_text += "  |  clock: " + ("paused" if self.paused else "max" if self.speed == clock.unbounded else f"x{self.speed:g}")
+        surf_pop = self.font_small.render(pop_text, True, (200, 200, 200))
+        self.screen.blit(surf_pop, (10, y_offset + 40))
+        
+        # Controls
+        if self.replay:
+            replay = self.frames
+            state = "paused" if replay.paused else f"x{replay.speed:g}"
+            controls = f"replay {replay.position:.1f}s / {replay.duration:.1f}s ({state})  |  <SPACE> pause  |  <LEFT>/<RIGHT> seek 10s  |  <UP>/<DOWN> speed  |  <ESC> QUIT"
+        elif self.cmd_conn is None:
+            state = "" if self.frames.connected else " (disconnected)"
+            controls = f"watching {self.frames.address}{state}  |  <ESC> QUIT"
+        else:
+            controls = ("<P> pause  <N> step  <1>-<4> speed  |  " if self.clock_keys else "") + "<SPACE> drought  <R> rain  |  <S> stats  <E> energy  |  <ESC> QUIT"
+        surf_controls = self.font_small.render(controls, True, (150, 150, 150))
+        self.screen.blit(surf_controls, (10, y_offset + 65))
+        view = "<WHEEL> <+>/<-> zoom  |  drag " + ("" if self.replay else "<ARROWS> ") + f"pan  |  <F> fit  |  zoom {self.viewport.scale / self.cell_size:.2g}"
+        surf_view = self.font_small.render(view, True, (150, 150, 150))
+        self.screen.blit(surf_view, (10, y_offset + 82))
+
+        if self.show_stats:
+            return [panel, self.draw_stats()]
+        return [panel]
+
+    def draw_stats(self):
+        """stats overlay in the top left corner of the grid, refreshed twice a second"""
+        now = time.monotonic()
+        if now >= self.stats_refresh:
+            self.stats_lines = stats.summary(self.stats_page.snapshot())
+            self.stats_refresh = now + 0.5
+
+        line_height = self.font_mono.get_linesize()
+        surfaces = [self.font_mono.render(line, True, text_color) for line in self.stats_lines]
+        width = min(max((s.get_width() for s in surfaces), default=0) + 12, self.window_width)
+        height = min(line_height * len(surfaces) + 12, self.view_height)
+        box = pygame.Surface((width, height), pygame.SRCALPHA)
+        box.fill((0, 0, 0, 190))
+        for i, surf in enumerate(surfaces):
+            box.blit(surf, (6, 6 + i * line_height))
+        rect = self.screen.blit(box, (0, 0))
+        self.renderer.forget(rect) #the cells under it get repainted, then the overlay on top again
+        return rect
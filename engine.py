@@ -0,0 +1,357 @@
+import numpy as np
+import env
+from neighbourhood import Neighbourhood, DensityMap
+from table import AnimalTable
+
+
+#moves: stay, up, down, left, right
+move_dx = np.array([0, 0, 0, -1, 1], dtype=np.int64)
+move_dy = np.array([0, -1, 1, 0, 0], dtype=np.int64)
+
+#one animal of a snapshot (checkpoints): its arrays here, its id and age from the animal table
+snapshot_dtypes = {'pos': np.int64, 'energy': np.float64, 'kind': np.uint8, 'id': AnimalTable.dtypes['id'], 'age': AnimalTable.dtypes['age']}
+
+
+class BatchEngine:
+    """all the animals in one process, stored as struct-of-arrays and stepped together with numpy"""
+
+    def __init__(self, grid, grid_lock, capacity=1024, seed=None, lo=0, hi=None, table=None):
+        self.grid = grid
+        self.cells = grid.cells #numpy uint8 view over the shared grid (grid.PackedCells when packed), writes go through grid.set_many
+        self.width = grid.width
+        self.height = grid.height
+        self.lock = grid_lock
+        self.rng = np.random.default_rng(seed)
+        #cells [lo, hi) belong to this engine (a shard, see shards.py), moves leaving them are handed back by step
+        self.lo = lo
+        self.hi = grid.size if hi is None else hi
+        self.sight = Neighbourhood(self.width, self.height, env.sense_radius)
+        self.scent = DensityMap(self.width, self.height, {'prey': env.active_prey})
+        self.table = table #table.AnimalTable, the records every process can read (None: not kept)
+
+        #struct of arrays, only the first self.count entries are alive
+        self.pos = np.zeros(capacity, dtype=snapshot_dtypes['pos'])
+        self.energy = np.zeros(capacity, dtype=snapshot_dtypes['energy'])
+        self.kind = np.zeros(capacity, dtype=snapshot_dtypes['kind']) #passive_prey for every prey, predator otherwise
+        self.slot = np.zeros(capacity, dtype=np.int64) #record in the animal table
+        self.count = 0
+
+    def grow(self, needed):
+        """make room for at least needed animals"""
+        capacity = len(self.pos)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in ("pos", "energy", "kind", "slot"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add(self, positions, kinds, energies, ids=None, ages=None):
+        """append animals to the arrays (the grid is written by the caller, who checked table.room for them),
+        ids and ages of animals coming from elsewhere (another shard, a checkpoint)"""
+        n = len(positions)
+        self.grow(self.count + n)
+        end = self.count + n
+        self.pos[self.count:end] = positions
+        self.kind[self.count:end] = kinds
+        self.energy[self.count:end] = energies
+        if self.table is not None:
+            self.slot[self.count:end] = self.table.allocate(positions, kinds, energies, ids, ages)
+        self.count = end
+
+    def snapshot(self):
+        """copy of the animals and of the random state (checkpoints)"""
+        n = self.count
+        state = {'pos': self.pos[:n].copy(), 'energy': self.energy[:n].copy(), 'kind': self.kind[:n].copy(), 'rng': self.rng.bit_generator.state}
+        if self.table is not None:
+            state['id'] = self.table.id[self.slot[:n]]
+            state['age'] = self.table.age[self.slot[:n]]
+        return state
+
+    def restore(self, state):
+        """back to a snapshot, the grid is restored by the caller. animals over the cap of the table leave it"""
+        self.keep(np.zeros(self.count, dtype=bool))
+        fits = self.fit(state['pos'])
+        ids, ages = state.get('id'), state.get('age')
+        self.add(state['pos'][fits], state['kind'][fits], state['energy'][fits], None if ids is None else ids[fits], None if ages is None else ages[fits])
+        self.rng.bit_generator.state = state['rng']
+
+    def spawn(self, kind, n):
+        """put n new animals of this kind on random empty cells, returns how many were placed"""
+        with self.lock:
+            free = self.grid.empties()
+            n = min(n, len(free))
+            if n == 0:
+                return 0
+            positions = free[self.rng.choice(len(free), size=n, replace=False)].astype(np.int64)
+            if self.table is not None:
+                positions = positions[self.table.room(positions)]
+            self.grid.set_many(positions, kind)
+        self.add(positions, kind, env.energy_start)
+        return len(positions)
+
+    def step(self):
+        """one tick for every animal: starve, move, eat, reproduce.
+        returns the animals whose move leaves [lo, hi): (pos, target, energy, kind), they stay where they are"""
+        n = self.count
+        if n == 0:
+            return self.no_leavers()
+
+        pos = self.pos[:n]
+        energy = self.energy[:n]
+        kind = self.kind[:n]
+        is_prey = kind == env.passive_prey
+
+        energy -= env.cost_move
+
+        #random proposal for everyone, hungry animals head for food, computed outside the lock
+        direction = self.rng.integers(0, len(move_dx), n)
+        x = pos % self.width + move_dx[direction]
+        y = pos // self.width + move_dy[direction]
+        seeking, step_x, step_y = self.seek(pos, is_prey, energy < env.h_lim)
+        x[seeking] = pos[seeking] % self.width + step_x
+        y[seeking] = pos[seeking] // self.width + step_y
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        target = np.where(inside, y * self.width + x, pos)
+        order = self.rng.permutation(n) #priority when several animals want the same cell
+
+        with self.lock:
+            #prey replaced by something else on the grid were eaten by another process
+            cells = self.cells[pos]
+            gone = is_prey & (cells != env.passive_prey) & (cells != env.active_prey)
+            starved = (energy <= 0) & ~gone
+            self.grid.set_many(pos[starved], env.empty)
+            alive = ~gone & ~starved
+
+            wanted = self.cells[np.clip(target, self.lo, self.hi - 1)] #cells of other shards are not read
+            moving = alive & (target != pos)
+            leaving = moving & ((target < self.lo) | (target >= self.hi))
+            moving &= ~leaving
+            moving[self.blocked(pos, target, moving, order)] = False
+
+            #predators jump on active prey, the prey dies where it stands (only hungry ones go looking for it,
+            #but food on the way is always eaten: energy can then climb past h_lim up to r_lim)
+            hunting = moving & ~is_prey & (wanted == env.active_prey)
+            hunters = self.first_claims(target, hunting, order)
+            if len(hunters):
+                victims = self.animals_at(target[hunters], pos, alive & is_prey)
+                found = victims >= 0
+                hunters = hunters[found]
+                alive[victims[found]] = False
+                moving[victims[found]] = False
+
+            #everyone else moves onto empty cells, prey can also eat grass
+            grazing = is_prey & (wanted == env.grass)
+            walkers = self.first_claims(target, moving & ((wanted == env.empty) | grazing), order)
+
+            movers = np.concatenate([hunters, walkers])
+            old = pos[movers].copy()
+            pos[movers] = target[movers]
+            self.grid.set_many(old, env.empty)
+
+            #food
+            energy[hunters] += env.food_gain
+            energy[walkers[grazing[walkers]]] += env.food_gain
+            np.minimum(energy, env.energy_max, out=energy)
+
+            #reproduction: the newborn takes the cell its parent just left, if the table has a record for it
+            #once the animals changing band got theirs
+            breeding = energy[movers] > env.r_lim
+            if self.table is not None:
+                crossed = target[movers] // self.table.band_cells != old // self.table.band_cells
+                fits = self.table.room(np.concatenate([target[movers][crossed], old[breeding]]))[int(crossed.sum()):]
+                breeding[np.flatnonzero(breeding)[~fits]] = False
+            parents = movers[breeding]
+            births = old[breeding]
+            birth_kind = kind[parents]
+            energy[parents] -= env.energy_start
+
+            #prey show their state on the grid: active when hungry
+            codes = kind.copy()
+            codes[is_prey & (energy < env.h_lim)] = env.active_prey
+            self.grid.set_many(pos[alive], codes[alive])
+            self.grid.set_many(births, birth_kind)
+
+        leaving &= alive #a leaving prey can still be eaten before
+        leavers = (pos[leaving], target[leaving], energy[leaving], kind[leaving])
+        leaver_slots = self.slot[:n][leaving] #they don't move this tick, their slot stays
+
+        self.keep(alive)
+        if self.table is None:
+            self.add(births, birth_kind, env.energy_start)
+            return leavers + (np.zeros(len(leaver_slots), dtype=np.int64), np.zeros(len(leaver_slots), dtype=np.int32))
+        self.sync()
+        self.add(births, birth_kind, env.energy_start)
+        return leavers + (self.table.id[leaver_slots], self.table.age[leaver_slots])
+
+    def blocked(self, pos, target, moving, order):
+        """moving animals going into a band of the table with no record left for them, by priority: they stay"""
+        if self.table is None or self.table.n_bands == 1:
+            return np.zeros(0, dtype=np.int64)
+        band_cells = self.table.band_cells
+        candidates = order[moving[order]]
+        crossing = candidates[pos[candidates] // band_cells != target[candidates] // band_cells]
+        return crossing[~self.table.room(target[crossing])]
+
+    def fit(self, positions):
+        """True for the animals the table has a record for on these cells (every one without a table), the
+        others are taken off the grid"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if self.table is None:
+            return np.ones(len(positions), dtype=bool)
+        fits = self.table.room(positions)
+        if not fits.all():
+            with self.lock:
+                self.grid.set_many(positions[~fits], env.empty)
+        return fits
+
+    def sync(self):
+        """writing cells, energies, ages and flags of every animal into the table, once per tick"""
+        n = self.count
+        slots = self.slot[:n] = self.table.update(self.slot[:n], self.pos[:n], self.energy[:n])
+        self.table.age[slots] += 1
+        self.table.mark(slots, self.energy[:n], env.h_lim, env.r_lim)
+
+    def seek(self, pos, is_prey, hungry):
+        """moves of the hungry animals sensing food: towards the nearest food in sight, else for predators
+        towards the side with the most active prey around. returns (indices, dx, dy)"""
+        idx = []
+        steps_x = []
+        steps_y = []
+        for mask, food in ((is_prey & hungry, env.grass), (~is_prey & hungry, env.active_prey)):
+            animals = np.flatnonzero(mask)
+            if len(animals) == 0:
+                continue
+            found = self.sight.nearest(self.cells, pos[animals], food)
+            step_x, step_y = self.sight.step_towards(pos[animals], found)
+            if food == env.active_prey and (found < 0).any():
+                #one refresh per tick, over our rows and the ones a scent can reach
+                lost = found < 0
+                self.scent.refresh(self.grid, self.lo // self.width - env.scent_radius, (self.hi - 1) // self.width + 1 + env.scent_radius)
+                step_x[lost], step_y[lost] = self.scent.step_towards('prey', pos[animals[lost]], env.scent_radius)
+            sensed = (step_x != 0) | (step_y != 0)
+            idx.append(animals[sensed])
+            steps_x.append(step_x[sensed])
+            steps_y.append(step_y[sensed])
+        if not idx:
+            return np.zeros(0, dtype=np.int64), 0, 0
+        return np.concatenate(idx), np.concatenate(steps_x), np.concatenate(steps_y)
+
+    def keep(self, mask):
+        """compacting the arrays to the animals in mask, the others leave the table"""
+        n = self.count
+        m = int(mask.sum())
+        if self.table is not None and m < n:
+            self.table.release(self.slot[:n][~mask])
+        self.pos[:m] = self.pos[:n][mask]
+        self.energy[:m] = self.energy[:n][mask]
+        self.kind[:m] = self.kind[:n][mask]
+        self.slot[:m] = self.slot[:n][mask]
+        self.count = m
+
+    def no_leavers(self):
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.uint8),
+                np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32))
+
+    def adopt(self):
+        """taking every animal found on [lo, hi) that is not simulated yet (placed by env), returns how many"""
+        band = self.cells[self.lo:self.hi]
+        found = self.lo + np.flatnonzero((band == env.passive_prey) | (band == env.active_prey) | (band == env.predator))
+        found = found[~np.isin(found, self.pos[:self.count])]
+        found = found[self.fit(found)]
+        kinds = np.where(self.cells[found] == env.predator, env.predator, env.passive_prey)
+        self.add(found, kinds, env.energy_start)
+        return len(found)
+
+    def arrive(self, target, energy, kind, blocked, ids=None, ages=None):
+        """animals of a neighbour shard moving onto cells of this one (after step), same rules as a local move.
+        blocked: cells of our own leavers, they can't be eaten (the other side may be taking them).
+        ids, ages: their records in the animal table, kept on this side
+        returns one status per animal: 0 refused, 1 moved in, 2 moved in and left a newborn on its old cell"""
+        status = np.zeros(len(target), dtype=np.uint8)
+        if len(target) == 0:
+            return status
+        energy = energy.copy()
+        n = self.count
+        pos = self.pos[:n]
+
+        with self.lock:
+            is_prey = kind == env.passive_prey
+            wanted = self.cells[target]
+            hunting = ~is_prey & (wanted == env.active_prey)
+            grazing = is_prey & (wanted == env.grass)
+            order = self.rng.permutation(len(target))
+            winners = self.first_claims(target, (wanted == env.empty) | hunting | grazing, order)
+            if self.table is not None: #refused when our band of the table is full
+                winners = winners[self.table.room(target[winners])]
+
+            alive = np.ones(n, dtype=bool)
+            hunters = winners[hunting[winners]]
+            if len(hunters):
+                preys = (self.kind[:n] == env.passive_prey) & ~np.isin(pos, blocked)
+                victims = self.animals_at(target[hunters], pos, preys)
+                found = victims >= 0
+                alive[victims[found]] = False
+                winners = np.setdiff1d(winners, hunters[~found])
+
+            fed = hunting[winners] | grazing[winners]
+            energy[winners[fed]] += env.food_gain
+            np.minimum(energy, env.energy_max, out=energy)
+            breeding = winners[energy[winners] > env.r_lim]
+            energy[breeding] -= env.energy_start
+            status[winners] = 1
+            status[breeding] = 2
+
+            codes = kind[winners].copy()
+            codes[(codes == env.passive_prey) & (energy[winners] < env.h_lim)] = env.active_prey
+            self.grid.set_many(target[winners], codes)
+
+        self.keep(alive)
+        self.add(target[winners], kind[winners], energy[winners], None if ids is None else ids[winners], None if ages is None else ages[winners])
+        return status
+
+    def depart(self, positions, status, kind):
+        """our leavers accepted by a neighbour shard leave their cell, a newborn takes it when status is 2"""
+        moved = status > 0
+        if not moved.any():
+            return
+        positions = positions[moved]
+        newborn = status[moved] == 2
+        if self.table is not None: #no record left: the parent paid for nothing
+            newborn[newborn] = self.table.room(positions[newborn])
+        n = self.count
+        with self.lock:
+            idx = self.animals_at(positions, self.pos[:n], np.ones(n, dtype=bool))
+            alive = np.ones(n, dtype=bool)
+            alive[idx[idx >= 0]] = False
+            self.grid.set_many(positions, np.where(newborn, kind[moved], env.empty))
+        self.keep(alive)
+        self.add(positions[newborn], kind[moved][newborn], env.energy_start)
+
+    def first_claims(self, target, mask, order):
+        """indices of the animals winning their target cell, at most one winner per cell"""
+        candidates = order[mask[order]]
+        if len(candidates) == 0:
+            return candidates
+        _, first = np.unique(target[candidates], return_index=True)
+        return candidates[first]
+
+    def animals_at(self, cells, pos, mask):
+        """index of the animal standing on each cell among mask, -1 if none"""
+        idx = np.flatnonzero(mask)
+        if len(idx) == 0:
+            return np.full(len(cells), -1, dtype=np.int64)
+        sorter = np.argsort(pos[idx])
+        sorted_pos = pos[idx][sorter]
+        where = np.searchsorted(sorted_pos, cells)
+        where = np.minimum(where, len(sorted_pos) - 1)
+        found = sorted_pos[where] == cells
+        return np.where(found, idx[sorter][where], -1)
+
+    def populations(self):
+        """number of prey and predators currently simulated"""
+        kind = self.kind[:self.count]
+        return int((kind == env.passive_prey).sum()), int((kind == env.predator).sum())
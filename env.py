@@ -1,20 +1,32 @@
 import socket
-from multiprocessing import shared_memory
 import random
 import struct
-from queue import Empty
+import selectors
 import os
 import time
 import signal
+import numpy as np
+from grid import SharedGrid, PackedGrid
+from frames import FrameRing, frames_name
+from grass import GrassModel
+from recording import Recorder
+import checkpoint
+from stats import StatsPage, TimedLock, stats_name
+import protocol
+from broadcast import BroadcastServer, parse_address
+from clock import SimClock, unbounded
+from table import AnimalTable, table_name
 
 
+#default grid, overridden at startup (--width, --height, --cell-size)
 tab_size = 20
 cell_size = 25
-number_bytes = tab_size * tab_size
 
 #network
 HOST = "localhost"
 PORT = 65501
+UNIX_PATH = None #optional unix socket for local clients (--unix-socket)
+BROADCAST = None #(host, port) streaming the frames to remote viewers (--broadcast)
 shared_mem_name = "CircleGame"
 
 #constants
@@ -24,6 +36,14 @@ h_lim = 40 #hunger limit (threshold to become active)
 r_lim = 75       #reproduction limit
 cost_move = 0.5
 food_gain = 25
+sense_radius = 3 #hungry animals see food up to this many cells away
+scent_radius = 8 #hungry predators seeing no prey head for the side with the most active prey this far
+animal_tick = 0.1 #seconds between two ticks (one move of every animal) in realtime
+grass_rate = 0.0025 #chance for an empty cell to grow grass each tick
+rain_factor = 2.5 #grass_rate multiplier while raining
+grass_spread = 0.0 #extra chance per neighbouring grass cell (0: grass appears anywhere alike)
+frame_interval = 0.033 #30 FPS
+tick_budget = 0.01 #seconds of ticks back to back before looking at the sockets again (fast speeds)
 
 #local codes
 empty = 0
@@ -31,173 +51,593 @@ grass = 1
 passive_prey = 2
 predator = 3
 active_prey = 4
+animal_codes = (passive_prey, predator, active_prey)
+
+#settings a run can change (--set, sweep.py), the rest are constants
+settings = ('HOST', 'PORT', 'UNIX_PATH', 'BROADCAST', 'shared_mem_name', 'energy_start', 'energy_max', 'h_lim', 'r_lim',
+            'cost_move', 'food_gain', 'sense_radius', 'scent_radius', 'animal_tick', 'grass_rate', 'rain_factor', 'grass_spread')
+configured = {} #what configure changed, handed to processes that don't fork from us (forkserver)
+
+
+def configure(**params):
+    """changing settings before the simulation starts, forked processes inherit them"""
+    for name, value in params.items():
+        if name not in settings:
+            raise ValueError(f"unknown setting {name}")
+        globals()[name] = value
+    configured.update(params)
+
+
+def parse_setting(text):
+    """"name=value" -> (name, value), the value gets the type of the current setting (BROADCAST: [host:]port,
+    a (host, port) tuple). ValueError for an unknown name or a value of the wrong type"""
+    name, sep, value = text.partition("=")
+    name = name.strip().replace("-", "_")
+    usage = f"expected name=value with name among {', '.join(settings)}, got {text!r}"
+    if not sep or name not in settings:
+        raise ValueError(usage)
+    current = globals()[name]
+    try:
+        if name == 'BROADCAST':
+            return name, parse_address(value)
+        if isinstance(current, bool) or current is None or isinstance(current, str):
+            return name, value
+        if isinstance(current, int):
+            number = float(value) #"1e3" is fine, 30.7 is not
+            if not number.is_integer():
+                raise ValueError(f"{name} takes a whole number")
+            return name, int(number)
+        return name, type(current)(value)
+    except ValueError as e:
+        raise ValueError(f"{usage}: {e}") from None
+
 
 class EnvProcess:
-    def __init__(self, grid_lock):
+    def __init__(self, grid_lock, engine="process", preys=20, predators=6, width=tab_size, height=tab_size, seed=None):
         self.lock = grid_lock
+        self.width = width
+        self.height = height
         self.running = True
         self.raining = False
         self.drought = False
+        self.engine_mode = engine #"process": one process per animal, "batch": every animal stepped here, "sharded": one worker per band
+        self.initial_population = {passive_prey: preys, predator: predators}
+        self.realtime = True #False: ticks as fast as possible (speed unbounded)
+        self.speed = 1.0 #simulated seconds per wall second at start, see clock.py
+        self.clock = None #clock.SimClock of the loop, the display changes its speed and pauses it
+        self.seed = seed #same seed, same grass and batch engine (animal processes are not reproducible)
+        self.packed = False #grid as bit planes (grid.PackedGrid), for very large worlds
+        self.max_animals = None #population cap sizing the animal table (None: a quarter of the cells)
+        self.record_path = None #recording of the published frames (see recording.py)
+        self.record_every = 1
+        self.checkpoint_path = None #periodic snapshots of the whole simulation (see checkpoint.py)
+        self.checkpoint_every = 60.0 #seconds
+        self.resume_path = None #starting from a checkpoint instead of an empty grid
+        self.stats_path = None #json lines dump of the stats page (see stats.py)
+        self.stats_every = 1.0 #seconds
+        self.ready = None #multiprocessing.Event set once the segments exist and the sockets listen
+        self.broadcast = None #broadcast.BroadcastServer when BROADCAST is set
+        self.ticks = 0
+        self.frames = 0
+        self.changed = True #something to show since the last frame: ticks, commands, ops, spawns
+        self.frame_capture = None #our copy of the grid (or of the planes) taken under the lock for a frame
+        self.last_counts = None
 
     def signal_handler(self, sig, frame):
         self.drought = not self.drought
+        self.changed = True
         print(f"<ENV> drought toggled: {self.drought}")
 
-    def run(self, cmd_queue, display_queue):
-        """main env process: it owns the shared memory and tries to send frames to display"""
+    def terminate_handler(self, sig, frame):
+        self.running = False #terminate() from main: the loop ends after this tick and cleanup still runs (shard workers, sockets, segments, last checkpoint)
+
+    def run(self, cmd_conn, max_ticks=None, max_seconds=None):
+        """main env process: it owns the shared memory and publishes frames for the display"""
         print(f"<ENV> starting. PID: {os.getpid()}")
         
         #drought
         signal.signal(signal.SIGUSR1, self.signal_handler) #trigger action to signal
+        signal.signal(signal.SIGTERM, self.terminate_handler)
         print("<ENV> SIGUSR1 handler registered for drought toggle")
-        
-        #shared mem
+
         try:
-            self.shared = shared_memory.SharedMemory(name=shared_mem_name, create=True, size=number_bytes)
-            self.is_owner = True
-        except FileExistsError:
-            #clean old mem
-            try:
-                old_shm = shared_memory.SharedMemory(name=shared_mem_name)
-                old_shm.close() #close connection
-                old_shm.unlink() #destroying it
-            except:
-                pass
-            self.shared = shared_memory.SharedMemory(name=shared_mem_name, create=True, size=number_bytes)
-            self.is_owner = True
-        
-        #data
-        self.grid = self.shared.buf
-        
-        #initialisation
-        for i in range(number_bytes):
-            self.grid[i] = empty
+            self.create_grid()
+            if not self.listen():
+                return
+            if self.ready is not None:
+                self.ready.set()
+            self.loop(cmd_conn, max_ticks, max_seconds)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.cleanup()
+
+    def create_grid(self):
+        """creating the shared grid (and the batch engine or the shard workers living on it)"""
+        #shared mem, the header tells every attaching process the shape. a new segment is zero filled (empty)
+        #with every cell in the free index (SharedGrid), no bit set in any plane (PackedGrid)
+        grid_class = PackedGrid if self.packed else SharedGrid
+        self.grid = grid_class(shared_mem_name, self.width, self.height, create=True, n_bands=self.lock.n_stripes)
+        self.is_owner = True
+
+        #stats page: every process writes its counters there, our own lock waits/holds included
+        self.stats_page = StatsPage(stats_name(shared_mem_name), create=True)
+        self.stats = self.stats_page.claim("env")
+        if isinstance(self.lock, TimedLock):
+            self.lock.stats = self.stats
+        else:
+            self.lock = TimedLock(self.lock, self.stats)
+
+        #one record per animal (energy, age...): written by whoever simulates it, read by env and the display
+        self.table = AnimalTable(table_name(shared_mem_name), self.width, self.height, self.grid.n_bands, create=True, capacity=self.max_animals)
+
+        #frames for the display, read straight from shared memory
+        self.ring = FrameRing(frames_name(shared_mem_name), self.width, self.height, create=True)
+        print(f"<ENV> grid {self.width}x{self.height} ({self.grid.size} cells{', packed' if self.packed else ''})")
+
+        if self.seed is not None:
+            random.seed(self.seed) #spawn positions
+        self.grass = GrassModel(self.width, self.height, grass_rate, rain_factor, grass_spread, self.seed)
+
+        restored = checkpoint.load(self.resume_path) if self.resume_path else None
+        if restored is not None:
+            cells, state = restored
+            self.grid.load(cells)
+            self.restore_state(state)
+            if self.engine_mode == "process": #the animal processes find their record on their cell
+                found = np.flatnonzero(np.isin(cells, animal_codes))
+                fits = self.table.room(found)
+                self.grid.set_many(found[~fits], empty) #more animals than the cap of this run
+                found = found[fits]
+                self.table.allocate(found, np.where(cells[found] == predator, predator, passive_prey), energy_start)
 
-        #socket for animal spawning
+        #batch engine: the animals live inside this process
+        self.engine = None
+        if self.engine_mode == "batch":
+            from engine import BatchEngine
+            self.engine = BatchEngine(self.grid, self.lock, seed=None if self.seed is None else self.seed + 1, table=self.table)
+            if restored is None:
+                for kind, n in self.initial_population.items():
+                    self.engine.spawn(kind, n)
+            elif 'engine' in restored[1]:
+                self.engine.restore(restored[1]['engine'])
+            else:
+                self.engine.adopt() #saved by another engine: the animals come back with energy_start
+            print(f"<ENV> batch engine started with {self.engine.count} animals")
+
+        #sharded: the animals live in one worker per band, env only drives the ticks
+        self.shards = None
+        if self.engine_mode == "sharded":
+            from shards import ShardPool
+            if restored is None:
+                for kind, n in self.initial_population.items():
+                    self.spawn_animals(kind, n)
+            #restored animals are adopted by the workers (energy_start, the energies of workers are not saved)
+            self.shards = ShardPool(self.grid)
+            self.shards.start()
+            print(f"<ENV> {self.shards.n_shards} shard workers started with {sum(self.grid.counts()[passive_prey:])} animals")
+
+        #started after the workers: no thread running when they are forked
+        self.recorder = None
+        if self.record_path:
+            self.recorder = Recorder(self.record_path, self.width, self.height, self.record_every)
+            print(f"<ENV> recording to {self.record_path}")
+
+        self.checkpointer = None
+        if self.checkpoint_path:
+            self.checkpointer = checkpoint.Checkpointer(self.checkpoint_path, self.width, self.height)
+            print(f"<ENV> checkpoint every {self.checkpoint_every}s to {self.checkpoint_path}")
+
+    def listen(self):
+        """sockets for the spawn protocol (see protocol.py), False if the port is taken"""
+        self.clients = {} #socket -> protocol.ServerConnection
         self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) #reuse port if quick restart
         try:
             self.server_sock.bind((HOST, PORT))
-            self.server_sock.listen(5) #backlog, ie max waiting room capacity
+            self.server_sock.listen(64) #backlog, ie max waiting room capacity (a whole population can connect at once)
             self.server_sock.setblocking(False)
         except OSError:
             print(f"<ENV> port {PORT} busy, we can't actually start the game...")
-            self.cleanup()
-            return
-
+            return False
         print(f"<ENV> listening on {HOST}:{PORT}")
-        
-        last_frame_time = time.time()
-        frame_interval = 0.033  #30 FPS
-        
+
+        self.unix_sock = None
+        if UNIX_PATH:
+            if os.path.exists(UNIX_PATH):
+                os.unlink(UNIX_PATH) #left by an old run
+            self.unix_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.unix_sock.bind(UNIX_PATH)
+            self.unix_sock.listen(64)
+            self.unix_sock.setblocking(False)
+            print(f"<ENV> listening on {UNIX_PATH}")
+
+        self.broadcast = None
+        if BROADCAST:
+            try:
+                self.broadcast = BroadcastServer(*BROADCAST, self.width, self.height)
+                print(f"<ENV> broadcasting frames on {BROADCAST[0]}:{self.broadcast.address[1]}")
+            except OSError as e:
+                print(f"<ENV> no frame broadcast, {BROADCAST[0]}:{BROADCAST[1]}: {e}") #the game runs anyway
+        return True
+
+    def loop(self, cmd_conn, max_ticks=None, max_seconds=None):
+        """env loop: waits on the spawn socket, the command pipe and the next tick/frame deadline at once.
+        the clock decides how many ticks are due, frames go out every frame_interval of wall time whatever
+        the speed. realtime=False ticks back to back (headless runs)"""
+        self.selector = selector = selectors.DefaultSelector()
+        #data of each key: (stats metric, callback)
+        for sock in (self.server_sock, self.unix_sock):
+            if sock is not None:
+                selector.register(sock, selectors.EVENT_READ, ('accept', lambda sock=sock: self.accept_clients(sock)))
+        if cmd_conn is not None:
+            selector.register(cmd_conn, selectors.EVENT_READ, ('commands', lambda: self.handle_commands(cmd_conn)))
+        if self.broadcast is not None:
+            self.broadcast.attach(selector)
+
+        start_time = time.monotonic()
+        self.clock = clock = SimClock(animal_tick, self.speed if self.realtime else unbounded, start_time)
+        next_frame = start_time
+        deadline = start_time + max_seconds if max_seconds is not None else float("inf")
+        next_checkpoint = start_time + self.checkpoint_every
+        start_ticks = self.ticks #a resumed run starts at the checkpoint tick
+        next_stats = start_time + self.stats_every
+
         try:
             while self.running:
-                self.growing_grass()
+                now = time.monotonic()
+                timeout = max(0.0, min(clock.wait(now), next_frame - now, deadline - now))
+                for key, _ in selector.select(timeout): #sleeping here, no cpu used while waiting (0: just polling)
+                    metric, callback = key.data
+                    with self.stats.timer(metric):
+                        callback()
 
-                #accepting new animals
-                try:
-                    conn, addr = self.server_sock.accept()
-                    with self.lock:
-                        start_pos = self.find_empty_spot()
-                        if start_pos != -1:
-                            conn.sendall(struct.pack("I", start_pos)) #int to 4 bytes binary data
-                        else:
-                            conn.close()
-                    conn.close()
-
-                except BlockingIOError:
-                    pass
-
-                #commands from display
-                try:
-                    while True:
-                        cmd = cmd_queue.get_nowait()
-                        if cmd == "quit":
-                            self.running = False
-                        elif cmd == "rain":
-                            self.raining = not self.raining
-                            print(f"<ENV> raining: {self.raining}")
-                        elif cmd == "drought":
-                            self.drought = not self.drought
-                            print(f"<ENV> drought: {self.drought}")
-                except Empty: #no more messages to treat
-                    pass
-                
-                #sending frames
-                current_time = time.time()
-                if current_time - last_frame_time >= frame_interval: #to avoid flooding the queue
-                    self.send_frame(display_queue)
-                    last_frame_time = current_time
-                
-                time.sleep(0.01)  #sleep to prevent CPU from spinning
-        except KeyboardInterrupt:
-            pass
+                #every tick due, at most until the next frame or tick_budget: fast speeds still serve the sockets
+                now = time.monotonic()
+                stop_ticking = min(next_frame, now + tick_budget)
+                while self.running and clock.due(now):
+                    with self.stats.timer('tick'):
+                        self.tick()
+                    now = time.monotonic()
+                    clock.ticked(now)
+                    if max_ticks is not None and self.ticks - start_ticks >= max_ticks:
+                        self.running = False
+                    if now >= stop_ticking:
+                        break
+
+                if self.checkpointer is not None and now >= next_checkpoint:
+                    with self.stats.timer('checkpoint'):
+                        self.checkpoint()
+                    next_checkpoint = now + self.checkpoint_every
+
+                #sending frames, none while paused with nothing new
+                if now >= next_frame: #30 FPS is enough for the display
+                    if self.frame_wanted():
+                        with self.stats.timer('frame'):
+                            self.send_frame()
+                    next_frame = now + frame_interval
+
+                if self.stats_path and now >= next_stats:
+                    self.stats_page.dump(self.stats_path)
+                    next_stats = now + self.stats_every
+
+                if now >= deadline:
+                    self.running = False
         finally:
-            self.cleanup()
+            for sock in list(self.clients):
+                self.drop_client(sock)
+            if self.broadcast is not None:
+                self.broadcast.detach()
+            selector.close()
 
-    def find_empty_spot(self):
-        """find random empty spot for new animal"""
-        attempts = 0
-        while attempts < 100:
-            position = random.randint(0, number_bytes - 1)
-            if self.grid[position] == empty:
-                return position
-            attempts += 1
-        return -1
+    def tick(self):
+        """one simulation step: grass then every animal of the batch engine or of the shard workers"""
+        self.changed = True
+        with self.stats.timer('grass'):
+            self.growing_grass()
 
-    def growing_grass(self):
-        """growing grass randomly unless drought is active"""
-        if self.drought:
+        #moving every animal at once
+        with self.stats.timer('step'):
+            if self.engine is not None:
+                self.engine.step()
+            if self.shards is not None and not self.shards.tick():
+                self.running = False
+
+        #animal processes keep their own energy in the table: env holds them to the rules
+        if self.engine_mode == "process":
+            with self.lock:
+                self.table.enforce(self.grid.cells, animal_codes, energy_max, h_lim, r_lim)
+        self.ticks += 1
+        self.stats.set('ticks', self.ticks)
+
+    def accept_clients(self, server_sock):
+        """accepting every pending connection, they stay open for many requests"""
+        while True:
+            try:
+                conn, addr = server_sock.accept()
+            except BlockingIOError:
+                return
+            conn.setblocking(False)
+            self.clients[conn] = protocol.ServerConnection(conn)
+            self.selector.register(conn, selectors.EVENT_READ, ('requests', lambda conn=conn: self.handle_client(conn)))
+
+    def handle_client(self, conn):
+        """reading the requests of one client, answering them in order"""
+        client = self.clients[conn]
+        try:
+            data = conn.recv(65536)
+            if not data: #client is gone
+                self.drop_client(conn)
+                return
+            for msg_type, byte, count, payload in client.feed(data):
+                self.answer(client, msg_type, byte, count, payload)
+        except BlockingIOError:
+            pass
+        except (protocol.ProtocolError, ConnectionError):
+            client.reply(0, protocol.E_BAD_REQUEST, 0)
+            client.flush()
+            self.drop_client(conn)
             return
 
-        if self.raining:
-            growth_chance = 0.25
+        #a reply too large for the socket buffer is finished when it becomes writable
+        try:
+            done = client.flush()
+        except ConnectionError:
+            self.drop_client(conn)
+            return
+        events = selectors.EVENT_READ if done else selectors.EVENT_READ | selectors.EVENT_WRITE
+        key = self.selector.get_key(conn)
+        if key.events != events:
+            self.selector.modify(conn, events, key.data)
+
+    def drop_client(self, conn):
+        self.selector.unregister(conn)
+        del self.clients[conn]
+        conn.close()
+
+    def answer(self, client, msg_type, byte, count, payload):
+        """running one request"""
+        if count > protocol.max_count:
+            client.reply(msg_type, protocol.E_BAD_REQUEST, 0)
+        elif msg_type == protocol.SPAWN:
+            status, positions = self.spawn_animals(byte, count)
+            client.reply(msg_type, status, len(positions), struct.pack(f"<{len(positions)}i", *positions))
+        elif msg_type == protocol.OPS:
+            if len(payload) != count * protocol.op_record.size:
+                client.reply(msg_type, protocol.E_BAD_REQUEST, 0)
+            elif self.engine_mode != "process": #the batch engine or the shard workers own every animal
+                client.reply(msg_type, protocol.E_UNSUPPORTED, 0)
+            else:
+                with self.lock: #the whole batch under one acquire
+                    statuses = bytes(self.apply_op(op, pos, target) for op, pos, target in protocol.op_record.iter_unpack(payload))
+                client.reply(msg_type, protocol.OK, count, statuses)
         else:
-            growth_chance = 0.10
+            client.reply(msg_type, protocol.E_BAD_REQUEST, 0)
 
-        if random.random() < growth_chance:
-            with self.lock:
-                position = self.find_empty_spot()
-                if position != -1:
-                    self.grid[position] = grass
+    def spawn_animals(self, kind, n):
+        """placing up to n animals on random empty cells, returns (status, positions)"""
+        if kind not in (passive_prey, predator):
+            return protocol.E_BAD_REQUEST, []
+        positions = []
+        self.changed = True
+        with self.lock:
+            for _ in range(n):
+                pos = self.find_empty_spot()
+                if pos == -1:
+                    break
+                self.grid.set(pos, kind) #taken right away, no other spawn can get it
+                positions.append(pos)
+            fits = self.table.room(positions) if positions else []
+            for pos, fit in zip(list(positions), fits):
+                if not fit: #no record left in its band of the table
+                    self.grid.set(pos, empty)
+                    positions.remove(pos)
+            if self.engine is not None and positions:
+                self.engine.add(positions, kind, energy_start)
+            elif self.engine_mode == "process" and positions:
+                self.table.allocate(positions, kind, energy_start)
+            if getattr(self, 'shards', None) is not None:
+                self.shards.placed(positions)
+        return (protocol.OK if len(positions) == n else protocol.E_FULL), positions
 
-    def send_frame(self, display_queue):
-        """send grid frame"""
+    def apply_op(self, op, pos, target):
+        """one operation of an OPS batch (lock held by the caller), returns its status. the animal table follows
+        every grid write: records move with their animal, newborns get one, the dead and the eaten lose theirs"""
+        grid = self.grid.buf
+        table = self.table
+        self.changed = True
+        if pos >= self.grid.size or target >= self.grid.size:
+            return protocol.E_BOUNDS
+        code = grid[pos]
+        if code not in (passive_prey, active_prey, predator):
+            return protocol.E_NOT_ANIMAL
+        prey = code != predator
+        kind = passive_prey if prey else predator
+        slot = int(table.index[pos])
+        if slot < 0: #placed while its band of the table was full: it gets a record now if one is free
+            slot = int(table.allocate([pos], kind, energy_start)[0])
+        if op in (protocol.MOVE, protocol.EAT) and slot >= 0 and not table.can_move(pos, target):
+            return protocol.E_FULL #the band of target has no record left for it
+
+        if op == protocol.MOVE:
+            if grid[target] != empty:
+                return protocol.E_OCCUPIED
+        elif op == protocol.EAT:
+            if grid[target] != (grass if prey else active_prey):
+                return protocol.E_NO_FOOD
+            table.release([table.index[target]]) #the eaten prey (-1 for grass: nothing)
+            if slot >= 0:
+                table.energy[slot] = min(float(table.energy[slot]) + food_gain, energy_max)
+        elif op == protocol.REPRODUCE:
+            if grid[target] != empty:
+                return protocol.E_OCCUPIED
+            if not table.room([target])[0]:
+                return protocol.E_FULL
+            self.grid.set(target, kind)
+            table.allocate([target], kind, energy_start)
+            return protocol.OK
+        elif op == protocol.DIE:
+            self.grid.set(pos, empty)
+            table.release([slot])
+            return protocol.OK
+        else:
+            return protocol.E_BAD_REQUEST
+
+        #move or eat: the animal keeps its code and its record on the new cell
+        self.grid.set(pos, empty)
+        self.grid.set(target, code)
+        if slot >= 0:
+            table.move(slot, pos, target)
+        return protocol.OK
+
+    def handle_commands(self, cmd_conn):
+        """commands from display"""
+        while cmd_conn.poll():
+            try:
+                cmd = cmd_conn.recv()
+            except EOFError: #display is gone
+                self.running = False
+                return
+            if cmd == "quit":
+                self.running = False
+            elif cmd == "rain":
+                self.raining = not self.raining
+                self.changed = True
+                print(f"<ENV> raining: {self.raining}")
+            elif cmd == "drought":
+                self.drought = not self.drought
+                self.changed = True
+                print(f"<ENV> drought: {self.drought}")
+            elif self.engine_mode == "process" and (cmd in ("pause", "step") or cmd.startswith("speed ")):
+                print(f"<ENV> {cmd} ignored: animal processes keep their own wall-clock pace")
+            elif cmd == "pause":
+                self.clock.pause(time.monotonic())
+                print(f"<ENV> clock {self.clock.describe()} at tick {self.ticks}")
+            elif cmd == "step":
+                self.clock.step()
+            elif cmd.startswith("speed "): #"speed 10", "speed inf"
+                try:
+                    speed = float(cmd.split()[1])
+                except (IndexError, ValueError):
+                    print(f"<ENV> bad speed command ignored: {cmd!r}")
+                    continue
+                if not speed > 0: #nan included
+                    print(f"<ENV> speed must be positive, {cmd!r} ignored")
+                    continue
+                self.clock.set_speed(speed, time.monotonic())
+                print(f"<ENV> clock {self.clock.describe()}")
+
+    def simulation_state(self):
+        """everything but the grid needed to go on from here (env's own thread only changes it, between ticks)"""
+        state = {
+            'ticks': self.ticks,
+            'raining': self.raining,
+            'drought': self.drought,
+            'random': random.getstate(),
+            'grass_rng': self.grass.rng.bit_generator.state,
+        }
+        if self.engine is not None:
+            state['engine'] = self.engine.snapshot()
+        return state
+
+    def restore_state(self, state):
+        self.ticks = state['ticks']
+        self.raining = state['raining']
+        self.drought = state['drought']
+        random.setstate(state['random'])
+        self.grass.rng.bit_generator.state = state['grass_rng']
+
+    def checkpoint(self):
+        """a copy of the grid under the lock (a memcpy of the cells or of the planes), the rest of the state is
+        read after it, decoding, pickling and writing the file are done in the background"""
         with self.lock:
-            #copy of the grid state
-            grid_copy = bytes(self.grid)
-            
-            #population count
-            counts = {'grass': 0, 'passive_prey': 0, 'active_prey': 0, 'predator': 0}
-            
-            for i in range(number_bytes):
-                val = self.grid[i]
-                if val == grass:
-                    counts['grass'] += 1
-                elif val == passive_prey:
-                    counts['passive_prey'] += 1
-                elif val == active_prey:
-                    counts['active_prey'] += 1
-                elif val == predator:
-                    counts['predator'] += 1
-
-        frame = {'grid': grid_copy, 'counts': counts, 'raining': self.raining, 'drought': self.drought}
-        
-        #sending frame to display
-        try:
-            display_queue.put_nowait(frame)
-        except:
-            pass  #queue full, dropping this frame
+            captured = self.grid.capture()
+        return self.checkpointer.save(captured, self.simulation_state(), self.ticks, self.grid.decode)
+
+    def find_empty_spot(self):
+        """find random empty spot for new animal, -1 only when the grid is full"""
+        return self.grid.random_empty()
+
+    def growing_grass(self):
+        """growing grass on every empty cell at once unless drought is active, returns how many cells grew"""
+        if self.drought:
+            return 0
+
+        draws, chance = self.grass.draw(self.raining) #random numbers drawn before taking the lock
+        with self.lock:
+            return self.grass.grow(self.grid, draws, chance)
+
+    def frame_wanted(self):
+        """a frame is worth publishing: something changed since the last one, or a reader lost track of them"""
+        return self.changed or self.ring.want_key_mv[0] or (self.broadcast is not None and self.broadcast.behind())
+
+    def send_frame(self):
+        """publish grid frame"""
+        self.changed = False
+        with self.lock: #every band, in order: a consistent snapshot, only copied under the lock
+            population = self.grid.counts()
+            self.frame_capture = self.grid.capture(self.frame_capture) #a memcpy of the cells (or of the planes)
+        counts = (population[grass], population[passive_prey], population[active_prey], population[predator])
+
+        #the diff against the previous frame, the publish and the recording run on our copy, the animals go on
+        cells = self.grid.decode(self.frame_capture)
+        seq = self.ring.publish(cells, counts, self.raining, self.drought)
+        if self.recorder is not None:
+            with self.stats.timer('record'):
+                self.recorder.record(cells, counts, self.raining, self.drought, self.ticks) #a copy, written by another thread
+            self.stats.set('record_dropped', self.recorder.dropped)
+
+        if self.broadcast is not None: #from env's own copy of the frame
+            with self.stats.timer('broadcast'):
+                self.broadcast.publish(seq, self.ring.prev, self.ring.last_changed, counts, self.raining, self.drought)
+            self.stats.set('broadcast_dropped', self.broadcast.dropped)
+
+        self.frames += 1
+        self.stats.set('animals', counts[1] + counts[2] + counts[3])
+        self.stats.set('frame_bytes', self.ring.bytes_published)
+        self.last_counts = {'grass': counts[0], 'passive_prey': counts[1], 'active_prey': counts[2], 'predator': counts[3]}
 
     def cleanup(self):
         """cleaning up resources"""
         print("<ENV> cleaning up resources...")
         if hasattr(self, 'server_sock'):
             self.server_sock.close()
-        if hasattr(self, 'shared'):
-            self.shared.close()
+        if getattr(self, 'unix_sock', None) is not None:
+            self.unix_sock.close()
+            if os.path.exists(UNIX_PATH):
+                os.unlink(UNIX_PATH)
+        if getattr(self, 'broadcast', None) is not None:
+            self.broadcast.close()
+            self.broadcast = None
+        if getattr(self, 'checkpointer', None) is not None:
+            self.checkpointer.wait()
+            self.checkpoint() #last state, resuming starts right here
+            self.checkpointer.close()
+            self.checkpointer = None
+        self.engine = None #releasing the numpy view before closing the segment
+        if getattr(self, 'recorder', None) is not None:
+            self.recorder.close()
+            self.recorder = None
+        if getattr(self, 'shards', None) is not None:
+            self.shards.stop()
+            self.shards = None
+        if getattr(self, 'table', None) is not None:
+            self.table.close()
             if self.is_owner:
-                try:
-                    self.shared.unlink()
-                except:
-                    pass
\ No newline at end of file
+                self.table.unlink()
+            self.table = None
+        if hasattr(self, 'stats_page'):
+            if self.stats_path:
+                self.stats_page.dump(self.stats_path) #final counters
+            self.stats = self.lock.stats = None
+            self.stats_page.close()
+            if self.is_owner:
+                self.stats_page.unlink()
+        if hasattr(self, 'ring'):
+            self.ring.close()
+            if self.is_owner:
+                self.ring.unlink()
+        if hasattr(self, 'grid'):
+            self.grid.close()
+            if self.is_owner:
+                self.grid.unlink()
\ No newline at end of file
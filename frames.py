@@ -0,0 +1,242 @@
+from multiprocessing import shared_memory
+import struct
+import numpy as np
+
+
+#segment layout:
+#  header (64 bytes): magic, width, height, number of slots, latest published sequence number,
+#                     keyframe request (set by a reader that lost track, cleared by env)
+#  slots: meta (64 bytes: sequence word, kind, number of changed cells, counts, raining, drought)
+#         + data, room for the whole grid padded to 8 bytes
+#the sequence word of a slot is odd while env writes it, 2*seq once published
+#a keyframe holds the whole grid, a delta the cells that changed since the previous sequence number:
+#positions (uint32) then values (uint8). readers keep their own copy of the grid and apply the deltas
+#they missed while they are still in the ring, else they wait for the next keyframe
+magic = b"CFRM"
+header_format = "4sIII" #magic, width, height, number of slots
+latest_offset = 16
+want_key_offset = 24
+header_size = 64
+meta_format = "qq4qBB" #kind, changed cells, grass, passive_prey, active_prey, predator, raining, drought
+meta_offset = 8 #after the sequence word
+meta_size = 64
+keyframe = 0
+delta = 1
+key_interval = 90 #frames between two keyframes at most (3 s at 30 FPS)
+
+count_names = ('grass', 'passive_prey', 'active_prey', 'predator')
+
+
+def frames_name(grid_name):
+    """name of the frame segment going with a grid segment"""
+    return f"{grid_name}_frames"
+
+
+class Frame:
+    """one frame as seen by a reader: cells is the reader's copy of the grid (never torn),
+    changed the positions updated since the previous frame read (None: take the whole grid)"""
+
+    def __init__(self, seq, cells, changed, counts, raining, drought):
+        self.seq = seq
+        self.cells = cells
+        self.changed = changed
+        self.counts = counts
+        self.raining = raining
+        self.drought = drought
+
+    def valid(self):
+        return True
+
+
+class FrameRing:
+    """ring of frames in shared memory: env publishes keyframes and deltas, readers rebuild the latest grid
+    (seqlock style, a slot overwritten while being read is dropped)"""
+
+    def __init__(self, name, width=None, height=None, create=False, n_slots=8):
+        if create:
+            size = width * height
+            slot_size = meta_size + (size + 7) // 8 * 8
+            total = header_size + n_slots * slot_size
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+            except FileExistsError:
+                old_shm = shared_memory.SharedMemory(name=name)
+                old_shm.close()
+                old_shm.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+            struct.pack_into(header_format, self.shm.buf, 0, magic, width, height, n_slots)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            found, width, height, n_slots = struct.unpack_from(header_format, self.shm.buf, 0)
+            if found != magic:
+                self.shm.close()
+                raise ValueError(f"shared memory {name} is not a circle frame ring")
+
+        self.name = name
+        self.is_owner = create
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.n_slots = n_slots
+        self.slot_size = meta_size + (self.size + 7) // 8 * 8
+
+        buf = self.shm.buf
+        self.latest_mv = buf[latest_offset:latest_offset + 8].cast("q")
+        self.want_key_mv = buf[want_key_offset:want_key_offset + 8].cast("q")
+        self.seqs_mv = []
+        self.slot_data = []
+        for slot in range(n_slots):
+            start = self.slot_offset(slot)
+            self.seqs_mv.append(buf[start:start + 8].cast("q"))
+            self.slot_data.append(np.ndarray((self.size,), dtype=np.uint8, buffer=buf, offset=start + meta_size))
+
+        #writer side
+        self.prev = None #grid of the latest published frame
+        self.since_key = 0
+        self.last_changed = None #positions of the latest delta, None after a keyframe
+        self.keyframes = 0
+        self.deltas = 0
+        self.bytes_published = 0
+
+        #reader side
+        self.cells = None #our copy of the grid, at sequence number applied
+        self.applied = 0
+        self.changed = [] #positions applied since the last frame handed out, None: the whole grid
+        self.last_seq = 0
+        self.skipped = 0
+        self.torn = 0
+
+    def slot_offset(self, slot):
+        """where a slot starts in the segment"""
+        return header_size + slot * self.slot_size
+
+    def publish(self, cells, population, raining, drought):
+        """env side: writing what changed since the previous frame (or the whole grid) into the next slot,
+        then making it the latest"""
+        cells = np.asarray(cells, dtype=np.uint8).reshape(self.size)
+        kind = delta
+        if self.prev is None or self.want_key_mv[0] or self.since_key >= key_interval:
+            kind = keyframe
+        else:
+            changed = np.flatnonzero(cells != self.prev)
+            if 5 * len(changed) >= self.size: #the delta would outweigh the grid
+                kind = keyframe
+
+        seq = self.latest_mv[0] + 1
+        slot = seq % self.n_slots
+        data = self.slot_data[slot]
+        self.seqs_mv[slot][0] = 2 * seq - 1 #odd: readers of this slot must drop what they read
+        if kind == keyframe:
+            self.want_key_mv[0] = 0
+            np.copyto(data, cells)
+            if self.prev is None:
+                self.prev = cells.copy()
+            else:
+                np.copyto(self.prev, cells)
+            n = self.size
+            self.since_key = 0
+            self.last_changed = None
+            self.keyframes += 1
+            self.bytes_published += n
+        else:
+            n = len(changed)
+            values = cells[changed]
+            data[:4 * n].view(np.uint32)[:] = changed
+            data[4 * n:5 * n] = values
+            self.prev[changed] = values
+            self.since_key += 1
+            self.last_changed = changed
+            self.deltas += 1
+            self.bytes_published += 5 * n
+        struct.pack_into(meta_format, self.shm.buf, self.slot_offset(slot) + meta_offset, kind, n, *population, raining, drought)
+        self.seqs_mv[slot][0] = 2 * seq
+        self.latest_mv[0] = seq
+        return seq
+
+    def read(self):
+        """display side: the latest frame if there is a new one, None otherwise"""
+        seq = self.latest_mv[0]
+        if seq == 0 or seq == self.last_seq:
+            return None
+        if self.cells is None:
+            self.cells = np.zeros(self.size, dtype=np.uint8)
+
+        #newest keyframe we didn't apply yet, else the deltas following our copy
+        oldest = max(seq - self.n_slots + 1, 1)
+        start = None
+        for s in range(seq, max(oldest, self.applied + 1) - 1, -1):
+            meta = self.read_meta(s)
+            if meta is None:
+                break
+            if meta[0] == keyframe:
+                start = s
+                break
+        if start is None:
+            if self.applied == 0 or self.applied + 1 < oldest:
+                self.want_key_mv[0] = 1 #fell behind the ring: env sends the whole grid next frame
+                return None
+            start = self.applied + 1
+
+        for s in range(start, seq + 1):
+            slot = s % self.n_slots
+            meta = self.read_meta(s)
+            if meta is None:
+                return self.lost()
+            kind, n = meta[0], meta[1]
+            if kind == keyframe:
+                np.copyto(self.cells, self.slot_data[slot])
+                if self.seqs_mv[slot][0] != 2 * s:
+                    self.applied = 0 #our copy is garbage now
+                    return self.lost()
+                self.changed = None
+            else:
+                data = self.slot_data[slot]
+                positions = data[:4 * n].view(np.uint32).copy()
+                values = data[4 * n:5 * n].copy()
+                if self.seqs_mv[slot][0] != 2 * s:
+                    return self.lost()
+                self.cells[positions] = values
+                if self.changed is not None:
+                    self.changed.append(positions)
+            self.applied = s
+
+        if self.last_seq:
+            self.skipped += seq - self.last_seq - 1
+        self.last_seq = seq
+        changed = self.changed
+        if changed is not None:
+            changed = changed[0] if len(changed) == 1 else np.concatenate(changed) if changed else np.zeros(0, dtype=np.uint32)
+        self.changed = []
+        counts = dict(zip(count_names, meta[2:6]))
+        return Frame(seq, self.cells, changed, counts, bool(meta[6]), bool(meta[7]))
+
+    def read_meta(self, s):
+        """meta of sequence number s, None if its slot holds another one by now"""
+        slot = s % self.n_slots
+        if self.seqs_mv[slot][0] != 2 * s:
+            return None
+        meta = struct.unpack_from(meta_format, self.shm.buf, self.slot_offset(slot) + meta_offset)
+        if self.seqs_mv[slot][0] != 2 * s:
+            return None
+        return meta
+
+    def lost(self):
+        """env overwrote a slot while we read it: asking for a keyframe"""
+        self.torn += 1
+        self.want_key_mv[0] = 1
+        return None
+
+    def close(self):
+        """detaching from the segment (frames handed out must be dropped before)"""
+        self.slot_data = []
+        for view in self.seqs_mv + [self.latest_mv, self.want_key_mv]:
+            view.release()
+        self.seqs_mv = []
+        self.shm.close()
+
+    def unlink(self):
+        """destroying the segment, only for its owner"""
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,45 @@
+import numpy as np
+
+
+grass = 1 #same code as env.grass
+empty = 0
+scale = 65536 #chances are compared as 16 bit integers (1/65536 steps), half the random bytes of float32
+
+
+class GrassModel:
+    """grass growth on the whole grid in one numpy step per tick: every empty cell grows grass with its own
+    probability (field), times rain_factor when raining, plus spread for each neighbouring grass cell"""
+
+    def __init__(self, width, height, rate, rain_factor=2.5, spread=0.0, seed=None):
+        self.width = width
+        self.height = height
+        self.rain_factor = rain_factor
+        self.spread = spread
+        self.rng = np.random.default_rng(seed)
+        #extra threshold for 0 to 4 grass neighbours
+        self.spread_steps = np.minimum(np.arange(5) * round(spread * scale), scale - 1).astype(np.uint16)
+        self.set_field(np.full(width * height, rate, dtype=np.float32))
+
+    def set_field(self, field):
+        """per cell chance to grow each tick (fertile zones...)"""
+        self.field = np.asarray(field, dtype=np.float32).reshape(self.width * self.height)
+        self.thresholds = {} #raining -> uint16 thresholds, computed once
+
+    def threshold(self, raining):
+        if raining not in self.thresholds:
+            chance = self.field * self.rain_factor if raining else self.field
+            self.thresholds[raining] = np.clip(np.rint(chance * scale), 0, scale - 1).astype(np.uint16)
+        return self.thresholds[raining]
+
+    def draw(self, raining):
+        """per cell growth test, everything that doesn't need the cells (done outside the lock)"""
+        return self.rng.integers(0, scale, len(self.field), dtype=np.uint16), self.threshold(raining)
+
+    def grow(self, grid, draws, threshold):
+        """writing the new grass (band locks held by the caller), returns how many cells grew"""
+        if self.spread:
+            extra = self.spread_steps[grid.neighbours(grass)]
+            threshold = np.minimum(threshold, scale - 1 - extra) + extra
+        positions = np.flatnonzero((draws < threshold) & grid.where(empty))
+        grid.set_many(positions, grass)
+        return len(positions)
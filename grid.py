@@ -0,0 +1,592 @@
+from multiprocessing import shared_memory
+import random
+import struct
+import numpy as np
+
+
+#segment layout:
+#  header (64 bytes): magic, width, height, number of bands
+#  band table: for each band of rows, the number of cells holding each code (code 0: free cells)
+#  cells: one byte per cell (row by row), padded to 8 bytes
+#  free cell index: free[] empty positions, each band keeps its own dense list in its own range of free[],
+#                   slot[] position -> index in free (-1 if not empty)
+#a band only touches its own part of the table and of the index, so bands can be written under
+#different locks (see locks.StripedLock)
+magic = b"CIRC"
+packed_magic = b"CIRB"
+header_format = "4sIII" #magic, width, height, number of bands
+header_size = 64
+
+empty = 0 #same code as env.empty
+n_codes = 5 #empty, grass, passive_prey, predator, active_prey
+
+
+def band_rows(height, n_bands):
+    """number of rows in each band (the last one may be shorter)"""
+    return -(-height // n_bands)
+
+
+def padded(n, to=8):
+    """n rounded up to a multiple of to"""
+    return (n + to - 1) // to * to
+
+
+def layout(width, height, n_bands):
+    """offsets of the band table, cells, free list and slot map, and the total size"""
+    size = width * height
+    table_offset = header_size
+    cells_offset = padded(table_offset + 8 * n_codes * n_bands, 64)
+    free_offset = cells_offset + padded(size)
+    slot_offset = free_offset + 4 * size
+    return table_offset, cells_offset, free_offset, slot_offset, slot_offset + 4 * size
+
+
+def open_grid(name):
+    """attaching an existing grid segment, whatever its layout (SharedGrid or PackedGrid)"""
+    shm = shared_memory.SharedMemory(name=name)
+    found = bytes(shm.buf[:4])
+    shm.close()
+    return PackedGrid(name) if found == packed_magic else SharedGrid(name)
+
+
+class SharedGrid:
+    """the shared grid segment, every process attaching it reads the true shape from the header.
+    writes go through set/set_many (lock of the band held by the caller) so the free cell index and the
+    population counters stay right"""
+    packed = False
+
+    def __init__(self, name, width=None, height=None, create=False, n_bands=1):
+        if create:
+            n_bands = max(1, min(n_bands, height))
+            total = layout(width, height, n_bands)[-1]
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+            except FileExistsError:
+                #clean old mem
+                try:
+                    old_shm = shared_memory.SharedMemory(name=name)
+                    old_shm.close()
+                    old_shm.unlink()
+                except FileNotFoundError:
+                    pass
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+            struct.pack_into(header_format, self.shm.buf, 0, magic, width, height, n_bands)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            found, width, height, n_bands = struct.unpack_from(header_format, self.shm.buf, 0)
+            if found != magic:
+                self.shm.close()
+                raise ValueError(f"shared memory {name} is not a circle grid")
+
+        self.name = name
+        self.is_owner = create
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.n_bands = n_bands
+        self.band_cells = band_rows(height, n_bands) * width #cells per band
+        self.band_start = [min(b * self.band_cells, self.size) for b in range(n_bands + 1)]
+
+        #same bytes, two views: numpy for bulk work, memoryview for cheap single cell access
+        table_offset, cells_offset, free_offset, slot_offset, end = layout(width, height, n_bands)
+        buf = self.shm.buf
+        self.population = np.ndarray((n_bands, n_codes), dtype=np.int64, buffer=buf, offset=table_offset)
+        self.cells = np.ndarray((self.size,), dtype=np.uint8, buffer=buf, offset=cells_offset)
+        self.free = np.ndarray((self.size,), dtype=np.int32, buffer=buf, offset=free_offset)
+        self.slot = np.ndarray((self.size,), dtype=np.int32, buffer=buf, offset=slot_offset)
+        self.population_mv = buf[table_offset:table_offset + 8 * n_codes * n_bands].cast("q")
+        self.buf = buf[cells_offset:cells_offset + self.size]
+        self.free_mv = buf[free_offset:slot_offset].cast("i")
+        self.slot_mv = buf[slot_offset:end].cast("i")
+
+        if create:
+            self.rebuild_index()
+
+    def band_of(self, pos):
+        """band holding a cell"""
+        return pos // self.band_cells
+
+    def snapshot(self):
+        """the cells one byte each: the live array here, to be read under the lock"""
+        return self.cells
+
+    def capture(self, out=None):
+        """the cheapest private copy of the grid (into out when given), the only part of a frame or a
+        checkpoint done under the lock: decode() it after releasing the lock"""
+        if out is None:
+            return self.cells.copy()
+        np.copyto(out, self.cells)
+        return out
+
+    def decode(self, captured):
+        """the cells one byte each out of a capture(): already them here"""
+        return captured
+
+    def rows(self, lo, hi):
+        """rows [lo, hi) as a (hi - lo, width) view of the live cells"""
+        return self.cells[lo * self.width:hi * self.width].reshape(-1, self.width)
+
+    def load(self, cells):
+        """writing a whole grid at once (every band locked by the caller)"""
+        self.cells[:] = cells
+        self.rebuild_index()
+
+    def where(self, code):
+        """True on the cells holding code"""
+        return self.cells == code
+
+    def neighbours(self, code):
+        """number of cells holding code among the 4 neighbours of each cell"""
+        g = (self.cells == code).view(np.uint8).reshape(self.height, self.width)
+        n = np.zeros_like(g)
+        n[1:, :] += g[:-1, :]
+        n[:-1, :] += g[1:, :]
+        n[:, 1:] += g[:, :-1]
+        n[:, :-1] += g[:, 1:]
+        return n.ravel()
+
+    def rebuild_index(self):
+        """recomputing the free cell index and the counters from the cells"""
+        self.slot[:] = -1
+        for band in range(self.n_bands):
+            start, stop = self.band_start[band], self.band_start[band + 1]
+            self.population[band] = np.bincount(self.cells[start:stop], minlength=n_codes)[:n_codes]
+            positions = start + np.flatnonzero(self.cells[start:stop] == empty).astype(np.int32)
+            n = len(positions)
+            self.free[start:start + n] = positions
+            self.slot[positions] = np.arange(start, start + n, dtype=np.int32)
+
+    def counts(self):
+        """number of cells holding each code, without scanning the grid"""
+        return self.population.sum(axis=0).tolist()
+
+    def free_count(self):
+        """number of empty cells"""
+        return int(self.population[:, empty].sum())
+
+    def random_empty(self):
+        """random empty cell in O(bands), -1 if the grid is full (every band locked by the caller)"""
+        total = self.free_count()
+        if total == 0:
+            return -1
+        r = random.randrange(total)
+        for band in range(self.n_bands):
+            n = self.population_mv[band * n_codes + empty]
+            if r < n:
+                return self.free_mv[self.band_start[band] + r]
+            r -= n
+        return -1
+
+    def empties(self):
+        """every empty cell (every band locked by the caller)"""
+        lists = [self.free[start:start + n] for start, n in zip(self.band_start, self.population[:, empty].tolist())]
+        return np.concatenate(lists) if len(lists) > 1 else lists[0]
+
+    def set(self, pos, value):
+        """writing one cell"""
+        old = self.buf[pos]
+        if old == value:
+            return
+        band = pos // self.band_cells
+        row = band * n_codes
+        n = self.population_mv[row + empty]
+        self.buf[pos] = value
+        self.population_mv[row + old] -= 1
+        self.population_mv[row + value] += 1
+        if old == empty:
+            #swap-remove pos from the band list
+            last = self.band_start[band] + n - 1
+            s = self.slot_mv[pos]
+            moved = self.free_mv[last]
+            self.free_mv[s] = moved
+            self.slot_mv[moved] = s
+            self.slot_mv[pos] = -1
+        elif value == empty:
+            end = self.band_start[band] + n
+            self.free_mv[end] = pos
+            self.slot_mv[pos] = end
+
+    def set_many(self, positions, values):
+        """writing many distinct cells at once"""
+        positions = np.asarray(positions)
+        if len(positions) == 0:
+            return
+        values = np.broadcast_to(np.asarray(values, dtype=np.uint8), positions.shape)
+        if self.n_bands == 1:
+            self.set_band(0, positions, values)
+            return
+        bands = positions // self.band_cells
+        order = np.argsort(bands, kind="stable")
+        bands = bands[order]
+        bounds = np.flatnonzero(np.diff(bands)) + 1
+        for chunk in np.split(order, bounds):
+            self.set_band(int(positions[chunk[0]] // self.band_cells), positions[chunk], values[chunk])
+
+    def set_band(self, band, positions, values):
+        """set_many for cells all inside one band"""
+        old = self.cells[positions]
+        filled = positions[(old == empty) & (values != empty)]
+        freed = positions[(old != empty) & (values == empty)]
+        start = self.band_start[band]
+        n = start + int(self.population[band, empty]) #end of the band list before this write
+        self.cells[positions] = values
+        self.population[band] -= np.bincount(old, minlength=n_codes)
+        self.population[band] += np.bincount(values, minlength=n_codes)
+
+        #a freed cell takes the slot of a filled one (the common case: an animal moving)
+        k = min(len(filled), len(freed))
+        if k:
+            s = self.slot[filled[:k]]
+            self.free[s] = freed[:k]
+            self.slot[freed[:k]] = s
+            self.slot[filled[:k]] = -1
+
+        if len(freed) > k:
+            #appending the other freed cells
+            extra = freed[k:]
+            self.free[n:n + len(extra)] = extra
+            self.slot[extra] = np.arange(n, n + len(extra), dtype=np.int32)
+        elif len(filled) > k:
+            #removing the other filled cells: holes before the new end are refilled from the tail
+            extra = filled[k:]
+            removed = self.slot[extra]
+            end = n - len(extra)
+            tail_kept = np.ones(n - end, dtype=bool)
+            tail_kept[removed[removed >= end] - end] = False
+            holes = removed[removed < end]
+            movers = self.free[end:n][tail_kept]
+            self.free[holes] = movers
+            self.slot[movers] = holes
+            self.slot[extra] = -1
+
+    def close(self):
+        """detaching from the segment (views handed out must be dropped before)"""
+        self.cells = self.free = self.slot = self.population = None
+        for view in (self.buf, self.free_mv, self.slot_mv, self.population_mv):
+            view.release()
+        self.shm.close()
+
+    def unlink(self):
+        """destroying the segment, only for its owner"""
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+#packed layout (PackedGrid), for very large worlds:
+#  header (64 bytes): packed_magic, width, height, number of bands
+#  one bit plane per code but empty (grass, passive_prey, predator, active_prey), 64 cells per uint64 word
+#  each band is padded to whole words, so two band locks never guard bits of the same word
+#no counters and no free cell index: counts are popcounts, empty cells the bits set in no plane.
+#half a byte per cell instead of nine (cells, free list, slot map). words are read as little endian bytes
+plane_codes = (1, 2, 3, 4)
+
+
+def packed_layout(width, height, n_bands):
+    """words per band, words per plane and the total size"""
+    band_words = -(-band_rows(height, n_bands) * width // 64)
+    words = n_bands * band_words
+    return band_words, words, header_size + 8 * len(plane_codes) * words
+
+
+def shifted(words, k):
+    """bit i of the result is bit i - k of words (a run of bits, zeros shifted in)"""
+    out = np.zeros_like(words)
+    q, r = divmod(abs(k), 64)
+    if q >= len(words):
+        return out
+    if k >= 0:
+        src = words[:len(words) - q]
+        out[q:] = src << r
+        if r:
+            out[q + 1:] |= src[:-1] >> (64 - r)
+    else:
+        src = words[q:]
+        out[:len(words) - q] = src >> r
+        if r:
+            out[:len(words) - q - 1] |= src[1:] << (64 - r)
+    return out
+
+
+def unpack_codes(bit0, bit1, bit2):
+    """three runs of bits -> one byte per bit: bit0 + 2 * bit1 + 4 * bit2"""
+    out = np.unpackbits(bit0.view(np.uint8), bitorder="little")
+    out |= np.unpackbits(bit1.view(np.uint8), bitorder="little") << 1
+    out |= np.unpackbits(bit2.view(np.uint8), bitorder="little") << 2
+    return out
+
+
+class PackedCells:
+    """read side of a PackedGrid shaped like SharedGrid.cells / SharedGrid.buf: cells[pos] (an int),
+    cells[positions] and cells[a:b] (uint8 arrays), len, iteration and np.asarray (the whole grid decoded).
+    writes go through the grid's set/set_many"""
+
+    def __init__(self, grid):
+        self.grid = grid
+
+    def __len__(self):
+        return self.grid.size
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.grid.get(int(key))
+        if isinstance(key, slice):
+            return self.grid.values(np.arange(*key.indices(self.grid.size)))
+        return self.grid.values(key)
+
+    def __iter__(self):
+        return iter(self.grid.snapshot().tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        cells = self.grid.snapshot()
+        return cells if dtype is None else cells.astype(dtype)
+
+
+class PackedGrid:
+    """the grid as bit planes in a shared segment, same interface as SharedGrid (cells and buf are
+    PackedCells). set/set_many write under the lock of the band like SharedGrid"""
+    packed = True
+
+    def __init__(self, name, width=None, height=None, create=False, n_bands=1):
+        if create:
+            n_bands = max(1, min(n_bands, height))
+            total = packed_layout(width, height, n_bands)[-1]
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+            except FileExistsError:
+                try:
+                    old_shm = shared_memory.SharedMemory(name=name)
+                    old_shm.close()
+                    old_shm.unlink()
+                except FileNotFoundError:
+                    pass
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+            struct.pack_into(header_format, self.shm.buf, 0, packed_magic, width, height, n_bands)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            found, width, height, n_bands = struct.unpack_from(header_format, self.shm.buf, 0)
+            if found != packed_magic:
+                self.shm.close()
+                raise ValueError(f"shared memory {name} is not a packed circle grid")
+
+        self.name = name
+        self.is_owner = create
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.n_bands = n_bands
+        self.band_cells = band_rows(height, n_bands) * width
+        self.band_start = [min(b * self.band_cells, self.size) for b in range(n_bands + 1)]
+        self.band_words, self.words, end = packed_layout(width, height, n_bands)
+        self.pad = self.band_words * 64 - self.band_cells #bits between two bands
+
+        buf = self.shm.buf
+        self.planes = np.ndarray((len(plane_codes), self.words), dtype=np.uint64, buffer=buf, offset=header_size)
+        self.planes_mv = buf[header_size:end].cast("Q") #single cell access without numpy
+        self.cells = self.buf = PackedCells(self)
+        self.edges = {} #words -> bits of the cells having a left / right neighbour, made on first use
+
+    def band_of(self, pos):
+        return pos // self.band_cells
+
+    def bits(self, positions):
+        """bit index of cells in a plane (bands are padded to whole words)"""
+        positions = np.asarray(positions, dtype=np.int64)
+        return positions + (positions // self.band_cells) * self.pad if self.pad else positions
+
+    def strip(self, flat):
+        """one value per bit of a plane -> one per cell (band padding dropped)"""
+        if self.pad:
+            flat = flat.reshape(self.n_bands, -1)[:, :self.band_cells].reshape(-1)
+        return flat[:self.size]
+
+    def expand(self, words):
+        """bits of a plane (or of an expression of planes) -> one bool per cell"""
+        return self.strip(np.unpackbits(words.view(np.uint8), bitorder="little").view(bool))
+
+    def compress(self, mask):
+        """one bool per cell -> bits of a plane, padding bits cleared"""
+        flat = np.zeros(self.n_bands * self.band_cells, dtype=bool)
+        flat[:self.size] = np.asarray(mask, dtype=bool).reshape(-1)
+        rows = np.zeros((self.n_bands, self.band_words * 64), dtype=bool)
+        rows[:, :self.band_cells] = flat.reshape(self.n_bands, self.band_cells)
+        return np.packbits(rows, bitorder="little").view(np.uint64)
+
+    def occupied(self):
+        return self.planes[0] | self.planes[1] | self.planes[2] | self.planes[3]
+
+    def get(self, pos):
+        """code of one cell"""
+        bit = pos + (pos // self.band_cells) * self.pad
+        word, shift = bit >> 6, bit & 63
+        for i, code in enumerate(plane_codes):
+            if self.planes_mv[i * self.words + word] >> shift & 1:
+                return code
+        return empty
+
+    def values(self, positions):
+        """codes of many cells, any shape"""
+        bits = self.bits(positions)
+        words, shifts = bits >> 6, (bits & 63).astype(np.uint64)
+        result = np.zeros(bits.shape, dtype=np.uint8)
+        for i, code in enumerate(plane_codes):
+            result += ((self.planes[i][words] >> shifts) & np.uint64(1)).astype(np.uint8) * np.uint8(code)
+        return result
+
+    def snapshot(self):
+        """the cells one byte each, decoded into a new array (under the lock: capture() then decode() keeps
+        the decoding out of it)"""
+        return self.decode(self.planes)
+
+    def capture(self, out=None):
+        """copy of the planes, the whole grid in half a byte per cell (into out when given)"""
+        if out is None:
+            return self.planes.copy()
+        np.copyto(out, self.planes)
+        return out
+
+    def decode(self, planes):
+        """the cells one byte each out of captured planes: they are ored into the 3 bits of the codes
+        (grass 1, passive_prey 2, predator 3, active_prey 4) first, then 3 unpacks instead of 4"""
+        grass, passive, predator, active = planes
+        return self.strip(unpack_codes(grass | predator, passive | predator, active))
+
+    def rows(self, lo, hi):
+        """rows [lo, hi) decoded into a (hi - lo, width) array, only the words holding them unpacked"""
+        start, stop = lo * self.width, hi * self.width
+        if stop <= start:
+            return np.zeros((0, self.width), dtype=np.uint8)
+        parts = []
+        for band in range(self.band_of(start), self.band_of(stop - 1) + 1):
+            first = max(start, self.band_start[band]) + band * self.pad
+            last = min(stop, self.band_start[band + 1]) + band * self.pad
+            w0, w1 = first >> 6, (last + 63) >> 6
+            grass, passive, predator, active = self.planes[:, w0:w1]
+            parts.append(unpack_codes(grass | predator, passive | predator, active)[first - 64 * w0:last - 64 * w0])
+        return np.concatenate(parts).reshape(-1, self.width)
+
+    def load(self, cells):
+        """writing a whole grid at once (every band locked by the caller)"""
+        cells = np.asarray(cells, dtype=np.uint8).reshape(-1)
+        for i, code in enumerate(plane_codes):
+            self.planes[i] = self.compress(cells == code)
+
+    def rebuild_index(self):
+        """nothing to rebuild, the planes are the only state"""
+
+    def band_counts(self):
+        """(bands, codes) cells holding each code in each band, popcounts of the planes"""
+        population = np.zeros((self.n_bands, n_codes), dtype=np.int64)
+        counts = np.bitwise_count(self.planes.reshape(len(plane_codes), self.n_bands, self.band_words)).sum(axis=2, dtype=np.int64)
+        population[:, list(plane_codes)] = counts.T
+        population[:, empty] = np.diff(self.band_start) - counts.sum(axis=0)
+        return population
+
+    def counts(self):
+        """number of cells holding each code, popcount of each plane"""
+        counts = np.bitwise_count(self.planes).sum(axis=1, dtype=np.int64).tolist()
+        return [self.size - sum(counts)] + counts
+
+    def free_count(self):
+        return self.size - int(np.bitwise_count(self.planes).sum(dtype=np.int64))
+
+    def random_empty(self, tries=32):
+        """random empty cell, -1 if the grid is full (every band locked by the caller).
+        a few random picks first, the list of empty cells when the grid is that full"""
+        for _ in range(tries):
+            pos = random.randrange(self.size)
+            if self.get(pos) == empty:
+                return pos
+        free = self.empties()
+        return int(free[random.randrange(len(free))]) if len(free) else -1
+
+    def empties(self):
+        """every empty cell (every band locked by the caller)"""
+        return np.flatnonzero(self.where(empty)).astype(np.int32)
+
+    def where(self, code):
+        """True on the cells holding code"""
+        if code == empty:
+            return self.expand(~self.occupied())
+        return self.expand(self.planes[code - 1])
+
+    def neighbours(self, code):
+        """number of cells holding code among the 4 neighbours of each cell, from shifts of whole words:
+        left/right neighbours are the plane shifted by one bit, up/down by a row (width bits)"""
+        if self.pad or code == empty:
+            g = self.run(self.where(code)) #bands one after the other, no padding, nothing past the last cell
+        else:
+            g = self.planes[code - 1]
+        if len(g) not in self.edges:
+            column = np.arange(self.size) % self.width
+            self.edges[len(g)] = [self.run(column > 0, len(g)), self.run(column < self.width - 1, len(g))]
+        has_left, has_right = self.edges[len(g)]
+        left = shifted(g, 1) & has_left
+        right = shifted(g, -1) & has_right
+        up = shifted(g, self.width)
+        down = shifted(g, -self.width)
+        #bit-sliced sum of the four neighbour planes: three bits per cell
+        s1, c1 = left ^ right, left & right
+        s2, c2 = up ^ down, up & down
+        bit0 = s1 ^ s2
+        carry = s1 & s2
+        bit1 = c1 ^ c2 ^ carry
+        bit2 = c1 & c2
+        return unpack_codes(bit0, bit1, bit2)[:self.size]
+
+    def run(self, mask, words=None):
+        """one bool per cell -> a plain run of bits (no band padding) over words words"""
+        packed = np.packbits(mask, bitorder="little")
+        words = -(-len(packed) // 8) if words is None else words
+        return np.concatenate((packed, np.zeros(8 * words - len(packed), dtype=np.uint8))).view(np.uint64)
+
+    def set(self, pos, value):
+        """writing one cell"""
+        bit = pos + (pos // self.band_cells) * self.pad
+        word, mask = bit >> 6, 1 << (bit & 63)
+        for i, code in enumerate(plane_codes):
+            index = i * self.words + word
+            current = self.planes_mv[index]
+            if code == value:
+                if not current & mask:
+                    self.planes_mv[index] = current | mask
+            elif current & mask:
+                self.planes_mv[index] = current & ~mask
+
+    def set_many(self, positions, values):
+        """writing many distinct cells at once, one or-reduction per word touched"""
+        positions = np.asarray(positions)
+        if len(positions) == 0:
+            return
+        values = np.broadcast_to(np.asarray(values, dtype=np.uint8), positions.shape)
+        bits = self.bits(positions)
+        words, slot = np.unique(bits >> 6, return_inverse=True)
+        masks = np.left_shift(np.uint64(1), (bits & 63).astype(np.uint64))
+        touched = np.zeros(len(words), dtype=np.uint64)
+        np.bitwise_or.at(touched, slot, masks)
+        for i, code in enumerate(plane_codes):
+            plane = self.planes[i]
+            chosen = values == code
+            if chosen.all():
+                plane[words] |= touched
+                continue
+            kept = plane[words] & ~touched
+            if chosen.any():
+                new = np.zeros(len(words), dtype=np.uint64)
+                np.bitwise_or.at(new, slot[chosen], masks[chosen])
+                kept |= new
+            plane[words] = kept
+
+    def close(self):
+        """detaching from the segment (views handed out must be dropped before)"""
+        self.planes = None
+        self.planes_mv.release()
+        self.shm.close()
+
+    def unlink(self):
+        """destroying the segment, only for its owner"""
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
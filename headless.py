@@ -0,0 +1,125 @@
+import multiprocessing
+import argparse
+import time
+import os
+import env
+import checkpoint
+import broadcast
+import animals
+import supervisor
+from locks import StripedLock
+
+
+def run_headless(engine="batch", preys=20, predators=6, ticks=None, seconds=None, realtime=False, width=env.tab_size, height=env.tab_size, stripes=1, seed=None, record=None, checkpoint_path=None, checkpoint_every=60.0, resume=None, stats_path=None, stats_every=1.0, packed=False, spare_workers=supervisor.default_spare, max_animals=None, worker_lives=supervisor.default_max_lives):
+    """runs env and the animals without any display, returns a summary of the run"""
+    if engine == "process":
+        realtime = True #animal processes move on the wall clock: env ticking faster would only outgrow them
+    grid_lock = StripedLock(width, height, stripes)
+    birth_queue = multiprocessing.Queue()
+    env_proc = env.EnvProcess(grid_lock, engine, preys, predators, width, height, seed)
+    env_proc.realtime = realtime
+    env_proc.record_path = record
+    env_proc.checkpoint_path = checkpoint_path
+    env_proc.checkpoint_every = checkpoint_every
+    env_proc.resume_path = resume
+    env_proc.stats_path = stats_path
+    env_proc.stats_every = stats_every
+    env_proc.packed = packed
+    if max_animals is None and engine == "process":
+        max_animals = supervisor.default_cap
+    env_proc.max_animals = max_animals
+
+    pool = None
+    started = False #segments created and sockets listening: a last frame can go out
+    start_time = time.time()
+    start_ticks = 0
+    try:
+        env_proc.create_grid()
+        if not env_proc.listen():
+            return None
+        started = True
+
+        if engine == "process":
+            pool = supervisor.Supervisor(multiprocessing, grid_lock, birth_queue, spare_workers, max_animals, worker_lives)
+            pool.start(0 if resume is not None else preys + predators)
+            if resume is not None:
+                animals.adopt_population(grid_lock, pool)
+            else:
+                #env runs in this process: placing the population directly instead of asking over the socket
+                for kind, n in ((env.passive_prey, preys), (env.predator, predators)):
+                    status, positions = env_proc.spawn_animals(kind, n)
+                    for pos in positions:
+                        pool.place(kind, pos)
+
+        start_time = time.time()
+        start_ticks = env_proc.ticks
+        env_proc.loop(None, ticks, seconds)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        elapsed = time.time() - start_time
+        if pool is not None:
+            pool.stop()
+        if started:
+            env_proc.send_frame() #last population count
+        env_proc.cleanup()
+
+    return {
+        'engine': engine,
+        'ticks': env_proc.ticks - start_ticks,
+        'seconds': round(elapsed, 3),
+        'ticks_per_s': round((env_proc.ticks - start_ticks) / elapsed, 1) if elapsed > 0 else 0.0,
+        'frames': env_proc.frames,
+        'frame_bytes': env_proc.ring.bytes_published,
+        'counts': env_proc.last_counts,
+        'births': pool.latency() if pool is not None else None, #process engine
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="circle of life without display", fromfile_prefix_chars="@")
+    parser.add_argument("--engine", choices=["batch", "process", "sharded"], default="batch")
+    parser.add_argument("--width", type=int, default=env.tab_size, help="grid width in cells")
+    parser.add_argument("--height", type=int, default=env.tab_size, help="grid height in cells")
+    parser.add_argument("--preys", type=int, default=20)
+    parser.add_argument("--predators", type=int, default=6)
+    parser.add_argument("--stripes", type=int, default=os.cpu_count() or 1, help="number of row bands locked independently")
+    parser.add_argument("--ticks", type=int, default=None, help="stop after this many env ticks")
+    parser.add_argument("--seconds", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--realtime", action="store_true", help="keep the windowed pace instead of ticking as fast as possible (required by the process engine)")
+    parser.add_argument("--unix-socket", default=None, help="also serve the spawn protocol on this unix socket")
+    parser.add_argument("--seed", type=int, default=None, help="same seed, same run (batch engine)")
+    parser.add_argument("--grass-rate", type=float, default=env.grass_rate, help="chance for an empty cell to grow grass each tick")
+    parser.add_argument("--grass-spread", type=float, default=env.grass_spread, help="extra growth chance per neighbouring grass cell")
+    parser.add_argument("--record", default=None, help="record the run to this file (replay it with main.py --replay)")
+    parser.add_argument("--checkpoint", default=None, help="save the whole simulation to this file periodically and on exit")
+    parser.add_argument("--checkpoint-every", type=float, default=60.0, help="seconds between two checkpoints")
+    parser.add_argument("--resume", default=None, help="start from this checkpoint file (grid size taken from it)")
+    parser.add_argument("--broadcast", default=None, metavar="[HOST:]PORT", help="stream the frames to remote viewers (main.py --view HOST:PORT)")
+    parser.add_argument("--stats-jsonl", default=None, help="append the stats of every process to this file as json lines")
+    parser.add_argument("--stats-every", type=float, default=1.0, help="seconds between two lines of --stats-jsonl")
+    parser.add_argument("--packed", action="store_true", help="grid as one bit plane per species instead of one byte per cell")
+    parser.add_argument("--spare-workers", type=int, default=supervisor.default_spare, help="animal workers kept started and idle (process engine)")
+    parser.add_argument("--max-animals", type=int, default=None, help="population cap, sizes the animal table (default: 1000 for the process engine, a quarter of the cells otherwise)")
+    parser.add_argument("--set", action="append", default=[], type=env.parse_setting, metavar="NAME=VALUE", help="change an env setting (h_lim=30, food_gain=20...), repeatable")
+    args = parser.parse_args()
+    if args.engine == "process" and not args.realtime:
+        parser.error("--engine process needs --realtime, animal processes keep their own wall-clock pace")
+    if args.resume:
+        args.width, args.height = checkpoint.shape(args.resume)
+    env.configure(UNIX_PATH=args.unix_socket, grass_rate=args.grass_rate, grass_spread=args.grass_spread,
+                  BROADCAST=broadcast.parse_address(args.broadcast) if args.broadcast else None)
+    env.configure(**dict(args.set))
+
+    if args.ticks is None and args.seconds is None:
+        args.seconds = 10.0
+
+    summary = run_headless(args.engine, args.preys, args.predators, args.ticks, args.seconds, args.realtime, args.width, args.height, args.stripes, args.seed, args.record, args.checkpoint, args.checkpoint_every, args.resume, args.stats_jsonl, args.stats_every, args.packed, args.spare_workers, args.max_animals)
+    if summary is None:
+        return
+    print(f"<HEADLESS> {summary['ticks']} ticks in {summary['seconds']}s ({summary['ticks_per_s']} ticks/s), {summary['frames']} frames ({summary['frame_bytes'] / 1e6:.1f} MB published)")
+    print(f"<HEADLESS> final population: {summary['counts']}")
+
+
+if __name__ == "__main__":
+    main()
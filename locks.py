@@ -0,0 +1,54 @@
+import multiprocessing
+from grid import band_rows
+
+
+class StripedLock:
+    """one lock per band of rows, the same bands as grid.SharedGrid so a band's cells, free list and
+    counters are all covered by its lock.
+    `with lock:` takes every band (bulk writes, consistent snapshots), `with lock.cells(a, b):` only the
+    bands holding these cells. Bands are always taken in increasing order, so nobody can deadlock."""
+
+    def __init__(self, width, height, n_stripes=1, ctx=multiprocessing):
+        self.n_stripes = max(1, min(n_stripes, height))
+        self.band_cells = band_rows(height, self.n_stripes) * width
+        self.locks = [ctx.Lock() for _ in range(self.n_stripes)] #ctx: the context of the processes sharing them
+
+    def stripe_of(self, pos):
+        """band (and lock) holding a cell"""
+        return pos // self.band_cells
+
+    def __enter__(self):
+        for lock in self.locks:
+            lock.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        for lock in reversed(self.locks):
+            lock.release()
+        return False
+
+    def cells(self, *positions):
+        """guard for the bands of these cells (a move crossing a band border takes both)"""
+        return StripeGuard(self.locks, sorted({pos // self.band_cells for pos in positions}))
+
+    def bands(self, *stripes):
+        """guard for these bands"""
+        return StripeGuard(self.locks, sorted(set(stripes)))
+
+
+class StripeGuard:
+    """ordered acquire of some of the bands"""
+
+    def __init__(self, locks, stripes):
+        self.locks = locks
+        self.stripes = stripes
+
+    def __enter__(self):
+        for stripe in self.stripes:
+            self.locks[stripe].acquire()
+        return self
+
+    def __exit__(self, *exc):
+        for stripe in reversed(self.stripes):
+            self.locks[stripe].release()
+        return False
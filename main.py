@@ -1,233 +1,233 @@
-import pygame
 import multiprocessing
 from multiprocessing import shared_memory
+import argparse
 import time
-from queue import Empty
 import sys
+import os
 import env
 import animals
-
-#self.font = pygame.font.SysFont("Helvetica Neue", 16, bold=True)
-
-bg_color = (181, 136, 99)      # Light wood (maple/beech)
-grid_color = (240, 217, 181)   # Very light wood
-text_color = (60, 40, 20)      # Dark brown
-
-bg_color = (139, 69, 19)       # Dark walnut
-grid_color = (222, 184, 135)   # Light maple
-text_color = (255, 248, 220)   # Cream/cornsilk
-
-bg_color = (101, 67, 33)       # Dark mahogany
-grid_color = (205, 133, 63)    # Medium wood (peru)
-text_color = (255, 235, 205)   # Blanched almond
-#ui conf
-grid_pixel_size = env.tab_size * env.cell_size
-window_width = grid_pixel_size
-window_height = grid_pixel_size + 100 #extra space for text
-FPS = 30
-
-#colors
-bg_color = (15, 25, 40)
-grid_color = (30, 50, 70)
-text_color = (200, 230, 255)
-
-
-class Display:
-    def __init__(self, cmd_queue, display_queue):
-        pygame.init()
-        self.screen = pygame.display.set_mode((window_width, window_height))  #screen creation
-        pygame.display.set_caption("circle of life") #screen title
-        self.clock = pygame.time.Clock()
-        self.running = True
-        
-        #queues for comm
-        self.cmd_queue = cmd_queue #sending the comms to env
-        self.display_queue = display_queue  #receiving frames from env
-        
-        #actual state of the game
-        self.grid_data = bytes([env.empty] * env.number_bytes)
-        self.counts = {'grass': 0, 'passive_prey': 0, 'active_prey': 0, 'predator': 0} #counter
-        self.raining = False
-        self.drought = False
-        
-        #fonts definition
-        self.font = pygame.font.SysFont("Times New Roman", 16, bold=True)
-        self.font_small = pygame.font.SysFont("Times New Roman", 14)
-        
-        #loading the assets
-        self.images = {}
-        self.load_asset(env.grass, "grass.png", (34, 139, 34))
-        self.load_asset(env.passive_prey, "prey.png", (200, 200, 200))
-        self.load_asset(env.active_prey, "prey_active.png", (255, 255, 0))
-        self.load_asset(env.predator, "predator.png", (220, 20, 60))
-
-    def load_asset(self, key, path, color):
-        """load image or create colored squares if it doesn"t load as expected"""
-        try:
-            img = pygame.image.load(path) #loading img into memory
-            self.images[key] = pygame.transform.scale(img, (env.cell_size, env.cell_size)) #resizing the image to the actual size of the cells + saving
-        except:
-            surf = pygame.Surface((env.cell_size, env.cell_size))
-            surf.fill(color)
-            pygame.draw.rect(surf, (0, 0, 0), surf.get_rect(), 1) #drawing a border in black
-            self.images[key] = surf #saving
-
-    def run(self):
-        """main display loop"""
-        print("<DISPLAY> starting...")
-        
-        while self.running:
-            #handling events
-            for event in pygame.event.get(): #events : mouse click or pressing some keys
-                if event.type == pygame.QUIT:
-                    self.running = False
-                    self.cmd_queue.put("quit") #stopping the simulation
-                
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE:
-                        self.running = False
-                        self.cmd_queue.put("quit")
-                    
-                    elif event.key == pygame.K_SPACE:
-                        #drought on/off
-                        self.cmd_queue.put("drought")
-                    
-                    elif event.key == pygame.K_r:
-                        #rain on/off
-                        self.cmd_queue.put("rain")
-            
-            #updating the data on the display
+import supervisor
+from locks import StripedLock
+import checkpoint
+import stats
+import broadcast
+from frames import FrameRing, frames_name
+from table import AnimalTable, table_name
+#pygame comes with display.py, imported by main() once env and the animals are started: no child process pays for it
+
+launch_time = time.monotonic()
+
+
+def parse_args(argv=None):
+    """command line options, the env settings are applied right away (before any process starts)"""
+    parser = argparse.ArgumentParser(description="circle of life", fromfile_prefix_chars="@") #@file.conf: one argument per line
+    parser.add_argument("--engine", choices=["batch", "process", "sharded"], default="batch", help="batch: every animal stepped together in the env process, process: one OS process per animal, sharded: one worker per band of rows (--stripes)")
+    parser.add_argument("--width", type=int, default=env.tab_size, help="grid width in cells")
+    parser.add_argument("--height", type=int, default=env.tab_size, help="grid height in cells")
+    parser.add_argument("--cell-size", type=int, default=env.cell_size, help="cell size in pixels")
+    parser.add_argument("--preys", type=int, default=20)
+    parser.add_argument("--predators", type=int, default=6)
+    parser.add_argument("--stripes", type=int, default=os.cpu_count() or 1, help="number of row bands locked independently")
+    parser.add_argument("--unix-socket", default=None, help="also serve the spawn protocol on this unix socket, local clients use it")
+    parser.add_argument("--seed", type=int, default=None, help="random seed of grass growth and the batch engine")
+    parser.add_argument("--grass-rate", type=float, default=env.grass_rate, help="chance for an empty cell to grow grass each tick")
+    parser.add_argument("--grass-spread", type=float, default=env.grass_spread, help="extra growth chance per neighbouring grass cell")
+    parser.add_argument("--record", default=None, help="record the run to this file")
+    parser.add_argument("--record-every", type=int, default=1, help="record one frame out of this many")
+    parser.add_argument("--replay", default=None, help="play a recording back instead of simulating")
+    parser.add_argument("--checkpoint", default=None, help="save the whole simulation to this file periodically and on exit")
+    parser.add_argument("--checkpoint-every", type=float, default=60.0, help="seconds between two checkpoints")
+    parser.add_argument("--resume", default=None, help="start from this checkpoint file (grid size taken from it)")
+    parser.add_argument("--stats-jsonl", default=None, help="append the stats of every process to this file as json lines")
+    parser.add_argument("--stats-every", type=float, default=1.0, help="seconds between two lines of --stats-jsonl")
+    parser.add_argument("--broadcast", default=None, metavar="[HOST:]PORT", help="stream the frames to remote viewers (HOST 0.0.0.0 for other machines)")
+    parser.add_argument("--view", default=None, metavar="HOST:PORT", help="watch the simulation another game broadcasts instead of simulating")
+    parser.add_argument("--packed", action="store_true", help="grid as one bit plane per species (very large worlds, see bench.py --layouts)")
+    parser.add_argument("--speed", type=float, default=1.0, help="simulated seconds per wall second at start (10, 100, inf: as fast as possible), keys 1 to 4 change it")
+    parser.add_argument("--set", action="append", default=[], type=env.parse_setting, metavar="NAME=VALUE", help="change an env setting (h_lim=30, food_gain=20...), repeatable")
+    parser.add_argument("--start-method", choices=["fork", "forkserver"], default="fork", help="how animal processes are started: fork copies the game, forkserver forks them from a small server that preloaded the animal modules only")
+    parser.add_argument("--spare-workers", type=int, default=supervisor.default_spare, help="animal workers kept started and idle, births are handed to them (process engine)")
+    parser.add_argument("--max-animals", type=int, default=None, help="population cap, sizes the animal table, births over it are refused (default: 1000 for the process engine, a quarter of the cells otherwise)")
+    args = parser.parse_args(argv)
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    if args.speed != 1.0 and args.engine == "process":
+        parser.error("--speed needs the batch or sharded engine, animal processes keep their own wall-clock pace")
+    env.configure(UNIX_PATH=args.unix_socket, grass_rate=args.grass_rate, grass_spread=args.grass_spread,
+                  BROADCAST=broadcast.parse_address(args.broadcast) if args.broadcast else None)
+    env.configure(**dict(args.set))
+    if args.resume:
+        args.width, args.height = checkpoint.shape(args.resume)
+    if args.max_animals is None and args.engine == "process":
+        args.max_animals = supervisor.default_cap
+    return args
+
+
+class Simulation:
+    """env process and, with the process engine, the animal processes"""
+
+    def __init__(self, args):
+        self.args = args
+        #env always forks: it needs the settings parse_args put in the env module
+        self.fork = multiprocessing.get_context("fork")
+        self.ctx = multiprocessing.get_context(args.start_method) #animal processes
+        if args.start_method == "forkserver":
+            self.ctx.set_forkserver_preload(["animals", "supervisor"])
+        self.p_env = None
+        self.supervisor = None
+        self.env_ready = None #seconds from launch
+        self.populated = None
+
+    def start(self):
+        """starting env, waiting until it is ready, then the animals. False if env didn't come up"""
+        args = self.args
+        if args.start_method == "forkserver":
+            from multiprocessing import forkserver
+            forkserver.ensure_running() #warming up while env creates the grid
+
+        #sync (the animals get the lock and the queue: made by their own context)
+        self.grid_lock = StripedLock(args.width, args.height, args.stripes, self.ctx) #one mutual exclusion lock per band of rows
+        self.cmd_recv, self.cmd_send = self.fork.Pipe(duplex=False) # display-> env, env can wait on it
+        self.birth_queue = self.ctx.Queue() # animals and workers -> supervisor, newborns to hand out
+
+        #env process
+        env_proc = env.EnvProcess(self.grid_lock, args.engine, args.preys, args.predators, args.width, args.height, args.seed) #lock to env
+        env_proc.record_path = args.record
+        env_proc.record_every = args.record_every
+        env_proc.checkpoint_path = args.checkpoint
+        env_proc.checkpoint_every = args.checkpoint_every
+        env_proc.resume_path = args.resume
+        env_proc.stats_path = args.stats_jsonl
+        env_proc.stats_every = args.stats_every
+        env_proc.speed = args.speed
+        env_proc.packed = args.packed
+        env_proc.max_animals = args.max_animals
+        env_proc.ready = self.fork.Event() #set once the segments exist and the sockets listen
+        #daemon=True for child process, ends when parent process ends. the sharded env starts its own workers, which a daemon can't
+        self.p_env = self.fork.Process(target=env_proc.run, args=(self.cmd_recv,), daemon=args.engine != "sharded")
+        self.p_env.start()
+
+        while not env_proc.ready.wait(0.01):
+            if not self.p_env.is_alive():
+                print("env stopped before being ready")
+                return False
+        self.env_ready = time.monotonic() - launch_time
+
+        if args.engine == "process":
+            #initial population
+            print("spawning initial population...")
+
+            self.supervisor = supervisor.Supervisor(self.ctx, self.grid_lock, self.birth_queue, args.spare_workers, args.max_animals)
+            self.supervisor.start(0 if args.resume else args.preys + args.predators)
+            if args.resume:
+                #the animals of the checkpoint, with a fresh energy
+                placed = animals.adopt_population(self.grid_lock, self.supervisor)
+            else:
+                #preys then predators, each in one request to env
+                placed = animals.spawn_population(env.passive_prey, args.preys, self.supervisor)
+                placed += animals.spawn_population(env.predator, args.predators, self.supervisor)
+            self.supervisor.wait_ready(placed) #before pygame runs its font lookup
+
+            print(f"started {self.supervisor.population} animals")
+        self.populated = time.monotonic() - launch_time
+        return True
+
+    def stop(self):
+        """stopping every process and removing what env couldn't"""
+        if self.supervisor is not None:
+            self.supervisor.stop()
+        if self.p_env is not None:
+            self.p_env.terminate()
+            self.p_env.join(timeout=5) #env cleans up on SIGTERM
+
+        for name in (env.shared_mem_name, frames_name(env.shared_mem_name), stats.stats_name(env.shared_mem_name), table_name(env.shared_mem_name)):
             try:
-                while True:
-                    frame_latest = self.display_queue.get_nowait() #get item: if empty-> it crashes
-                    self.grid_data = frame_latest['grid'] #updating data (no previous crash)
-                    self.counts = frame_latest['counts']
-                    self.raining = frame_latest['raining']
-                    self.drought = frame_latest['drought']
-            except Empty: #if the crash was cause by an empty queue
-                pass #we continue
-
-            #drawing
-            self.draw_grid()
-            self.draw_ui()
-            
-            pygame.display.flip() #flipping the buffer: taking everything in the buffer and showing it onto the screen
-            self.clock.tick(FPS) #if loop is fast, we cap the execution with a delay
-
-        pygame.quit()
-
-    def draw_grid(self):
-        """drawing the grid"""
-        self.screen.fill(bg_color) #filling with background color
-        
-        for i in range(env.number_bytes):
-            val = self.grid_data[i] #wholives there
-
-            #calculating 2D position with 1D
-            x = (i % env.tab_size) * env.cell_size
-            y = (i // env.tab_size) * env.cell_size
-
-            #drawing
-            if val in self.images:
-                self.screen.blit(self.images[val], (x, y))
-            
-            #grid lines
-            pygame.draw.rect(self.screen, grid_color, (x, y, env.cell_size, env.cell_size), 1) #1 is thickness
-
-    def draw_ui(self):
-        """drawing the status panel"""
-        y_offset = env.tab_size * env.cell_size #starting position for the panel, where the grid ends
-        
-        #filling with background color
-        pygame.draw.rect(self.screen, (20, 20, 20), (0, y_offset, window_width, 100))
-        
-        if self.drought:
-            status_text = "status: drought -> no grass growth right now"
-            status_color = (255, 100, 100)
-        elif self.raining:
-            status_text = "status: raining -> fast grass growth"
-            status_color = (100, 200, 255)
-        else:
-            status_text = "status: normal"
-            status_color = (200, 255, 200)
-        
-        surf_status = self.font.render(status_text, True, status_color) #rendering the text
-        self.screen.blit(surf_status, (10, y_offset + 10)) #pushing the text-image
-        
-        #counting
-        total_prey = self.counts['passive_prey'] + self.counts['active_prey']
-        pop_text = (f"grass: {self.counts['grass']}  |  " f"prey: {total_prey}  |  " f"predators: {self.counts['predator']}")
-        surf_pop = self.font_small.render(pop_text, True, (200, 200, 200))
-        self.screen.blit(surf_pop, (10, y_offset + 40))
-        
-        # Controls
-        controls = "<SPACE> toggle drought  |  <R> toggle rain  |  <ESC> QUIT"
-        surf_controls = self.font_small.render(controls, True, (150, 150, 150))
-        self.screen.blit(surf_controls, (10, y_offset + 65))
+                s = shared_memory.SharedMemory(name=name)
+                s.close()
+                s.unlink()
+            except:
+                pass
+        if env.UNIX_PATH and os.path.exists(env.UNIX_PATH): #env was terminated before removing it
+            os.unlink(env.UNIX_PATH)
 
 
 def main(): 
+    args = parse_args()
+
+    if args.replay:
+        #no simulation at all, the recording feeds the display
+        from recording import Replay
+        from display import Display
+        frames = Replay(args.replay)
+        print(f"replaying {args.replay}: {len(frames.index)} frames, {frames.duration:.1f}s")
+        display = Display(None, frames, args.cell_size)
+        try:
+            display.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            frames.close()
+        return
+
+    if args.view:
+        #a remote env feeds the display, nothing runs here
+        from display import Display
+        frames = broadcast.FrameClient(*broadcast.parse_address(args.view))
+        print(f"watching {frames.address}: grid {frames.width}x{frames.height}")
+        display = Display(None, frames, args.cell_size)
+        try:
+            display.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            frames.close()
+        return
+
     print("Circle game")
     print("-" * 40)
     print()
 
-    #sync
-    grid_lock = multiprocessing.Lock() #mutual exclusion lock creation
-    cmd_queue = multiprocessing.Queue() # display-> env
-    display_queue = multiprocessing.Queue()  # env ->display
-
-    #env process
-    env_proc = env.EnvProcess(grid_lock) #lock to env
-    p_env = multiprocessing.Process(target=env_proc.run, args=(cmd_queue, display_queue), daemon=True) #daemon=True for child process, ends when parent process ends
-    p_env.start()
-    
-    #waiting for shared_mem
-    time.sleep(1)
-
-    #initial population
-    print("spawning initial population...")
-    procs = []
-    
-    #preys
-    for _ in range(20):
-        p = multiprocessing.Process(target=animals.run_animal, args=(env.passive_prey, grid_lock), daemon=True)
-        p.start()
-        procs.append(p)
-
-    #predators
-    for _ in range(6):
-        p = multiprocessing.Process(target=animals.run_animal, args=(env.predator, grid_lock), daemon=True)
-        p.start()
-        procs.append(p)
-
-    print(f"started {len(procs)} animals")
-    print("\ndisplay charging...")
-
-    #running display in the main process(required by pygame)
-    display = Display(cmd_queue, display_queue)
+    sim = Simulation(args)
     try:
-        display.run() #staying here until player quits
-    
+        if not sim.start():
+            return
+        print(f"env ready after {sim.env_ready:.3f}s, animals started after {sim.populated:.3f}s")
+        print("\ndisplay charging...")
+
+        #running display in the main process(required by pygame)
+        from display import Display
+        frames = FrameRing(frames_name(env.shared_mem_name)) #env -> display, shape read from the header
+        try:
+            stats_page = stats.StatsPage(stats.stats_name(env.shared_mem_name))
+        except (FileNotFoundError, ValueError):
+            stats_page = None #no overlay, the game still runs
+        try:
+            table = AnimalTable(table_name(env.shared_mem_name))
+        except (FileNotFoundError, ValueError):
+            table = None #no energy heatmap
+        display = Display(sim.cmd_send, frames, args.cell_size, stats_page, table, clock_keys=args.engine != "process")
+        display.started = launch_time
+        display.speed = args.speed
+        try:
+            display.run() #staying here until player quits
+        finally:
+            frames.close()
+            if stats_page is not None:
+                display.stats = None
+                stats_page.close()
+            if table is not None:
+                display.table = None
+                table.close()
+
     except KeyboardInterrupt:
         pass
 
     finally:
         print("\nshutting down the game and cleaning...")
-        p_env.terminate()
-        for p in procs:
-            if p.is_alive():
-                p.terminate()
-        
-        #cleanup
-        try:
-            s = shared_memory.SharedMemory(name=env.shared_mem_name)
-            s.close()
-            s.unlink()
-        except:
-            pass
+        sim.stop()
         print("cleanup complete")
         sys.exit()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,144 @@
+import numpy as np
+
+
+#queries around many cells at once over the flat grid: the cost grows with the number of animals asking,
+#not with the size of the grid
+#  Neighbourhood: offset tables of a radius, nearest cell holding some codes, step towards a cell
+#  DensityMap: summed-area tables of some codes, refreshed once per tick, any box count in 4 lookups
+chunk_cells = 1 << 20 #candidate cells looked at per batch, bounds the temporary arrays
+
+
+def offsets(radius, metric="chebyshev"):
+    """(dx, dy, distance) of every cell within radius of the origin, origin excluded, nearest first"""
+    r = np.arange(-radius, radius + 1, dtype=np.int64)
+    dx, dy = np.meshgrid(r, r)
+    dx, dy = dx.ravel(), dy.ravel()
+    if metric == "chebyshev":
+        dist = np.maximum(np.abs(dx), np.abs(dy))
+    elif metric == "manhattan":
+        dist = np.abs(dx) + np.abs(dy)
+    elif metric == "euclidean":
+        dist = np.sqrt(dx * dx + dy * dy)
+    else:
+        raise ValueError(f"unknown metric {metric}")
+    keep = (dist > 0) & (dist <= radius)
+    dx, dy, dist = dx[keep], dy[keep], dist[keep]
+    order = np.lexsort((dx, dy, dist)) #same distance: row then column order, always the same pick
+    return dx[order], dy[order], dist[order]
+
+
+class Neighbourhood:
+    """neighbour offsets of one grid shape and radius, computed once.
+    wrap=False: the grid has walls (like the moves of the animals), True: a torus"""
+
+    def __init__(self, width, height, radius=1, wrap=False, metric="chebyshev"):
+        self.width = width
+        self.height = height
+        self.radius = radius
+        self.wrap = wrap
+        self.dx, self.dy, self.dist = offsets(radius, metric)
+
+    def cells_around(self, positions):
+        """(n, k) cells around each position, nearest first, -1 for the ones outside the grid"""
+        positions = np.asarray(positions, dtype=np.int64)
+        x = (positions % self.width)[:, None] + self.dx
+        y = (positions // self.width)[:, None] + self.dy
+        if self.wrap:
+            return (y % self.height) * self.width + x % self.width
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        return np.where(inside, y * self.width + x, -1)
+
+    def nearest(self, cells, positions, codes, lo=0, hi=None):
+        """for each position the nearest cell holding one of codes, -1 if there is none within radius.
+        cells: the flat grid, only cells in [lo, hi) are looked at"""
+        positions = np.asarray(positions, dtype=np.int64)
+        hi = len(cells) if hi is None else hi
+        wanted = np.zeros(256, dtype=bool) #code -> looked for, one gather instead of one compare per code
+        wanted[np.atleast_1d(codes)] = True
+        result = np.full(len(positions), -1, dtype=np.int64)
+        step = max(1, chunk_cells // max(len(self.dx), 1))
+        for start in range(0, len(positions), step):
+            around = self.cells_around(positions[start:start + step])
+            valid = (around >= lo) & (around < hi)
+            hit = valid & wanted[cells[np.where(valid, around, lo)]]
+            first = hit.argmax(axis=1)
+            rows = np.arange(len(first))
+            result[start:start + step] = np.where(hit[rows, first], around[rows, first], -1)
+        return result
+
+    def step_towards(self, positions, targets):
+        """(dx, dy) of the move (one cell, one axis) bringing each position closer to its target,
+        (0, 0) when there is no target (-1) or it is reached"""
+        positions = np.asarray(positions, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        dx = targets % self.width - positions % self.width
+        dy = targets // self.width - positions // self.width
+        if self.wrap: #the short way around
+            dx = (dx + self.width // 2) % self.width - self.width // 2
+            dy = (dy + self.height // 2) % self.height - self.height // 2
+        along_x = np.abs(dx) >= np.abs(dy)
+        none = targets < 0
+        step_x = np.where(along_x & ~none, np.sign(dx), 0)
+        step_y = np.where(~along_x & ~none, np.sign(dy), 0)
+        return step_x, step_y
+
+
+class DensityMap:
+    """summed-area tables (one per species, a species being some cell codes) over rows [row_lo, row_hi)
+    of the grid. refresh once per tick, then count any box for many animals at once"""
+
+    def __init__(self, width, height, species):
+        self.width = width
+        self.height = height
+        self.species = {name: np.atleast_1d(codes) for name, codes in species.items()}
+        self.tables = {}
+        self.row_lo = 0
+        self.row_hi = height
+
+    def refresh(self, grid, row_lo=0, row_hi=None):
+        """recomputing the tables from the grid, only rows [row_lo, row_hi) (a shard and its surroundings)
+        are read: a packed grid decodes just those"""
+        self.row_lo = max(row_lo, 0)
+        self.row_hi = self.height if row_hi is None else min(row_hi, self.height)
+        rows = grid.rows(self.row_lo, self.row_hi)
+        for name, codes in self.species.items():
+            table = self.tables.get(name)
+            if table is None or table.shape[0] != len(rows) + 1:
+                table = self.tables[name] = np.zeros((len(rows) + 1, self.width + 1), dtype=np.int32)
+            present = rows == codes[0] if len(codes) == 1 else np.isin(rows, codes)
+            np.cumsum(present, axis=0, dtype=np.int32, out=table[1:, 1:])
+            np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+
+    def count(self, name, x0, y0, x1, y1):
+        """cells of the species in the boxes [x0, x1) x [y0, y1), clipped to the grid and the refreshed rows"""
+        table = self.tables[name]
+        x0 = np.clip(x0, 0, self.width)
+        x1 = np.clip(x1, 0, self.width)
+        y0 = np.clip(np.asarray(y0) - self.row_lo, 0, self.row_hi - self.row_lo)
+        y1 = np.clip(np.asarray(y1) - self.row_lo, 0, self.row_hi - self.row_lo)
+        x1 = np.maximum(x0, x1)
+        y1 = np.maximum(y0, y1)
+        return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+    def around(self, name, positions, radius):
+        """cells of the species in the square of radius around each position"""
+        x = np.asarray(positions) % self.width
+        y = np.asarray(positions) // self.width
+        return self.count(name, x - radius, y - radius, x + radius + 1, y + radius + 1)
+
+    def step_towards(self, name, positions, radius):
+        """(dx, dy) towards the side (left, right, up, down) holding most of the species within radius,
+        (0, 0) when there is none"""
+        x = np.asarray(positions) % self.width
+        y = np.asarray(positions) // self.width
+        sides = np.stack([
+            self.count(name, x - radius, y - radius, x, y + radius + 1),         #left
+            self.count(name, x + 1, y - radius, x + radius + 1, y + radius + 1), #right
+            self.count(name, x - radius, y - radius, x + radius + 1, y),         #up
+            self.count(name, x - radius, y + 1, x + radius + 1, y + radius + 1), #down
+        ])
+        best = sides.argmax(axis=0)
+        found = sides.max(axis=0) > 0
+        step_x = np.where(found, np.array([-1, 1, 0, 0])[best], 0)
+        step_y = np.where(found, np.array([0, 0, -1, 1])[best], 0)
+        return step_x, step_y
@@ -0,0 +1,145 @@
+import socket
+import struct
+import env
+
+
+#binary protocol on the spawn socket, one connection kept open for many requests
+#every message: header (payload length, type, kind or status, count) + payload, little endian
+header = struct.Struct("<IBBI")
+op_record = struct.Struct("<BII") #op, cell, target cell
+max_count = 65536 #larger batches are refused
+max_payload = max_count * op_record.size
+
+#message types
+SPAWN = 1 #request: kind, count=N, no payload. reply: status, count=k, k int32 positions
+OPS = 2   #request: count=N, N op records. reply: status, count=N, one status byte per op
+
+#operations of an OPS batch (the energy stays on the client side)
+MOVE = 1      #animal at cell goes to an empty target
+EAT = 2       #animal at cell goes to a target holding its food (grass for preys, an active prey for predators)
+REPRODUCE = 3 #newborn of the animal at cell put on an empty target
+DIE = 4       #cell emptied
+
+#status codes
+OK = 0
+E_BOUNDS = 1      #cell outside the grid
+E_NOT_ANIMAL = 2  #no animal at cell
+E_OCCUPIED = 3    #target is not empty
+E_NO_FOOD = 4     #nothing to eat at target
+E_FULL = 5        #fewer free cells (or animal records) than requested, the positions found are still sent
+E_BAD_REQUEST = 6 #unknown type, kind or op, batch too large
+E_UNSUPPORTED = 7 #not available with this engine
+
+status_names = {OK: "ok", E_BOUNDS: "out of bounds", E_NOT_ANIMAL: "not an animal", E_OCCUPIED: "occupied",
+                E_NO_FOOD: "no food", E_FULL: "grid or animal table full", E_BAD_REQUEST: "bad request", E_UNSUPPORTED: "unsupported"}
+
+
+class ProtocolError(Exception):
+    """broken stream or error status for a whole request"""
+
+    def __init__(self, status, message=None):
+        super().__init__(message or status_names.get(status, f"status {status}"))
+        self.status = status
+
+
+def pack(msg_type, byte, count, payload=b""):
+    """one message, header included"""
+    return header.pack(len(payload), msg_type, byte, count) + payload
+
+
+def pack_ops(ops):
+    """ops: (op, cell, target) tuples"""
+    return b"".join(op_record.pack(op, pos, target) for op, pos, target in ops)
+
+
+class ServerConnection:
+    """env side of one client: bytes in, whole requests out, replies buffered until the socket takes them"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbox = bytearray()
+        self.outbox = bytearray()
+
+    def feed(self, data):
+        """appending received bytes, returns the complete requests (type, kind, count, payload)"""
+        self.inbox += data
+        requests = []
+        while len(self.inbox) >= header.size:
+            length, msg_type, byte, count = header.unpack_from(self.inbox)
+            if length > max_payload:
+                raise ProtocolError(E_BAD_REQUEST, f"payload of {length} bytes")
+            end = header.size + length
+            if len(self.inbox) < end:
+                break
+            requests.append((msg_type, byte, count, bytes(self.inbox[header.size:end])))
+            del self.inbox[:end]
+        return requests
+
+    def reply(self, msg_type, status, count, payload=b""):
+        self.outbox += pack(msg_type, status, count, payload)
+
+    def flush(self):
+        """sending what the socket takes, True once everything is gone"""
+        while self.outbox:
+            try:
+                sent = self.sock.send(self.outbox)
+            except BlockingIOError:
+                return False
+            del self.outbox[:sent]
+        return True
+
+
+class Client:
+    """persistent connection to env (unix socket when env.UNIX_PATH is set, tcp otherwise)"""
+
+    def __init__(self, unix_path=None):
+        unix_path = unix_path or env.UNIX_PATH
+        if unix_path:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(unix_path)
+        else:
+            self.sock = socket.create_connection((env.HOST, env.PORT))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) #small requests, no waiting
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def recv_exact(self, n):
+        data = bytearray()
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise ProtocolError(E_BAD_REQUEST, "env closed the connection")
+            data += chunk
+        return bytes(data)
+
+    def request(self, msg_type, byte, count, payload=b""):
+        """one round trip, returns (status, count, payload) of the reply"""
+        self.sock.sendall(pack(msg_type, byte, count, payload))
+        length, reply_type, status, reply_count = header.unpack(self.recv_exact(header.size))
+        data = self.recv_exact(length)
+        if reply_type != msg_type:
+            raise ProtocolError(E_BAD_REQUEST, f"reply of type {reply_type} to a request of type {msg_type}")
+        return status, reply_count, data
+
+    def spawn(self, kind, n):
+        """asking env to place n animals of this kind, returns (status, positions): E_FULL when fewer were placed"""
+        status, count, data = self.request(SPAWN, kind, n)
+        if status not in (OK, E_FULL):
+            raise ProtocolError(status)
+        return status, list(struct.unpack(f"<{count}i", data))
+
+    def submit(self, ops):
+        """batch of (op, cell, target) operations, returns one status per op"""
+        ops = list(ops)
+        status, count, data = self.request(OPS, 0, len(ops), pack_ops(ops))
+        if status != OK:
+            raise ProtocolError(status)
+        return list(data)
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,225 @@
+import threading
+import bisect
+import queue
+import struct
+import time
+import zlib
+import numpy as np
+
+
+#file layout:
+#  header: magic, version, width, height
+#  records: record header (kind, frame number, seconds since start, env tick, counts, raining, drought, payload size)
+#           + zlib payload: the whole grid for a keyframe, the XOR with the previous record as runs for a delta
+#delta payload: number of runs, gap before each run (from the end of the previous one), run lengths, XOR bytes
+magic = b"CREC"
+version = 1
+file_header = struct.Struct("<4sHII")
+record_header = struct.Struct("<BIdQ4qBBI")
+keyframe = 0
+delta = 1
+max_key_interval = 9000 #frames between two keyframes at most (5 minutes at 30 FPS)
+
+count_names = ('grass', 'passive_prey', 'active_prey', 'predator')
+
+
+def encode_delta(prev, cells):
+    """runs of changed bytes between two grids"""
+    xor = np.bitwise_xor(prev, cells)
+    changed = np.flatnonzero(xor)
+    if len(changed) == 0:
+        return struct.pack("<I", 0)
+    breaks = np.flatnonzero(np.diff(changed) != 1) + 1
+    starts = changed[np.concatenate(([0], breaks))]
+    ends = changed[np.concatenate((breaks - 1, [len(changed) - 1]))] + 1
+    lengths = ends - starts
+    gaps = starts - np.concatenate(([0], ends[:-1]))
+    return b"".join((struct.pack("<I", len(starts)), gaps.astype("<u4").tobytes(), lengths.astype("<u4").tobytes(), xor[changed].tobytes()))
+
+
+def apply_delta(cells, data):
+    """replaying encode_delta onto cells, in place"""
+    n = struct.unpack_from("<I", data)[0]
+    if n == 0:
+        return
+    gaps = np.frombuffer(data, dtype="<u4", count=n, offset=4).astype(np.int64)
+    lengths = np.frombuffer(data, dtype="<u4", count=n, offset=4 + 4 * n).astype(np.int64)
+    values = np.frombuffer(data, dtype=np.uint8, offset=4 + 8 * n)
+    offsets = np.cumsum(lengths) - lengths #where each run starts among the changed bytes
+    starts = np.cumsum(gaps) + offsets #gaps are counted from the end of the previous run
+    idx = np.repeat(starts - offsets, lengths) + np.arange(len(values))
+    cells[idx] ^= values
+
+
+class Recorder:
+    """env side: frames are queued as they are published and encoded/written by a background thread"""
+
+    def __init__(self, path, width, height, every=1, backlog=64):
+        self.path = path
+        self.size = width * height
+        self.every = every #recording one published frame out of every
+        self.file = open(path, "wb")
+        self.file.write(file_header.pack(magic, version, width, height))
+        self.queue = queue.Queue(maxsize=backlog)
+        self.start_time = time.monotonic()
+        self.offered = 0
+        self.recorded = 0
+        self.dropped = 0 #the writer was behind, frames skipped rather than stalling env
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    def record(self, cells, counts, raining, drought, tick):
+        """queuing a copy of the grid, never blocks"""
+        self.offered += 1
+        if (self.offered - 1) % self.every:
+            return
+        try:
+            self.queue.put_nowait((time.monotonic() - self.start_time, tick, bytes(cells), counts, raining, drought))
+        except queue.Full:
+            self.dropped += 1
+
+    def writer(self):
+        prev = None
+        frame = 0
+        since_key = 0 #frames since the last keyframe
+        delta_bytes = 0 #bytes written since the last keyframe
+        key_bytes = 0
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            t, tick, cells, counts, raining, drought = item
+            cells = np.frombuffer(cells, dtype=np.uint8)
+
+            #keyframe when deltas since the last one outweigh it (seeking replays at most that much)
+            if prev is None or delta_bytes > key_bytes or since_key >= max_key_interval:
+                kind = keyframe
+                payload = zlib.compress(cells.tobytes(), 1)
+                key_bytes = len(payload)
+                delta_bytes = 0
+                since_key = 0
+            else:
+                kind = delta
+                payload = zlib.compress(encode_delta(prev, cells), 1)
+                delta_bytes += len(payload)
+                since_key += 1
+
+            self.file.write(record_header.pack(kind, frame, t, tick, *counts, raining, drought, len(payload)))
+            self.file.write(payload)
+            prev = cells
+            frame += 1
+            self.recorded += 1
+
+    def close(self):
+        """writing what is queued and closing the file"""
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        print(f"<RECORD> {self.recorded} frames written to {self.path} ({self.dropped} dropped)")
+
+
+class ReplayFrame:
+    """same fields as frames.Frame, never torn"""
+
+    def __init__(self, cells, counts, raining, drought):
+        self.cells = cells
+        self.counts = counts
+        self.raining = raining
+        self.drought = drought
+        self.changed = None #the renderer compares the whole grid
+
+    def valid(self):
+        return True
+
+
+class Replay:
+    """display side: a recording read like a frames.FrameRing, paced by the recorded times.
+    seek and speed move a virtual clock, a seek restarts from the keyframe before the target"""
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        found, file_version, self.width, self.height = file_header.unpack(self.file.read(file_header.size))
+        if found != magic:
+            raise ValueError(f"{path} is not a circle recording")
+        if file_version != version:
+            raise ValueError(f"{path}: recording version {file_version}, expected {version}")
+        self.size = self.width * self.height
+        self.skipped = 0
+        self.torn = 0 #never, same counters as frames.FrameRing
+
+        #index of the records: (offset, seconds, kind), only the headers are read
+        self.index = []
+        offset = file_header.size
+        while True:
+            head = self.file.read(record_header.size)
+            if len(head) < record_header.size:
+                break
+            kind, frame, t, tick, *rest = record_header.unpack(head)
+            self.index.append((offset, t, kind))
+            offset += record_header.size + rest[-1]
+            self.file.seek(offset)
+        self.times = [t for offset, t, kind in self.index]
+        self.keyframes = [i for i, (offset, t, kind) in enumerate(self.index) if kind == keyframe]
+        self.duration = self.index[-1][1] if self.index else 0.0
+
+        self.cells = np.zeros(self.size, dtype=np.uint8)
+        self.next = 0 #next record to apply
+        self.position = 0.0 #virtual clock, recorded seconds
+        self.speed = 1.0
+        self.paused = False
+        self.last_read = None
+        self.frame = None
+        self.pending = False #set by seek: the grid changed without read applying anything
+
+    def load(self, i):
+        """applying record i onto the current grid"""
+        offset, t, kind = self.index[i]
+        self.file.seek(offset)
+        kind, frame, t, tick, grass, passive, active, predator, raining, drought, size = record_header.unpack(self.file.read(record_header.size))
+        data = zlib.decompress(self.file.read(size))
+        if kind == keyframe:
+            self.cells[:] = np.frombuffer(data, dtype=np.uint8)
+        else:
+            apply_delta(self.cells, data)
+        self.frame = ReplayFrame(self.cells, dict(zip(count_names, (grass, passive, active, predator))), bool(raining), bool(drought))
+
+    def read(self):
+        """the frame at the virtual clock if it changed, None otherwise"""
+        now = time.monotonic()
+        if self.last_read is not None and not self.paused:
+            self.position = min(self.position + (now - self.last_read) * self.speed, self.duration)
+        self.last_read = now
+
+        start = self.next
+        while self.next < len(self.index) and self.index[self.next][1] <= self.position:
+            self.load(self.next)
+            self.next += 1
+        if self.next == start and not self.pending:
+            return None
+        self.skipped += max(0, self.next - start - 1) #fast forward: records applied but never shown
+        self.pending = False
+        return self.frame
+
+    def seek(self, seconds):
+        """jumping to a recorded time"""
+        self.position = max(0.0, min(seconds, self.duration))
+        if not self.index:
+            return
+        target = max(0, bisect.bisect_right(self.times, self.position) - 1)
+        start = self.keyframes[bisect.bisect_right(self.keyframes, target) - 1]
+        if start < self.next <= target:
+            start = self.next #no keyframe in between: going on from the current grid
+        for i in range(start, target + 1):
+            self.load(i)
+        self.next = target + 1
+        self.pending = True
+
+    def faster(self):
+        self.speed = min(self.speed * 2, 256.0)
+
+    def slower(self):
+        self.speed = max(self.speed / 2, 0.25)
+
+    def close(self):
+        self.frame = None
+        self.file.close()
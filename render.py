@@ -0,0 +1,314 @@
+import math
+import pygame
+import numpy as np
+
+
+sprite_min = 6 #pixels per cell below which the grid is drawn as a density image instead of sprites
+
+
+class Viewport:
+    """the part of the grid shown in the window: scale (pixels per cell, below 1 when zoomed out) and the
+    cell at the top left corner (x, y, floats)"""
+
+    def __init__(self, width, height, view_width, view_height, scale):
+        self.width = width
+        self.height = height
+        self.view_width = view_width
+        self.view_height = view_height
+        self.scale = float(scale)
+        self.max_scale = float(scale) * 4
+        self.x = 0.0
+        self.y = 0.0
+        self.clamp()
+
+    def fit(self):
+        """the whole grid in the window"""
+        self.scale = min(self.view_width / self.width, self.view_height / self.height)
+        self.x = self.y = 0.0
+        self.clamp()
+
+    def min_scale(self):
+        return min(self.view_width / self.width, self.view_height / self.height, 1.0)
+
+    def zoom(self, factor, px=None, py=None):
+        """scale times factor, the cell under pixel (px, py) (default: the center) stays where it is"""
+        px = self.view_width / 2 if px is None else px
+        py = self.view_height / 2 if py is None else py
+        cx, cy = self.x + px / self.scale, self.y + py / self.scale
+        self.scale = min(max(self.scale * factor, self.min_scale()), self.max_scale)
+        self.x, self.y = cx - px / self.scale, cy - py / self.scale
+        self.clamp()
+
+    def pan(self, dx, dy):
+        """moving the view by (dx, dy) pixels"""
+        self.x += dx / self.scale
+        self.y += dy / self.scale
+        self.clamp()
+
+    def clamp(self):
+        """never past the grid edges"""
+        self.x = min(max(self.x, 0.0), max(self.width - self.view_width / self.scale, 0.0))
+        self.y = min(max(self.y, 0.0), max(self.height - self.view_height / self.scale, 0.0))
+
+    def sprite_size(self):
+        """pixels per cell when cells are drawn one by one, 0 when zoomed out too far"""
+        return int(self.scale) if self.scale >= sprite_min else 0
+
+    def visible(self):
+        """cells in view: columns [c0, c1) and rows [r0, r1). sprites start at cell (c0, r0) exactly"""
+        c0, r0 = int(self.x), int(self.y)
+        c1 = min(self.width, int(math.ceil(self.x + self.view_width / self.scale)))
+        r1 = min(self.height, int(math.ceil(self.y + self.view_height / self.scale)))
+        return c0, r0, c1, r1
+
+    def key(self):
+        """changes whenever what is drawn does (sprites only move by whole cells)"""
+        if self.sprite_size():
+            return (self.scale, int(self.x), int(self.y))
+        return (self.scale, self.x, self.y)
+
+
+class DirtyRenderer:
+    """draws only the cells in view that changed since the previous frame, returns the rects to update"""
+
+    def __init__(self, screen, images, width, height, cell_size, bg_color, grid_color, view=None):
+        self.screen = screen
+        self.images = images
+        self.width = width
+        self.height = height
+        self.bg_color = bg_color
+        self.grid_color = grid_color
+        self.prev = None #what is on screen right now, None: full redraw needed
+        self.stale = [] #positions drawn over since the last draw (forget)
+        self.full_ratio = 0.25 #above this share of changed cells one full redraw is cheaper
+        self.set_view(images, cell_size, 0, 0, view or (width * cell_size, height * cell_size))
+
+    def set_view(self, images, cell_size, c0, r0, view):
+        """sprites of this size, cell (c0, r0) at the top left of a view of view = (w, h) pixels"""
+        self.images = images
+        self.cell_size = cell_size
+        self.c0, self.r0 = c0, r0
+        self.view = pygame.Rect(0, 0, *view)
+        self.cols = min(self.width - c0, -(-view[0] // cell_size))
+        self.rows = min(self.height - r0, -(-view[1] // cell_size))
+        self.area = pygame.Rect(0, 0, self.cols * cell_size, self.rows * cell_size).clip(self.view)
+
+        #grid lines rendered once, same look as a 1px rect around every cell
+        self.overlay = pygame.Surface((self.cols * cell_size, self.rows * cell_size), pygame.SRCALPHA)
+        last_x = self.cols * cell_size - 1
+        last_y = self.rows * cell_size - 1
+        for i in range(self.cols):
+            for x in (i * cell_size, i * cell_size + cell_size - 1):
+                pygame.draw.line(self.overlay, self.grid_color, (x, 0), (x, last_y))
+        for j in range(self.rows):
+            for y in (j * cell_size, j * cell_size + cell_size - 1):
+                pygame.draw.line(self.overlay, self.grid_color, (0, y), (last_x, y))
+        self.invalidate()
+
+    def invalidate(self):
+        """next draw repaints everything (window exposed, mode change...)"""
+        self.prev = None
+        self.stale = []
+
+    def forget(self, rect):
+        """the cells under rect (screen pixels) get repainted next draw (something was drawn over them)"""
+        if self.prev is None:
+            return
+        cs = self.cell_size
+        c0, c1 = self.c0 + max(rect.left // cs, 0), self.c0 + min((rect.right + cs - 1) // cs, self.cols)
+        r0, r1 = self.r0 + max(rect.top // cs, 0), self.r0 + min((rect.bottom + cs - 1) // cs, self.rows)
+        if c0 < c1 and r0 < r1:
+            self.prev.reshape(self.height, self.width)[r0:r1, c0:c1] = 255 #no such code: always different
+            self.stale.append((np.arange(r0, r1)[:, None] * self.width + np.arange(c0, c1)).ravel())
+
+    def draw(self, cells, changed=None):
+        """cells: the new grid (bytes, memoryview or array), changed: the positions that may differ from
+        the previous grid (a delta frame), None to compare the whole grid"""
+        new = np.frombuffer(cells, dtype=np.uint8)
+        if self.prev is None:
+            return self.draw_all(new)
+
+        if changed is None:
+            changed = np.flatnonzero(new != self.prev)
+        else:
+            if self.stale:
+                changed = np.unique(np.concatenate([changed] + self.stale))
+            changed = changed[new[changed] != self.prev[changed]]
+        self.stale = []
+        if len(changed) == 0:
+            return []
+        values = new[changed] #only the changed cells are copied out of the frame
+        self.prev[changed] = values #out of view too: what a pan will show
+
+        x = changed % self.width - self.c0
+        y = changed // self.width - self.r0
+        shown = (x >= 0) & (x < self.cols) & (y >= 0) & (y < self.rows)
+        if not shown.all():
+            changed, values = changed[shown], values[shown]
+        if len(changed) == 0:
+            return []
+        if len(changed) > self.full_ratio * self.cols * self.rows:
+            return self.draw_all(new)
+
+        self.screen.set_clip(self.area)
+        rects = []
+        for i, val in zip(changed.tolist(), values.tolist()):
+            rects.append(self.draw_cell(i, val).clip(self.area))
+        self.screen.set_clip(None)
+        return rects
+
+    def draw_all(self, new):
+        """repainting every cell in view"""
+        self.prev = new.copy()
+        self.stale = []
+        self.screen.set_clip(self.area)
+        self.screen.fill(self.bg_color, self.area)
+        cs = self.cell_size
+        shown = self.prev.reshape(self.height, self.width)[self.r0:self.r0 + self.rows, self.c0:self.c0 + self.cols]
+        for y, x in zip(*np.nonzero(shown)):
+            image = self.images.get(shown[y, x])
+            if image is not None:
+                self.screen.blit(image, (int(x) * cs, int(y) * cs))
+        self.screen.blit(self.overlay, (0, 0))
+        self.screen.set_clip(None)
+        return [self.area]
+
+    def draw_cell(self, i, val):
+        """repainting one cell, background then sprite then its piece of the grid lines"""
+        rect = pygame.Rect((i % self.width - self.c0) * self.cell_size, (i // self.width - self.r0) * self.cell_size, self.cell_size, self.cell_size)
+        self.screen.fill(self.bg_color, rect)
+        if val in self.images:
+            self.screen.blit(self.images[val], rect)
+        self.screen.blit(self.overlay, rect, rect)
+        return rect
+
+
+class Mipmap:
+    """cells of each species (some codes) over blocks of 2**level x 2**level cells, from level 1 up to a
+    single block. rebuilt from a whole grid, then level 1 is kept up to date from the cells that change and
+    the levels above are summed again from it when asked for"""
+
+    def __init__(self, width, height, codes):
+        self.width = width
+        self.height = height
+        self.n = len(codes)
+        self.channel = np.full(256, -1, dtype=np.int64) #code -> species, -1: not counted
+        self.channel[list(codes)] = np.arange(self.n)
+        self.levels = [None] #level 0 is the grid itself
+        level = 1
+        while (1 << (level - 1)) < max(width, height):
+            block = 1 << level
+            self.levels.append(np.zeros((self.n, -(-height // block), -(-width // block)), dtype=np.int32))
+            level += 1
+        self.valid = 0 #levels up to this one are up to date
+
+    @staticmethod
+    def reduce(counts):
+        """2x2 sums, odd edges padded with zeros"""
+        n, h, w = counts.shape
+        if h % 2 or w % 2:
+            counts = np.pad(counts, ((0, 0), (0, h % 2), (0, w % 2)))
+        return counts.reshape(n, (h + 1) // 2, 2, (w + 1) // 2, 2).sum(axis=(2, 4), dtype=np.int32)
+
+    def rebuild(self, cells):
+        grid = np.asarray(cells).reshape(self.height, self.width)
+        species = self.channel[grid]
+        counts = np.stack([species == c for c in range(self.n)]).astype(np.int32)
+        for level in range(1, len(self.levels)):
+            counts = self.levels[level][:] = self.reduce(counts)
+        self.valid = len(self.levels) - 1
+
+    def update(self, positions, old, new):
+        """cells at positions went from codes old to new"""
+        x = positions % self.width
+        y = positions // self.width
+        old_channel, new_channel = self.channel[old], self.channel[new]
+        removed, added = old_channel >= 0, new_channel >= 0
+        _, h, w = self.levels[1].shape
+        block = (y >> 1) * w + (x >> 1)
+        index = np.concatenate((old_channel[removed] * h * w + block[removed], new_channel[added] * h * w + block[added]))
+        weight = np.concatenate((np.full(removed.sum(), -1, dtype=np.int32), np.ones(added.sum(), dtype=np.int32)))
+        np.add.at(self.levels[1].reshape(-1), index, weight)
+        self.valid = min(self.valid, 1)
+
+    def level(self, level):
+        """the counts of a level, summed again from the one below if cells changed since"""
+        while self.valid < level:
+            self.levels[self.valid + 1][:] = self.reduce(self.levels[self.valid])
+            self.valid += 1
+        return self.levels[level]
+
+
+class DensityRenderer:
+    """zoomed out: the colors of the species in view, mixed by their density in the mipmap level closest to one
+    block per pixel, pushed to the screen as a single surface. the work follows the window, not the grid"""
+
+    def __init__(self, screen, viewport, colors, bg_color):
+        self.screen = screen
+        self.viewport = viewport
+        self.width = viewport.width
+        self.height = viewport.height
+        self.bg_color = bg_color
+        self.mipmap = Mipmap(self.width, self.height, list(colors))
+        self.palette = np.array(list(colors.values()), dtype=np.float32)
+        self.lut = [bg_color] * 256 #8-bit palette of the cell codes, level 0
+        for code, color in colors.items():
+            self.lut[code] = color
+        self.prev = None #grid the mipmap was built from, None: rebuild
+        self.dirty = True
+
+    def invalidate(self):
+        """next draw repaints the view"""
+        self.dirty = True
+
+    def forget(self, rect):
+        self.dirty = True
+
+    def reset(self):
+        """frames went by without us (sprites or the energy heatmap were drawn): the mipmap is rebuilt next draw"""
+        self.prev = None
+
+    def draw(self, cells, changed=None):
+        new = np.frombuffer(cells, dtype=np.uint8)
+        if self.prev is None:
+            self.prev = new.copy()
+            self.mipmap.rebuild(self.prev)
+            self.dirty = True
+        else:
+            if changed is None:
+                changed = np.flatnonzero(new != self.prev)
+            else:
+                changed = changed[new[changed] != self.prev[changed]]
+            if len(changed):
+                values = new[changed]
+                self.mipmap.update(changed, self.prev[changed], values)
+                self.prev[changed] = values
+                self.dirty = True
+        if not self.dirty:
+            return []
+        self.dirty = False
+
+        view = self.viewport
+        level = min(max(0, int(math.floor(math.log2(1 / view.scale)))) if view.scale < 1 else 0, len(self.mipmap.levels) - 1)
+        block = 1 << level
+        c0, r0, c1, r1 = view.visible()
+        b0x, b0y, b1x, b1y = c0 >> level, r0 >> level, -(-c1 // block), -(-r1 // block)
+        if level == 0:
+            shown = np.ascontiguousarray(self.prev.reshape(self.height, self.width)[r0:r1, c0:c1])
+            surface = pygame.image.frombuffer(shown.tobytes(), (c1 - c0, r1 - r0), "P") #the codes themselves, no rgb copy
+            surface.set_palette(self.lut)
+        else:
+            #background + share of each species * (its color - background), the share folded into the palette
+            mix = (self.palette - np.asarray(self.bg_color, dtype=np.float32)) / (block * block)
+            counts = self.mipmap.level(level)[:, b0y:b1y, b0x:b1x]
+            rgb = counts.reshape(len(mix), -1).astype(np.float32).T @ mix
+            rgb += np.asarray(self.bg_color, dtype=np.float32)
+            surface = pygame.image.frombuffer(rgb.astype(np.uint8).tobytes(), (b1x - b0x, b1y - b0y), "RGB")
+
+        size = (max(1, round((b1x - b0x) * block * view.scale)), max(1, round((b1y - b0y) * block * view.scale)))
+        area = pygame.Rect(0, 0, view.view_width, view.view_height)
+        self.screen.set_clip(area)
+        self.screen.fill(self.bg_color, area)
+        self.screen.blit(pygame.transform.scale(surface, size), (round((b0x * block - view.x) * view.scale), round((b0y * block - view.y) * view.scale)))
+        self.screen.set_clip(None)
+        return [area]
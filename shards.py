@@ -0,0 +1,204 @@
+from multiprocessing import shared_memory
+from contextlib import nullcontext
+import multiprocessing
+import threading
+import struct
+import numpy as np
+from grid import open_grid
+from engine import BatchEngine
+from stats import StatsPage, stats_name
+from table import AnimalTable, table_name
+
+
+#one worker process per band of rows of the grid (grid.SharedGrid bands), each one owns every animal
+#standing in its band and is the only writer of the band during a tick, so workers never lock.
+#a tick, between two waits on the env barrier:
+#  step:   local moves, animals leaving the band are posted to the neighbour's halo box
+#  arrive: each worker takes what its neighbours posted, the answer is written back in the box
+#  depart: the accepted leavers are removed from their old cell
+#env grows grass and publishes frames while the workers wait on the barrier
+
+#segment layout:
+#  header (64 bytes): magic, number of shards, box capacity
+#  rescan flags: one int64 per shard, set by env when it placed animals in the band
+#  box counts: int64 per shard and direction (0: up, 1: down)
+#  boxes: records per shard and direction
+magic = b"CHAL"
+header_format = "4sII"
+header_size = 64
+up, down = 0, 1
+record = np.dtype([('pos', '<i8'), ('target', '<i8'), ('energy', '<f8'), ('id', '<i8'), ('age', '<i4'), ('kind', 'u1'), ('status', 'u1')], align=True)
+barrier_timeout = 10.0 #seconds, a worker that never shows up breaks the barrier
+
+
+def halo_name(grid_name):
+    """name of the halo segment going with a grid segment"""
+    return f"{grid_name}_halo"
+
+
+class HaloBuffers:
+    """boxes for the animals crossing a band border, one per shard and direction.
+    a move crosses at most one border and only from the border row, so width records are enough"""
+
+    def __init__(self, name, n_shards=None, capacity=None, create=False):
+        if create:
+            total = self.layout(n_shards, capacity)[-1]
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+            except FileExistsError:
+                old_shm = shared_memory.SharedMemory(name=name)
+                old_shm.close()
+                old_shm.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+            struct.pack_into(header_format, self.shm.buf, 0, magic, n_shards, capacity)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            found, n_shards, capacity = struct.unpack_from(header_format, self.shm.buf, 0)
+            if found != magic:
+                self.shm.close()
+                raise ValueError(f"shared memory {name} is not a circle halo")
+
+        self.name = name
+        self.n_shards = n_shards
+        self.capacity = capacity
+        rescan_offset, counts_offset, boxes_offset, end = self.layout(n_shards, capacity)
+        buf = self.shm.buf
+        self.rescan = np.ndarray((n_shards,), dtype=np.int64, buffer=buf, offset=rescan_offset)
+        self.counts = np.ndarray((n_shards, 2), dtype=np.int64, buffer=buf, offset=counts_offset)
+        self.boxes = np.ndarray((n_shards, 2, capacity), dtype=record, buffer=buf, offset=boxes_offset)
+
+    @staticmethod
+    def layout(n_shards, capacity):
+        """offsets of the rescan flags, box counts and boxes, and the total size"""
+        rescan_offset = header_size
+        counts_offset = rescan_offset + 8 * n_shards
+        boxes_offset = counts_offset + 16 * n_shards
+        return rescan_offset, counts_offset, boxes_offset, boxes_offset + 2 * n_shards * capacity * record.itemsize
+
+    def post(self, shard, direction, pos, target, energy, kind, ident, age):
+        """writing the leavers going one way (id and age: their record of the animal table)"""
+        n = len(pos)
+        box = self.boxes[shard, direction, :n]
+        box['pos'] = pos
+        box['target'] = target
+        box['energy'] = energy
+        box['id'] = ident
+        box['age'] = age
+        box['kind'] = kind
+        box['status'] = 0
+        self.counts[shard, direction] = n
+
+    def box(self, shard, direction):
+        """records posted by shard going this way"""
+        return self.boxes[shard, direction, :self.counts[shard, direction]]
+
+    def close(self):
+        """detaching from the segment"""
+        self.rescan = self.counts = self.boxes = None
+        self.shm.close()
+
+    def unlink(self):
+        """destroying the segment, only for its owner"""
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def run_shard(grid_name, shard, tick_barrier, halo_barrier):
+    """one worker: every animal of one band, stepped in batch"""
+    grid = open_grid(grid_name)
+    halo = HaloBuffers(halo_name(grid_name))
+    page = StatsPage(stats_name(grid_name))
+    stats = page.claim(f"shard{shard}")
+    table = AnimalTable(table_name(grid_name))
+    lo, hi = grid.band_start[shard], grid.band_start[shard + 1]
+    engine = BatchEngine(grid, nullcontext(), lo=lo, hi=hi, table=table) #no lock: nobody else writes the band during a tick
+    last = halo.n_shards - 1
+
+    try:
+        while True:
+            tick_barrier.wait()
+            if halo.rescan[shard]:
+                halo.rescan[shard] = 0
+                engine.adopt()
+
+            with stats.timer('step'):
+                leavers = engine.step() #pos, target, energy, kind, id, age
+                going_up = leavers[1] < lo
+                halo.post(shard, up, *(column[going_up] for column in leavers))
+                halo.post(shard, down, *(column[~going_up] for column in leavers))
+                pos = leavers[0]
+            with stats.timer('barrier'):
+                halo_barrier.wait()
+
+            #animals coming down from the band above and up from the band below
+            with stats.timer('halo'):
+                for box in ([halo.box(shard - 1, down)] if shard > 0 else []) + ([halo.box(shard + 1, up)] if shard < last else []):
+                    box['status'] = engine.arrive(box['target'], box['energy'], box['kind'], pos, box['id'], box['age'])
+            with stats.timer('barrier'):
+                halo_barrier.wait()
+
+            with stats.timer('halo'):
+                for direction in (up, down):
+                    box = halo.box(shard, direction)
+                    engine.depart(box['pos'], box['status'], box['kind'])
+            stats.set('animals', engine.count)
+            tick_barrier.wait()
+    except threading.BrokenBarrierError: #env stopped the pool
+        pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine = stats = None
+        table.close()
+        page.close()
+        halo.close()
+        grid.close()
+
+
+class ShardPool:
+    """env side: starts the workers and runs the ticks"""
+
+    def __init__(self, grid, n_shards=None):
+        self.grid = grid
+        self.n_shards = n_shards or grid.n_bands
+        if self.n_shards != grid.n_bands:
+            raise ValueError("one shard per band of the grid")
+        self.halo = HaloBuffers(halo_name(grid.name), self.n_shards, grid.width, create=True)
+        self.tick_barrier = multiprocessing.Barrier(self.n_shards + 1) #workers + env
+        self.halo_barrier = multiprocessing.Barrier(self.n_shards)
+        self.procs = []
+
+    def start(self):
+        self.halo.rescan[:] = 1 #adopting what env placed before
+        for shard in range(self.n_shards):
+            p = multiprocessing.Process(target=run_shard, args=(self.grid.name, shard, self.tick_barrier, self.halo_barrier), daemon=True)
+            p.start()
+            self.procs.append(p)
+
+    def placed(self, positions):
+        """env put animals on the grid, the workers of these bands adopt them next tick"""
+        for band in {pos // self.grid.band_cells for pos in positions}:
+            self.halo.rescan[band] = 1
+
+    def tick(self):
+        """one tick of every worker, False if a worker is gone"""
+        try:
+            self.tick_barrier.wait(barrier_timeout) #go
+            self.tick_barrier.wait(barrier_timeout) #everybody done
+        except threading.BrokenBarrierError:
+            print("<ENV> a shard worker stopped, ending the simulation")
+            return False
+        return True
+
+    def stop(self):
+        self.tick_barrier.abort()
+        self.halo_barrier.abort()
+        for p in self.procs:
+            p.join(timeout=2)
+            if p.is_alive():
+                p.terminate()
+        self.procs = []
+        self.halo.close()
+        self.halo.unlink()
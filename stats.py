@@ -0,0 +1,252 @@
+from multiprocessing import shared_memory
+import struct
+import json
+import time
+import os
+import numpy as np
+
+
+#segment layout:
+#  header (64 bytes): magic, number of rows, number of metrics
+#  rows: one per process and name (env, display, supervisor, shard workers, animal processes), each written by its process only
+#    pid (int64), name (24 bytes), then count, total ns, max ns (3 int64) for every metric
+#timers add a duration, counters only count, gauges overwrite count with a value
+magic = b"CSTA"
+header_format = "4sII"
+header_size = 64
+name_size = 24
+metrics = (
+    'tick', 'grass', 'step', 'accept', 'commands', 'requests', 'frame', 'record', 'checkpoint',  #env loop phases
+    'broadcast',
+    'halo', 'barrier',                                                                           #shard workers
+    'lock_wait', 'lock_hold',                                                                    #every process
+    'draw',                                                                                      #display
+    'birth',                                                                                     #supervisor: newborn -> worker
+    'animals', 'ticks', 'record_dropped', 'frames_skipped', 'frames_torn', 'frame_bytes',        #gauges
+    'broadcast_dropped', 'workers', 'workers_idle', 'births_cold', 'births_refused', 'respawns',
+)
+metric_index = {name: i for i, name in enumerate(metrics)}
+row_words = 1 + name_size // 8 + 3 * len(metrics)
+default_rows = 1024
+
+
+def stats_name(grid_name):
+    """name of the stats segment going with a grid segment"""
+    return f"{grid_name}_stats"
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class StatsPage:
+    """the whole stats segment: env creates it, every process claims its own row"""
+
+    def __init__(self, name, create=False, n_rows=default_rows):
+        if create:
+            total = header_size + 8 * row_words * n_rows
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+            except FileExistsError:
+                old_shm = shared_memory.SharedMemory(name=name)
+                old_shm.close()
+                old_shm.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+            struct.pack_into(header_format, self.shm.buf, 0, magic, n_rows, len(metrics))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            found, n_rows, n_metrics = struct.unpack_from(header_format, self.shm.buf, 0)
+            if found != magic or n_metrics != len(metrics):
+                self.shm.close()
+                raise ValueError(f"shared memory {name} is not a circle stats page of this version")
+
+        self.name = name
+        self.n_rows = n_rows
+        self.rows_mv = self.shm.buf[header_size:header_size + 8 * row_words * n_rows].cast("q")
+        self.rows = np.ndarray((n_rows, row_words), dtype=np.int64, buffer=self.shm.buf, offset=header_size)
+
+    def claim(self, name):
+        """a row for this process under this name (a free one, one left by a dead process, or the one it claimed
+        before under the same name), None when they are all taken. a process can hold several rows with different
+        names (display and supervisor in main). probing starts at pid % rows so processes starting together don't
+        race for the same row"""
+        pid = os.getpid()
+        start = pid % self.n_rows
+        encoded = np.frombuffer(name.encode()[:name_size].ljust(name_size, b"\0"), dtype=np.int64)
+        for i in range(self.n_rows):
+            row = (start + i) % self.n_rows
+            owner = int(self.rows[row, 0])
+            mine = owner == pid and (self.rows[row, 1:1 + name_size // 8] == encoded).all()
+            if owner == 0 or mine or (owner != pid and not alive(owner)):
+                self.rows[row] = 0
+                self.rows[row, 1:1 + name_size // 8] = encoded
+                self.rows[row, 0] = pid
+                return Stats(self, row)
+        return None
+
+    def snapshot(self):
+        """every claimed row: {name: {metric: {count, total_ms, mean_us, max_us}}}, only metrics used"""
+        result = {}
+        for row in np.flatnonzero(self.rows[:, 0]).tolist():
+            values = self.rows[row].copy()
+            name = values[1:1 + name_size // 8].tobytes().rstrip(b"\0").decode(errors="replace")
+            table = values[1 + name_size // 8:].reshape(len(metrics), 3)
+            entry = {}
+            for i, metric in enumerate(metrics):
+                count, total, peak = table[i].tolist()
+                if count or total:
+                    entry[metric] = {'count': count, 'total_ms': round(total / 1e6, 3), 'mean_us': round(total / count / 1e3, 1) if count else 0.0, 'max_us': round(peak / 1e3, 1)}
+            result[f"{name}" if name not in result else f"{name}.{row}"] = entry
+        return result
+
+    def dump(self, path):
+        """appending the snapshot as one json line"""
+        with open(path, "a") as f:
+            f.write(json.dumps({'time': round(time.time(), 3), 'rows': self.snapshot()}) + "\n")
+
+    def close(self):
+        self.rows = None
+        self.rows_mv.release()
+        self.shm.close()
+
+    def unlink(self):
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class Stats:
+    """the row of one process, single writer so plain increments are enough"""
+
+    def __init__(self, page, row):
+        self.mv = page.rows_mv
+        self.base = row * row_words + 1 + name_size // 8
+
+    def add(self, metric, ns):
+        """one timed occurrence"""
+        i = self.base + 3 * metric_index[metric]
+        mv = self.mv
+        mv[i] += 1
+        mv[i + 1] += ns
+        if ns > mv[i + 2]:
+            mv[i + 2] = ns
+
+    def count(self, metric, n=1):
+        self.mv[self.base + 3 * metric_index[metric]] += n
+
+    def set(self, metric, value):
+        """gauge"""
+        self.mv[self.base + 3 * metric_index[metric]] = value
+
+    def timer(self, metric):
+        return Timer(self, metric)
+
+
+class Timer:
+    """with stats.timer('grass'): ..."""
+
+    def __init__(self, stats, metric):
+        self.stats = stats
+        self.metric = metric
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add(self.metric, time.perf_counter_ns() - self.start)
+        return False
+
+
+class TimedLock:
+    """wrapper around a lock (or a guard of locks.StripedLock) measuring how long we wait for it and how long we
+    hold it, into a stats row and/or sample lists (bench percentiles). cells()/bands() guards are timed too"""
+
+    def __init__(self, lock, stats=None, samples=False, waits=None, holds=None):
+        self.lock = lock
+        self.stats = stats
+        self.samples = samples
+        self.waits = [] if waits is None else waits
+        self.holds = [] if holds is None else holds
+
+    def __enter__(self):
+        start = time.perf_counter_ns()
+        self.lock.__enter__()
+        self.acquired = time.perf_counter_ns()
+        wait = self.acquired - start
+        if self.stats is not None:
+            self.stats.add('lock_wait', wait)
+        if self.samples:
+            self.waits.append(wait / 1e9)
+        return self
+
+    def __exit__(self, *exc):
+        hold = time.perf_counter_ns() - self.acquired
+        self.lock.__exit__(*exc)
+        if self.stats is not None:
+            self.stats.add('lock_hold', hold)
+        if self.samples:
+            self.holds.append(hold / 1e9)
+        return False
+
+    def cells(self, *positions):
+        return TimedLock(self.lock.cells(*positions), self.stats, self.samples, self.waits, self.holds)
+
+    def bands(self, *stripes):
+        return TimedLock(self.lock.bands(*stripes), self.stats, self.samples, self.waits, self.holds)
+
+    def __getattr__(self, name):
+        return getattr(self.lock, name) #n_stripes, band_cells... (not timed)
+
+
+def summary(snapshot):
+    """a few text lines out of a snapshot (display overlay, headless output)"""
+    lines = []
+    env_row = snapshot.get("env", {})
+    for metric in ('tick', 'grass', 'step', 'frame', 'record', 'broadcast', 'checkpoint', 'accept', 'requests', 'commands'):
+        if metric in env_row:
+            m = env_row[metric]
+            lines.append(f"{metric:<10} {m['mean_us']:>9.1f} us  max {m['max_us']:>9.1f} us  n {m['count']}")
+
+    ticks = env_row.get('ticks', {}).get('count', 0)
+    animals = env_row.get('animals', {}).get('count', 0)
+    if 'step' in env_row and animals:
+        lines.append(f"step per animal {1000 * env_row['step']['mean_us'] / animals:>8.1f} ns  ({animals} animals, tick {ticks})")
+
+    #lock times and shard workers, grouped by kind of process
+    groups = {}
+    for name, row in snapshot.items():
+        group = name.split(".")[0].rstrip("0123456789")
+        groups.setdefault(group, []).append(row)
+    for group, rows in sorted(groups.items()):
+        for metric in ('lock_wait', 'lock_hold', 'step', 'halo', 'barrier'):
+            if group == "env" and metric == 'step':
+                continue
+            used = [row[metric] for row in rows if metric in row]
+            count = sum(m['count'] for m in used)
+            if count:
+                mean = 1000 * sum(m['total_ms'] for m in used) / count
+                lines.append(f"{group:<7} {metric:<9} {mean:>9.1f} us  max {max(m['max_us'] for m in used):>9.1f} us  ({len(used)} processes)")
+
+    pool = snapshot.get("supervisor", {})
+    if pool:
+        birth = pool.get('birth', {'count': 0, 'mean_us': 0.0, 'max_us': 0.0})
+        lines.append(f"births {birth['count']}  latency {birth['mean_us']:.1f} us  max {birth['max_us']:.1f} us  waited {pool.get('births_cold', {}).get('count', 0)}"
+                     f"  refused {pool.get('births_refused', {}).get('count', 0)}  respawns {pool.get('respawns', {}).get('count', 0)}"
+                     f"  workers {pool.get('workers', {}).get('count', 0)} ({pool.get('workers_idle', {}).get('count', 0)} idle)")
+
+    dropped = env_row.get('record_dropped', {}).get('count', 0)
+    display = snapshot.get("display", {})
+    skipped = display.get('frames_skipped', {}).get('count', 0)
+    torn = display.get('frames_torn', {}).get('count', 0)
+    published = env_row.get('frame_bytes', {}).get('count', 0)
+    not_sent = env_row.get('broadcast_dropped', {}).get('count', 0)
+    lines.append(f"frames skipped {skipped}  torn {torn}  not recorded {dropped}  not sent to viewers {not_sent}  published {published / 1e6:.1f} MB")
+    return lines
@@ -0,0 +1,293 @@
+from collections import deque
+import multiprocessing
+import threading
+import signal
+import queue
+import time
+import numpy as np
+import env
+import animals
+from grid import open_grid
+from stats import StatsPage, stats_name
+from table import AnimalTable, table_name, alive
+
+
+#process engine: animal workers are started ahead of time, a birth is handed to an idle one (one pipe send)
+#instead of starting a process in the middle of a population boom. a worker attaches the segments once, lives
+#one animal after the other (animals.live) and exits after max_lives of them, a fresh one takes its place.
+#the supervisor is a thread of the main process: it hands animals out, reaps the workers that exited, keeps
+#`spare` workers idle (started one at a time between two messages, never on the birth path), refuses births
+#over the population cap and gives the animal of a killed worker to another one. with no idle worker a birth
+#waits (cold) for the next one to be ready: a fresh one or one whose animal just died, whichever comes first
+#inbox (animals and workers -> supervisor, one queue):
+#  ("birth", kind, pos, id, born_at)  newborn already on pos, born_at on time.monotonic() (animals.live)
+#  ("place", kind, pos, id, born_at)  initial population, adopted animals (id -1: read from the table)
+#  ("idle", worker, lives)            ready for an animal, lives: animals it lived already
+#  ("started", worker, latency)       seconds from born_at to the worker taking the animal
+#  None                               stop
+default_spare = 8
+default_cap = 1000
+default_max_lives = 100
+reap_every = 0.2 #seconds
+latency_samples = 100000
+stop_grace = 2.0 #seconds for the workers to leave on their own before being killed
+
+
+def run_worker(wid, grid_lock, inbox, orders, stopping, settings=None, max_lives=default_max_lives):
+    """one pooled worker process: orders are (kind, pos, born_at), None to stop. an idle worker leaves when
+    the main process is gone (the other workers keep its pipe open, no EOF), a busy one when stopping is set
+    (between two ticks of its animal: killed, it could hold a band lock)"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL) #forked after pygame started, SDL's handler would only post a quit event
+    if settings:
+        env.configure(**settings)
+    parent = multiprocessing.parent_process()
+    world = animals.World(grid_lock, stopping)
+    try:
+        for lives in range(max_lives):
+            if stopping.is_set():
+                return
+            inbox.put(("idle", wid, lives))
+            while not orders.poll(0.2):
+                if stopping.is_set() or (parent is not None and not parent.is_alive()):
+                    return
+            order = orders.recv()
+            if order is None:
+                return
+            kind, pos, born_at = order
+            inbox.put(("started", wid, time.monotonic() - born_at))
+            animals.live(world, kind, pos, inbox)
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        world.close()
+
+
+class Worker:
+    def __init__(self, wid, process, orders):
+        self.wid = wid
+        self.process = process
+        self.orders = orders #our end of its pipe
+        self.animal = None #(kind, id, origin) of the animal handed to it
+
+
+class Supervisor:
+    """the worker pool of the process engine: start() once env is ready, place() the first animals, then
+    wait_ready() before anything else forks or runs a subprocess in this process (pygame's font lookup does):
+    a worker forked by the thread in the middle of it would hold its pipes"""
+
+    def __init__(self, ctx, grid_lock, inbox, spare=default_spare, cap=default_cap, max_lives=default_max_lives):
+        self.ctx = ctx #animal processes are started from it
+        self.grid_lock = grid_lock
+        self.inbox = inbox #the animals' birth queue too
+        self.spare = spare
+        self.cap = cap
+        self.max_lives = max_lives
+        self.workers = {}
+        self.idle = [] #said idle, no animal: last in first out, the warmest first
+        self.starting = [] #not idle yet
+        self.waiting = deque() #(kind, pos, id, born_at, origin) with no idle worker to go to
+        self.next_wid = 0
+        self.population = 0 #animals handed out or waiting
+        self.placed = 0 #place() orders dealt with (started or refused)
+        self.latencies = deque(maxlen=latency_samples) #seconds, births only
+        self.cold = self.refused = self.respawned = self.recycled = self.peak = 0
+        self.thread = None
+        self.stats = None
+        self.stopping = ctx.Event() #set by stop(): workers leave between two ticks of their animal
+
+    def start(self, expected=0):
+        """attaching the segments and starting workers for the expected first animals plus the spare ones,
+        the supervisor thread does the rest"""
+        self.shared = open_grid(env.shared_mem_name)
+        self.table = AnimalTable(table_name(env.shared_mem_name))
+        self.page = StatsPage(stats_name(env.shared_mem_name))
+        self.stats = self.page.claim("supervisor")
+        for _ in range(min(expected, self.cap) + self.spare):
+            self.start_worker()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def place(self, kind, pos):
+        """an animal already on pos (spawned by env, or resumed) to hand to a worker"""
+        self.inbox.put(("place", kind, pos, -1, time.monotonic()))
+
+    def wait_ready(self, n, timeout=10.0):
+        """True once the first n place() orders were dealt with and the spare workers are started again"""
+        deadline = time.monotonic() + timeout
+        while self.placed < n or self.short():
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                return False
+            time.sleep(0.005)
+        return True
+
+    def start_worker(self):
+        """a new worker, idle once it attached the segments"""
+        recv, send = self.ctx.Pipe(duplex=False)
+        wid = self.next_wid
+        self.next_wid += 1
+        p = self.ctx.Process(target=run_worker, args=(wid, self.grid_lock, self.inbox, recv, self.stopping, env.configured, self.max_lives), daemon=True)
+        p.start()
+        recv.close() #the worker's end
+        worker = Worker(wid, p, send)
+        self.workers[wid] = worker
+        self.starting.append(worker)
+        return worker
+
+    def short(self):
+        """fewer workers idle or on their way than spare ones plus waiting animals"""
+        return len(self.idle) + len(self.starting) < self.spare + len(self.waiting)
+
+    def run(self):
+        next_reap = time.monotonic() + reap_every
+        while True:
+            now = time.monotonic()
+            if now >= next_reap:
+                self.reap()
+                next_reap = now + reap_every
+            short = self.short()
+            if short:
+                self.start_worker() #one at a time, the inbox is checked in between
+            try:
+                message = self.inbox.get(timeout=0 if short else reap_every)
+            except queue.Empty:
+                continue
+            if message is None:
+                return
+            self.handle(message)
+            if self.stats is not None:
+                self.stats.set('workers', len(self.workers))
+                self.stats.set('workers_idle', len(self.idle))
+
+    def handle(self, message):
+        what = message[0]
+        if what == "birth" or what == "place":
+            _, kind, pos, ident, born_at = message
+            if self.population >= self.cap:
+                self.cull(pos, ident)
+            else:
+                self.assign(kind, pos, ident, born_at, what)
+            if what == "place":
+                self.placed += 1
+        elif what == "idle":
+            _, wid, lives = message
+            worker = self.workers.get(wid)
+            if worker is None:
+                return
+            if worker in self.starting:
+                self.starting.remove(worker)
+            if worker.animal is not None: #its animal died
+                worker.animal = None
+                self.population -= 1
+            if self.waiting:
+                self.hand(worker, *self.waiting.popleft())
+            else:
+                self.idle.append(worker)
+        elif what == "started":
+            _, wid, latency = message
+            worker = self.workers.get(wid)
+            if worker is not None and worker.animal is not None and worker.animal[2] == "birth":
+                self.latencies.append(latency)
+                if self.stats is not None:
+                    self.stats.add('birth', int(latency * 1e9))
+
+    def assign(self, kind, pos, ident, born_at, origin):
+        """the animal on pos to the warmest idle worker, or waiting for the next one ready (cold)"""
+        if ident < 0:
+            slot = int(self.table.index[pos])
+            ident = int(self.table.id[slot]) if slot >= 0 else -1
+        self.population += 1
+        self.peak = max(self.peak, self.population)
+        if self.idle:
+            self.hand(self.idle.pop(), kind, pos, ident, born_at, origin)
+            return
+        self.waiting.append((kind, pos, ident, born_at, origin))
+        if origin == "birth":
+            self.cold += 1
+            if self.stats is not None:
+                self.stats.count('births_cold')
+
+    def hand(self, worker, kind, pos, ident, born_at, origin):
+        worker.animal = (kind, ident, origin)
+        try:
+            worker.orders.send((kind, pos, born_at))
+        except OSError: #died meanwhile: reap() gives the animal to another worker
+            pass
+
+    def cull(self, pos, ident):
+        """refusing an animal over the cap: it leaves the grid before living"""
+        with self.grid_lock.cells(pos):
+            slot = int(self.table.index[pos])
+            if slot < 0 or self.shared.buf[pos] not in env.animal_codes or (ident >= 0 and self.table.id[slot] != ident):
+                return #eaten already
+            self.shared.set(pos, env.empty)
+            self.table.release([slot])
+        self.refused += 1
+        if self.stats is not None:
+            self.stats.count('births_refused')
+
+    def reap(self):
+        """joining the workers that exited: retired after max_lives, or killed (their animal goes to another)"""
+        for worker in [w for w in self.workers.values() if not w.process.is_alive()]:
+            worker.process.join()
+            worker.orders.close()
+            del self.workers[worker.wid]
+            if worker in self.idle:
+                self.idle.remove(worker)
+            if worker in self.starting:
+                self.starting.remove(worker)
+            if worker.animal is not None:
+                self.population -= 1
+            if worker.process.exitcode == 0:
+                self.recycled += 1
+            elif worker.animal is not None:
+                self.respawn(*worker.animal[:2])
+
+    def respawn(self, kind, ident):
+        """the animal of a killed worker, if it is still on the grid, to another worker"""
+        if ident < 0:
+            return
+        found = np.flatnonzero((self.table.id == ident) & ((self.table.flags & alive) != 0))
+        if not len(found):
+            return #it died with its worker
+        self.respawned += 1
+        if self.stats is not None:
+            self.stats.count('respawns')
+        self.assign(kind, int(self.table.pos[found[0]]), ident, time.monotonic(), "respawn")
+
+    def stop(self):
+        """stopping the thread and every worker, then the report. workers get stop_grace seconds to leave on
+        their own, the animals stay on their cells: only the ones still there after it are killed"""
+        if self.thread is not None:
+            self.inbox.put(None)
+            self.thread.join()
+        self.stopping.set() #once the thread is gone, or it would start new workers for the ones leaving
+        deadline = time.monotonic() + stop_grace
+        for worker in self.workers.values():
+            worker.process.join(timeout=max(0.0, deadline - time.monotonic()))
+        for worker in self.workers.values():
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join(timeout=1)
+            worker.orders.close()
+        self.workers = {}
+        if self.thread is not None:
+            self.report()
+            self.stats = None
+            self.page.close()
+            self.table.close()
+            self.shared.close()
+
+    def latency(self):
+        """births handed out, their latency in ms (from the parent's put to the worker taking the newborn)
+        and how many had to wait for a worker"""
+        latencies = np.array(self.latencies) * 1000
+        if not len(latencies):
+            return {'births': 0, 'mean_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0, 'waited': self.cold}
+        return {'births': len(latencies), 'mean_ms': round(float(latencies.mean()), 3), 'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+                'max_ms': round(float(latencies.max()), 3), 'waited': self.cold}
+
+    def report(self):
+        births = self.latency()
+        if births['births']:
+            print(f"<SUPERVISOR> {births['births']} births, latency mean {births['mean_ms']:.2f} ms  p99 {births['p99_ms']:.2f} ms  max {births['max_ms']:.2f} ms, {births['waited']} waited for a worker")
+        print(f"<SUPERVISOR> peak population {self.peak} (cap {self.cap}), {self.refused} refused, {self.respawned} respawned, {self.recycled} workers recycled")
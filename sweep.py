@@ -0,0 +1,183 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+import multiprocessing
+import itertools
+import argparse
+import time
+import io
+import os
+import numpy as np
+import env
+from frames import count_names
+from locks import StripedLock
+
+
+#many headless runs over a grid of parameters, each in its own pool process with its own segments
+#(CircleSweep<pid>_<run>) and no fixed port, so runs never collide with each other or with a game.
+#results: one .npz of columns (one value per run) plus the population series of every run
+populations = ('preys', 'predators') #initial populations, swept like the env settings
+metrics = ('prey_extinct', 'predator_extinct', 'prey_period', 'predator_period', 'prey_mean', 'predator_mean',
+           'grass_mean', 'final_prey', 'final_predator', 'ticks', 'seconds', 'ticks_per_s')
+reserved = ('HOST', 'PORT', 'UNIX_PATH', 'BROADCAST', 'shared_mem_name') #set by the sweep for every run
+
+
+def parse_param(text):
+    """"name=v1,v2,..." -> (name, [values]), values typed like the env setting (int for populations)"""
+    name, sep, values = text.partition("=")
+    name = name.strip().replace("-", "_")
+    if not sep or not values:
+        raise ValueError(f"expected name=v1,v2,..., got {text!r}")
+    if name in populations:
+        return name, [int(v) for v in values.split(",")]
+    if name in reserved:
+        raise ValueError(f"{name} is set by the sweep itself")
+    return name, [env.parse_setting(f"{name}={v}")[1] for v in values.split(",")]
+
+
+def period(series):
+    """main oscillation period (in samples) from the autocorrelation: the highest peak after it first
+    goes negative, -1 when the series does not oscillate"""
+    x = np.asarray(series, dtype=np.float64)
+    x = x - x.mean()
+    if len(x) < 4 or not x.any():
+        return -1
+    ac = np.correlate(x, x, mode="full")[len(x) - 1:]
+    ac /= ac[0]
+    negative = np.flatnonzero(ac < 0)
+    if not len(negative):
+        return -1
+    start = negative[0]
+    lag = start + int(ac[start:len(x) // 2 + 1].argmax()) if start < len(x) // 2 else -1
+    return lag if lag > 0 and ac[lag] > 0 else -1
+
+
+def summarize(series, sample_every):
+    """metrics of one run out of its (samples, 4) series in count_names order"""
+    grass, prey, predator = series[:, 0], series[:, 1] + series[:, 2], series[:, 3]
+    gone = lambda s: int(np.flatnonzero(s == 0)[0]) * sample_every if (s == 0).any() else -1
+    prey_period = period(prey)
+    predator_period = period(predator)
+    return {
+        'prey_extinct': gone(prey),
+        'predator_extinct': gone(predator),
+        'prey_period': prey_period * sample_every if prey_period > 0 else -1,
+        'predator_period': predator_period * sample_every if predator_period > 0 else -1,
+        'prey_mean': round(float(prey.mean()), 2),
+        'predator_mean': round(float(predator.mean()), 2),
+        'grass_mean': round(float(grass.mean()), 2),
+        'final_prey': int(prey[-1]),
+        'final_predator': int(predator[-1]),
+    }
+
+
+def run_one(index, params, seed, engine, width, height, stripes, ticks, sample_every):
+    """one simulation in this (fresh) pool process: (index, metrics, series)"""
+    params = dict(params)
+    preys = params.pop('preys', 20)
+    predators = params.pop('predators', 6)
+    env.configure(shared_mem_name=f"CircleSweep{os.getpid()}_{index}", PORT=0, UNIX_PATH=None, BROADCAST=None, **params)
+
+    n_samples = ticks // sample_every + 1
+    series = np.zeros((n_samples, len(count_names)), dtype=np.int32)
+    codes = [env.grass, env.passive_prey, env.active_prey, env.predator] #count_names order
+    env_proc = env.EnvProcess(StripedLock(width, height, stripes if engine == "sharded" else 1), engine, preys, predators, width, height, seed)
+    env_proc.realtime = False
+    with redirect_stdout(io.StringIO()):
+        try:
+            env_proc.create_grid()
+            start = time.perf_counter()
+            sample = 0
+            while True:
+                if env_proc.ticks % sample_every == 0:
+                    counts = env_proc.grid.counts()
+                    series[sample] = [counts[code] for code in codes]
+                    sample += 1
+                if sample == n_samples or not series[sample - 1, 1:].any() or not env_proc.running:
+                    break
+                env_proc.tick()
+            elapsed = time.perf_counter() - start
+        finally:
+            env_proc.cleanup()
+    series[sample:] = series[sample - 1] #stopped early (nothing but grass left): the animals stay at their last count
+
+    result = summarize(series, sample_every)
+    result.update(ticks=env_proc.ticks, seconds=round(elapsed, 3), ticks_per_s=round(env_proc.ticks / elapsed, 1) if elapsed > 0 else 0.0)
+    return index, result, series
+
+
+def jobs(grid, repeats, seed):
+    """(index, params, seed) of every run: the cartesian product of the values, repeats times each"""
+    names = list(grid)
+    index = 0
+    for values in itertools.product(*(grid[name] for name in names)):
+        for repeat in range(repeats):
+            yield index, tuple(zip(names, values)), None if seed is None else seed + repeat
+            index += 1
+
+
+def sweep(grid, repeats=1, seed=None, engine="batch", width=env.tab_size, height=env.tab_size, stripes=1, ticks=1000, sample_every=10, workers=None, report=None):
+    """every run of the grid in a pool, returns (runs, series): runs is a list of (params, seed, metrics)
+    in run order, series a (runs, samples, 4) array. report(run, params, seed, metrics) as runs finish"""
+    todo = list(jobs(grid, repeats, seed))
+    n_samples = ticks // sample_every + 1
+    series = np.zeros((len(todo), n_samples, len(count_names)), dtype=np.int32)
+    runs = [None] * len(todo)
+    #a fresh process per run: settings, segments and the shard workers of a run never leak into the next one
+    with ProcessPoolExecutor(workers or os.cpu_count() or 1, mp_context=multiprocessing.get_context("forkserver"), max_tasks_per_child=1) as pool:
+        futures = {pool.submit(run_one, index, params, run_seed, engine, width, height, stripes, ticks, sample_every): (params, run_seed) for index, params, run_seed in todo}
+        for future in as_completed(futures):
+            index, result, run_series = future.result()
+            params, run_seed = futures[future]
+            runs[index] = (dict(params), run_seed, result)
+            series[index] = run_series
+            if report is not None:
+                report(index, dict(params), run_seed, result)
+    return runs, series
+
+
+def save(path, grid, runs, series, sample_every):
+    """columns (run, seed, every parameter, every metric) and the series into one .npz"""
+    columns = {'run': np.arange(len(runs)), 'seed': np.array([-1 if s is None else s for _, s, _ in runs])}
+    for name in grid:
+        columns[name] = np.array([params[name] for params, _, _ in runs])
+    for name in metrics:
+        columns[name] = np.array([m[name] for _, _, m in runs])
+    np.savez_compressed(path, **columns, series=series, sample_ticks=np.arange(series.shape[1]) * sample_every,
+                        series_columns=np.array(count_names))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parameter sweep of headless runs", fromfile_prefix_chars="@")
+    parser.add_argument("--param", action="append", default=[], type=parse_param, metavar="NAME=V1,V2", help=f"values of an env setting or of {'/'.join(populations)}, repeatable (cartesian product)")
+    parser.add_argument("--repeats", type=int, default=1, help="runs of every combination (seeds --seed, --seed + 1...)")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the first repeat, runs are reproducible with the batch engine")
+    parser.add_argument("--ticks", type=int, default=1000, help="ticks of every run")
+    parser.add_argument("--sample-every", type=int, default=10, help="ticks between two population samples")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="runs at the same time")
+    parser.add_argument("--engine", choices=["batch", "sharded"], default="batch")
+    parser.add_argument("--stripes", type=int, default=2, help="shard workers of every run (sharded engine)")
+    parser.add_argument("--width", type=int, default=env.tab_size, help="grid width in cells")
+    parser.add_argument("--height", type=int, default=env.tab_size, help="grid height in cells")
+    parser.add_argument("--out", default="sweep.npz", help="results file")
+    args = parser.parse_args()
+    grid = dict(args.param)
+    if len(grid) != len(args.param):
+        parser.error("a parameter is given twice")
+
+    n_runs = args.repeats * int(np.prod([len(values) for values in grid.values()]))
+    print(f"<SWEEP> {n_runs} runs of {args.ticks} ticks on {args.workers} workers")
+    header = "  ".join(f"{name:>10}" for name in list(grid) + ['seed', 'prey_ext', 'pred_ext', 'period', 'prey_mean', 'pred_mean', 'ticks/s'])
+    print(f"{'run':>4}  {header}")
+
+    def report(index, params, seed, m):
+        values = [params[name] for name in grid] + [seed, m['prey_extinct'], m['predator_extinct'], m['prey_period'], m['prey_mean'], m['predator_mean'], m['ticks_per_s']]
+        print(f"{index:>4}  " + "  ".join(f"{str(v):>10}" for v in values))
+
+    start = time.time()
+    runs, series = sweep(grid, args.repeats, args.seed, args.engine, args.width, args.height, args.stripes, args.ticks, args.sample_every, args.workers, report)
+    save(args.out, grid, runs, series, args.sample_every)
+    print(f"<SWEEP> {len(runs)} runs in {time.time() - start:.1f}s, results in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+from multiprocessing import shared_memory
+import struct
+import numpy as np
+
+
+#one record per animal, readable by every process (energy heatmap of the display, rules checked by env)
+#segment layout:
+#  header (64 bytes): magic, width, height, number of bands, slots per band
+#  per band: free slots left, next id
+#  records, struct of arrays over the slots of every band: id, pos, energy, age, free, kind, flags
+#  free slots: each band keeps a stack of its free slots in its own range (like grid.SharedGrid's free cells)
+#  index: cell -> slot of the animal standing there, -1 if none (the only array over the cells)
+#an animal always holds a slot of the band of its cell (crossing a band border moves it to a new slot, same
+#id), so a band of the table is written under the lock of the band of the grid, or by its shard worker alone.
+#the slots come from a population cap, not from the cells: each band gets twice its share of it (animals
+#gather) plus a few, at most one per cell. a band with no free slot refuses births and animals coming in
+#(check room() before allocate): they stay where they are
+magic = b"CANI"
+header_format = "4sIIII"
+header_size = 64
+default_share = 4 #cap when none is given: a quarter of the cells (populations peak around 12% of them)
+headroom = 2
+spare_slots = 16
+
+#flags
+alive = 1
+hungry = 2  #energy below h_lim
+fertile = 4 #energy above r_lim
+
+
+def table_name(grid_name):
+    """name of the animal table going with a grid segment"""
+    return f"{grid_name}_animals"
+
+
+def band_slots(width, height, n_bands, capacity=None):
+    """slots of each band for a population cap (None: a quarter of the cells)"""
+    band_cells = -(-height // n_bands) * width
+    if capacity is None:
+        capacity = width * height // default_share
+    if n_bands == 1:
+        return max(1, min(band_cells, capacity))
+    return max(1, min(band_cells, -(-headroom * capacity // n_bands) + spare_slots))
+
+
+def layout(size, n_slots, n_bands):
+    """offsets of the band table and of each array, and the total size"""
+    bands_offset = header_size
+    offsets = {}
+    offset = bands_offset + 16 * n_bands
+    for name, itemsize in (('id', 8), ('pos', 4), ('energy', 4), ('age', 4), ('free', 4), ('index', 4), ('kind', 1), ('flags', 1)):
+        offset = (offset + 7) // 8 * 8
+        offsets[name] = offset
+        offset += itemsize * (size if name == 'index' else n_slots)
+    return bands_offset, offsets, offset
+
+
+class AnimalTable:
+    """the animal table segment: env creates it (capacity: the population cap), engines, shard workers, animal
+    processes and the display attach"""
+    dtypes = {'id': np.int64, 'pos': np.int32, 'energy': np.float32, 'age': np.int32, 'free': np.int32, 'index': np.int32, 'kind': np.uint8, 'flags': np.uint8}
+
+    def __init__(self, name, width=None, height=None, n_bands=1, create=False, capacity=None):
+        if create:
+            per_band = band_slots(width, height, n_bands, capacity)
+            total = layout(width * height, min(width * height, per_band * n_bands), n_bands)[-1]
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+            except FileExistsError:
+                old_shm = shared_memory.SharedMemory(name=name)
+                old_shm.close()
+                old_shm.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+            struct.pack_into(header_format, self.shm.buf, 0, magic, width, height, n_bands, per_band)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            found, width, height, n_bands, per_band = struct.unpack_from(header_format, self.shm.buf, 0)
+            if found != magic:
+                self.shm.close()
+                raise ValueError(f"shared memory {name} is not a circle animal table")
+
+        self.name = name
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.n_bands = n_bands
+        self.band_cells = -(-height // n_bands) * width #same bands as the grid
+        self.band_slots = per_band
+        self.capacity = min(self.size, per_band * n_bands)
+        self.band_start = [min(b * per_band, self.capacity) for b in range(n_bands + 1)] #slots of each band
+
+        bands_offset, offsets, end = layout(self.size, self.capacity, n_bands)
+        buf = self.shm.buf
+        self.bands = np.ndarray((n_bands, 2), dtype=np.int64, buffer=buf, offset=bands_offset) #free slots left, next id
+        for name, dtype in self.dtypes.items():
+            setattr(self, name, np.ndarray((self.size if name == 'index' else self.capacity,), dtype=dtype, buffer=buf, offset=offsets[name]))
+
+        if create:
+            self.reset()
+
+    def reset(self):
+        """every slot free, no animal on any cell"""
+        self.flags[:] = 0
+        self.index[:] = -1
+        for band in range(self.n_bands):
+            start, stop = self.band_start[band], self.band_start[band + 1]
+            self.free[start:stop] = np.arange(stop - 1, start - 1, -1, dtype=np.int32) #lowest slot on top
+            self.bands[band] = (stop - start, 0)
+
+    def room(self, positions):
+        """True for the animals allocate() would give a slot on these cells: first come first served, up to
+        the free slots of each band"""
+        positions = np.atleast_1d(np.asarray(positions, dtype=np.int64))
+        if self.n_bands == 1:
+            return np.arange(len(positions)) < self.bands[0, 0]
+        bands = positions // self.band_cells
+        order = np.argsort(bands, kind="stable")
+        ranks = np.empty(len(positions), dtype=np.int64)
+        ranks[order] = np.arange(len(positions)) - np.searchsorted(bands[order], bands[order])
+        return ranks < self.bands[bands, 0]
+
+    def allocate(self, positions, kinds, energies, ids=None, ages=None):
+        """slots for animals standing on these cells (bands of the cells held by the caller), -1 for the ones
+        finding their band full (see room). ids: kept from another slot (band crossing, checkpoint), new ones
+        otherwise"""
+        positions = np.atleast_1d(np.asarray(positions, dtype=np.int64))
+        n = len(positions)
+        slots = np.full(n, -1, dtype=np.int64)
+        if n == 0:
+            return slots
+        kinds = np.broadcast_to(np.asarray(kinds, dtype=np.uint8), (n,))
+        energies = np.broadcast_to(np.asarray(energies, dtype=np.float32), (n,))
+        bands = positions // self.band_cells
+        for band in (np.unique(bands).tolist() if self.n_bands > 1 else [0]):
+            chosen = np.flatnonzero(bands == band) if self.n_bands > 1 else np.arange(n)
+            left, next_id = self.bands[band].tolist()
+            k = min(len(chosen), left)
+            start = self.band_start[band]
+            taken = self.free[start + left - k:start + left][::-1].astype(np.int64)
+            chosen = chosen[:k]
+            slots[chosen] = taken
+            self.bands[band, 0] = left - k
+            if ids is None:
+                self.id[taken] = (next_id + np.arange(k)) * self.n_bands + band #unique whatever band allocates
+                self.bands[band, 1] = next_id + k
+            else:
+                self.id[taken] = np.asarray(ids)[chosen]
+                if k:
+                    self.bands[band, 1] = max(next_id, int(self.id[taken].max()) // self.n_bands + 1)
+            self.age[taken] = 0 if ages is None else np.asarray(ages)[chosen]
+            self.pos[taken] = positions[chosen]
+            self.kind[taken] = kinds[chosen]
+            self.energy[taken] = energies[chosen]
+            self.flags[taken] = alive
+            self.index[positions[chosen]] = taken
+        return slots
+
+    def release(self, slots):
+        """freeing the slots of dead (or departed) animals, bands of their cells held by the caller"""
+        slots = np.asarray(slots, dtype=np.int64)
+        slots = slots[slots >= 0]
+        slots = slots[(self.flags[slots] & alive) != 0] #released once
+        if len(slots) == 0:
+            return
+        cells = self.pos[slots]
+        mine = self.index[cells] == slots #someone may stand there already
+        self.index[cells[mine]] = -1
+        self.flags[slots] = 0
+        bands = slots // self.band_slots
+        for band in (np.unique(bands).tolist() if self.n_bands > 1 else [0]):
+            freed = slots[bands == band] if self.n_bands > 1 else slots
+            left = int(self.bands[band, 0])
+            start = self.band_start[band]
+            self.free[start + left:start + left + len(freed)] = freed
+            self.bands[band, 0] = left + len(freed)
+
+    def update(self, slots, positions, energies):
+        """animals moved and ate: new cells and energies, returns their slots (new ones for the animals that
+        changed band). every old cell is cleared from the index before the new ones are written"""
+        slots = np.asarray(slots, dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+        energies = np.asarray(energies)
+        old = self.pos[slots].astype(np.int64)
+        moved = old != positions
+        if self.n_bands > 1:
+            crossing = np.flatnonzero(moved & (old // self.band_cells != positions // self.band_cells))
+            if len(crossing):
+                slots = slots.copy()
+                kept = slots[crossing]
+                ids, ages, kinds = self.id[kept], self.age[kept], self.kind[kept]
+                self.release(kept)
+                slots[crossing] = self.allocate(positions[crossing], kinds, energies[crossing], ids, ages)
+                moved[crossing] = False
+        gone = old[moved]
+        self.index[gone[self.index[gone] == slots[moved]]] = -1
+        self.index[positions[moved]] = slots[moved]
+        self.pos[slots] = positions
+        self.energy[slots] = energies
+        return slots
+
+    def can_move(self, old, new):
+        """an animal may go from old to new: same band, or a free slot in the band of new"""
+        band = new // self.band_cells
+        return old // self.band_cells == band or self.bands[band, 0] > 0
+
+    def move(self, slot, old, new):
+        """one animal moving (animal processes, both bands held, can_move checked), returns its slot"""
+        if old // self.band_cells != new // self.band_cells:
+            ident, age, kind, energy = int(self.id[slot]), int(self.age[slot]), int(self.kind[slot]), float(self.energy[slot])
+            self.release([slot])
+            return int(self.allocate([new], kind, energy, [ident], [age])[0])
+        if self.index[old] == slot:
+            self.index[old] = -1
+        self.index[new] = slot
+        self.pos[slot] = new
+        return slot
+
+    def mark(self, slots, energies, h_lim, r_lim):
+        """hungry and fertile flags out of the energies"""
+        self.flags[slots] = alive | np.where(energies < h_lim, hungry, 0) | np.where(energies > r_lim, fertile, 0)
+
+    def enforce(self, cells, codes, energy_max, h_lim, r_lim):
+        """checking every animal of the table against the grid and the rules (every band held by the caller):
+        animals not on their cell anymore (eaten) are released, energies are kept under energy_max,
+        flags follow h_lim/r_lim. returns (released, clamped)"""
+        used = np.flatnonzero(self.flags & alive)
+        lost = used[(self.index[self.pos[used]] != used) | ~np.isin(cells[self.pos[used]], codes)]
+        self.release(lost)
+        used = np.setdiff1d(used, lost, assume_unique=True)
+        over = used[self.energy[used] > energy_max]
+        self.energy[over] = energy_max
+        self.mark(used, self.energy[used], h_lim, r_lim)
+        return len(lost), len(over)
+
+    def energy_map(self, positions=None):
+        """energy of the animal on each cell (or on these cells only), -1 where there is none"""
+        slots = self.index if positions is None else self.index[positions]
+        result = np.full(slots.shape, -1.0, dtype=np.float32)
+        occupied = slots >= 0
+        result[occupied] = self.energy[slots[occupied]]
+        return result
+
+    def count(self):
+        """animals holding a slot"""
+        return int(self.capacity - self.bands[:, 0].sum())
+
+    def close(self):
+        """detaching from the segment"""
+        self.bands = None
+        for name in self.dtypes:
+            setattr(self, name, None)
+        self.shm.close()
+
+    def unlink(self):
+        """destroying the segment, only for its owner"""
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
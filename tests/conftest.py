@@ -0,0 +1,33 @@
+import contextlib
+import sys
+import os
+import io
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) #the modules sit at the repo root
+import env
+from locks import StripedLock
+
+
+@pytest.fixture
+def make_env(request):
+    """EnvProcess factory with its own segments and no fixed port, cleaned up after the test"""
+    made = []
+    saved = {name: getattr(env, name) for name in env.settings}
+
+    def make(engine="batch", preys=20, predators=6, width=40, height=40, stripes=1, seed=1, packed=False, max_animals=None, **settings):
+        env.configure(shared_mem_name=f"CircleTest{os.getpid()}_{len(made)}", PORT=0, UNIX_PATH=None, BROADCAST=None, **settings)
+        proc = env.EnvProcess(StripedLock(width, height, stripes), engine, preys, predators, width, height, seed)
+        proc.realtime = False
+        proc.packed = packed
+        proc.max_animals = max_animals
+        with contextlib.redirect_stdout(io.StringIO()):
+            proc.create_grid()
+        made.append(proc)
+        return proc
+
+    yield make
+    for proc in made:
+        with contextlib.redirect_stdout(io.StringIO()):
+            proc.cleanup()
+    env.configure(**saved)
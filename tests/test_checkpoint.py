@@ -0,0 +1,43 @@
+import contextlib
+import io
+import numpy as np
+import pytest
+import checkpoint
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_checkpoint_holds_the_grid_of_its_tick(make_env, tmp_path, packed):
+    """the writer thread decodes the copy taken under the lock: ticks after it don't leak into the file"""
+    proc = make_env(preys=30, predators=8, packed=packed)
+    proc.checkpointer = checkpoint.Checkpointer(str(tmp_path / "sim.ckpt"), proc.width, proc.height)
+    for _ in range(20):
+        proc.tick()
+    expected = proc.grid.snapshot().copy()
+    ticks = proc.ticks
+    assert proc.checkpoint()
+    for _ in range(20):
+        proc.tick()
+    with contextlib.redirect_stdout(io.StringIO()):
+        proc.checkpointer.close()
+    proc.checkpointer = None
+
+    cells, state = checkpoint.load(str(tmp_path / "sim.ckpt"))
+    assert np.array_equal(cells, expected)
+    assert state['ticks'] == ticks
+    assert len(state['engine']['pos']) == len(state['engine']['id'])
+
+
+def test_state_of_one_animal_per_cell_fits(tmp_path):
+    """room is reserved from the record layout of a snapshot: a full grid of animals is not skipped"""
+    from engine import snapshot_dtypes
+    width, height = 600, 600 #12 bytes an animal more than the first layout: several times extra_state
+    animals = {name: np.zeros(width * height, dtype=dtype) for name, dtype in snapshot_dtypes.items()}
+    state = {'ticks': 7, 'engine': dict(animals, rng=np.random.default_rng(1).bit_generator.state)}
+    saver = checkpoint.Checkpointer(str(tmp_path / "full.ckpt"), width, height)
+    cells = np.full(width * height, 2, dtype=np.uint8)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert saver.save(cells, state, 7)
+        saver.close()
+    assert saver.saved == 1
+    cells, state = checkpoint.load(str(tmp_path / "full.ckpt"))
+    assert len(state['engine']['id']) == width * height
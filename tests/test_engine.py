@@ -0,0 +1,31 @@
+import numpy as np
+import env
+
+
+def test_births_with_default_settings(make_env):
+    """animals have to reach r_lim with the default energies, or populations can only go down"""
+    proc = make_env(preys=20, predators=6)
+    for _ in range(600):
+        proc.tick()
+    ids_given = int(proc.table.bands[:, 1].sum()) #every record ever allocated got the next id of its band
+    assert ids_given > 26
+    counts = proc.grid.counts()
+    assert counts[env.passive_prey] + counts[env.active_prey] + counts[env.predator] > 0
+
+
+def test_full_table_refuses_births_and_crossings(make_env):
+    """a cap far under what the populations would reach: every animal on the grid keeps its record"""
+    proc = make_env(preys=20, predators=6, stripes=4, max_animals=20)
+    table = proc.table
+    assert table.capacity < table.size
+    filled = False
+    for _ in range(300):
+        proc.tick()
+        cells = proc.grid.snapshot()
+        on_grid = np.flatnonzero(np.isin(cells, env.animal_codes))
+        slots = table.index[on_grid]
+        assert (slots >= 0).all()
+        assert (table.pos[slots] == on_grid).all()
+        assert table.count() == len(on_grid) == proc.engine.count
+        filled |= bool((table.bands[:, 0] == 0).any())
+    assert filled #some band did fill up
@@ -0,0 +1,65 @@
+import contextlib
+import io
+import pytest
+import env
+from clock import SimClock
+
+
+class Pipe:
+    """what the display sends, in order"""
+    def __init__(self, commands):
+        self.commands = commands
+
+    def poll(self):
+        return bool(self.commands)
+
+    def recv(self):
+        return self.commands.pop(0)
+
+
+def test_no_frame_while_nothing_changes(make_env):
+    proc = make_env()
+    proc.send_frame()
+    assert not proc.frame_wanted() #paused: no tick, nothing to diff
+    proc.tick()
+    assert proc.frame_wanted()
+    proc.send_frame()
+    assert not proc.frame_wanted()
+    proc.ring.want_key_mv[0] = 1 #a display lost track
+    assert proc.frame_wanted()
+    proc.send_frame()
+    assert not proc.frame_wanted()
+    proc.spawn_animals(env.predator, 1)
+    assert proc.frame_wanted()
+
+
+def test_process_engine_ignores_clock_commands(make_env):
+    proc = make_env("process")
+
+    proc.clock = SimClock(env.animal_tick, 1.0, 0.0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        proc.handle_commands(Pipe(["pause", "speed 100", "step", "rain"]))
+    assert not proc.clock.paused and proc.clock.speed == 1.0
+    assert proc.raining
+
+
+def test_bad_speed_commands_are_ignored(make_env):
+    proc = make_env()
+    proc.clock = SimClock(env.animal_tick, 1.0, 0.0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        proc.handle_commands(Pipe(["speed ", "speed fast", "speed 0", "speed -5", "speed nan", "speed 10"]))
+    assert proc.running and proc.clock.speed == 10.0
+
+
+def test_parse_setting_types():
+    assert env.parse_setting("BROADCAST=0.0.0.0:7000") == ('BROADCAST', ("0.0.0.0", 7000))
+    assert env.parse_setting("BROADCAST=7000") == ('BROADCAST', ("localhost", 7000))
+    assert env.parse_setting("UNIX_PATH=/tmp/circle.sock") == ('UNIX_PATH', "/tmp/circle.sock")
+    assert env.parse_setting("energy-start=1e2") == ('energy_start', 100)
+    assert env.parse_setting("grass_rate=0.25") == ("grass_rate", 0.25)
+
+
+@pytest.mark.parametrize("text", ["h_lim=30.7", "PORT=http", "BROADCAST=host:port", "nope=1", "h_lim"])
+def test_parse_setting_rejects(text):
+    with pytest.raises(ValueError, match="expected name=value"):
+        env.parse_setting(text)
@@ -0,0 +1,67 @@
+import os
+import numpy as np
+import pytest
+from frames import FrameRing, key_interval
+
+
+@pytest.fixture
+def ring():
+    writer = FrameRing(f"CircleTest{os.getpid()}_frames", 30, 20, create=True, n_slots=8)
+    reader = FrameRing(writer.name)
+    yield writer, reader
+    reader.close()
+    writer.close()
+    writer.unlink()
+
+
+def frames(n, size, seed=3):
+    """n grids, a few cells changing from one to the next"""
+    rng = np.random.default_rng(seed)
+    cells = rng.integers(0, 5, size, dtype=np.uint8)
+    for _ in range(n):
+        cells = cells.copy()
+        changed = rng.choice(size, rng.integers(1, 20), replace=False)
+        cells[changed] = rng.integers(0, 5, len(changed), dtype=np.uint8)
+        yield cells
+
+
+def test_every_frame_rebuilt_from_keyframe_and_deltas(ring):
+    writer, reader = ring
+    before = None
+    for i, cells in enumerate(frames(200, writer.size)):
+        seq = writer.publish(cells, (i, 0, 0, 0), False, i % 2 == 1)
+        frame = reader.read()
+        assert frame.seq == seq
+        assert np.array_equal(frame.cells, cells)
+        assert frame.counts['grass'] == i and frame.drought == (i % 2 == 1)
+        if before is not None and frame.changed is not None: #a delta: exactly the cells that changed
+            assert np.array_equal(np.sort(frame.changed), np.flatnonzero(cells != before))
+        before = cells.copy()
+        assert reader.read() is None #nothing new
+    assert writer.deltas > writer.keyframes > 1 #one keyframe every key_interval frames at most
+    assert writer.keyframes <= 200 // key_interval + 1
+
+
+def test_reader_catches_up_on_missed_deltas(ring):
+    writer, reader = ring
+    for i, cells in enumerate(frames(100, writer.size)):
+        writer.publish(cells, (0, 0, 0, 0), False, False)
+        if i % 5 == 4: #4 frames missed, still in the ring
+            frame = reader.read()
+            assert np.array_equal(frame.cells, cells)
+    assert reader.skipped > 0 and reader.torn == 0
+
+
+def test_reader_behind_the_ring_waits_for_a_keyframe(ring):
+    writer, reader = ring
+    published = list(frames(30, writer.size))
+    writer.publish(published[0], (0, 0, 0, 0), False, False)
+    assert np.array_equal(reader.read().cells, published[0])
+    for cells in published[1:20]: #more than the 8 slots
+        writer.publish(cells, (0, 0, 0, 0), False, False)
+    assert reader.read() is None
+    assert writer.want_key_mv[0] == 1
+    keyframes = writer.keyframes
+    writer.publish(published[20], (0, 0, 0, 0), False, False)
+    assert writer.keyframes == keyframes + 1
+    assert np.array_equal(reader.read().cells, published[20])
@@ -0,0 +1,104 @@
+import os
+import numpy as np
+import pytest
+from grid import SharedGrid, PackedGrid, empty, n_codes
+
+
+@pytest.fixture
+def grids():
+    """a byte grid and a packed one of the same odd shape (bands padded to whole words)"""
+    made = []
+
+    def make(cls, width=70, height=30, n_bands=3):
+        grid = cls(f"CircleTest{os.getpid()}_grid{len(made)}", width, height, create=True, n_bands=n_bands)
+        made.append(grid)
+        return grid
+
+    yield make
+    for grid in made:
+        grid.close()
+        grid.unlink()
+
+
+def writes(size, n, seed=5):
+    """n batches of distinct cells and codes to write"""
+    rng = np.random.default_rng(seed)
+    for _ in range(n):
+        positions = rng.choice(size, rng.integers(1, 200), replace=False)
+        yield positions, rng.integers(0, n_codes, len(positions)).astype(np.uint8)
+
+
+def test_packed_grid_matches_the_byte_grid(grids):
+    cells, packed = grids(SharedGrid), grids(PackedGrid)
+    for i, (positions, values) in enumerate(writes(cells.size, 60)):
+        if i % 2:
+            cells.set_many(positions, values)
+            packed.set_many(positions, values)
+        else:
+            for pos, value in zip(positions.tolist(), values.tolist()):
+                cells.set(pos, value)
+                packed.set(pos, value)
+        expected = cells.snapshot()
+        assert np.array_equal(packed.snapshot(), expected)
+        assert np.array_equal(packed.decode(packed.capture()), expected)
+        assert np.array_equal(packed.values(positions), expected[positions])
+        assert packed.get(int(positions[0])) == expected[positions[0]]
+        assert packed.counts() == cells.counts()
+        assert np.array_equal(packed.band_counts(), cells.population)
+        assert np.array_equal(np.sort(packed.empties()), np.sort(cells.empties()))
+    for lo, hi in ((0, cells.height), (3, 17), (9, 10), (12, 12), (25, 30)): #inside a band, across bands, none
+        assert np.array_equal(packed.rows(lo, hi), cells.rows(lo, hi))
+    for code in range(n_codes):
+        assert np.array_equal(packed.where(code), cells.where(code))
+        assert np.array_equal(packed.neighbours(code), cells.neighbours(code))
+
+
+def test_packed_grid_load_and_capture(grids):
+    cells, packed = grids(SharedGrid), grids(PackedGrid)
+    expected = np.random.default_rng(2).integers(0, n_codes, cells.size).astype(np.uint8)
+    cells.load(expected)
+    packed.load(expected)
+    assert np.array_equal(packed.snapshot(), expected)
+    assert packed.counts() == cells.counts()
+
+    captured = packed.capture()
+    assert captured.nbytes < cells.size #half a byte per cell plus the padding of the bands
+    packed.set_many(np.arange(packed.size), empty)
+    assert np.array_equal(packed.decode(captured), expected) #a copy: later writes don't reach it
+    assert packed.free_count() == packed.size
+
+
+def check_index(grid):
+    """each band lists exactly its empty cells, slot[] points back into the list, counters match the cells"""
+    for band in range(grid.n_bands):
+        start, stop = grid.band_start[band], grid.band_start[band + 1]
+        n = int(grid.population[band, empty])
+        listed = grid.free[start:start + n]
+        assert sorted(listed.tolist()) == (start + np.flatnonzero(grid.cells[start:stop] == empty)).tolist()
+        assert (grid.slot[listed] == np.arange(start, start + n)).all()
+        assert np.array_equal(grid.population[band], np.bincount(grid.cells[start:stop], minlength=n_codes)[:n_codes])
+    assert (grid.slot[grid.cells != empty] == -1).all()
+
+
+def test_free_index_swap_remove(grids):
+    """filling a cell takes it out of its band list by moving the last entry into its slot, freeing one
+    appends it: single writes and batches (moves, more filled than freed, more freed than filled)"""
+    grid = grids(SharedGrid)
+    rng = np.random.default_rng(11)
+    check_index(grid)
+    for pos in rng.choice(grid.size, 300, replace=False).tolist(): #single fills: swap-remove
+        grid.set(pos, int(rng.integers(1, n_codes)))
+        check_index(grid)
+    for pos in rng.choice(np.flatnonzero(grid.cells != empty), 100, replace=False).tolist(): #single frees
+        grid.set(pos, empty)
+        check_index(grid)
+    for positions, values in writes(grid.size, 100, seed=12): #batches, crossing the bands
+        grid.set_many(positions, values)
+        check_index(grid)
+    full = np.flatnonzero(grid.cells != empty)
+    grid.set_many(full, empty) #everything freed at once
+    check_index(grid)
+    assert grid.free_count() == grid.size
+    grid.set_many(np.arange(grid.size), 1) #everything filled at once
+    check_index(grid)
+    assert grid.free_count() == 0 and grid.random_empty() == -1
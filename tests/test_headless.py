@@ -0,0 +1,14 @@
+import contextlib
+import io
+import pytest
+import env
+import headless
+
+
+def test_failed_setup_is_not_hidden_by_the_last_frame(monkeypatch):
+    """no last frame on segments never created: the error of the setup is the one raised"""
+    def create_grid(self):
+        raise OSError("no room for the segment")
+    monkeypatch.setattr(env.EnvProcess, "create_grid", create_grid)
+    with contextlib.redirect_stdout(io.StringIO()), pytest.raises(OSError, match="no room"):
+        headless.run_headless(ticks=1, width=40, height=40)
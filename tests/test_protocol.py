@@ -0,0 +1,97 @@
+import numpy as np
+import env
+import protocol
+import table
+
+
+def agree(proc):
+    """grid, animal table and cell index describe the same animals"""
+    cells, t = proc.grid.cells, proc.table
+    animals = np.flatnonzero(np.isin(cells, env.animal_codes))
+    used = np.flatnonzero(t.flags & table.alive)
+    slots = t.index[animals]
+    assert (slots >= 0).all()
+    assert (t.pos[slots] == animals).all()
+    assert sorted(used.tolist()) == sorted(slots.tolist())
+    assert (t.index >= 0).sum() == len(animals)
+    assert t.count() == len(animals)
+
+
+def cell_of(proc, code):
+    return int(np.flatnonzero(proc.grid.cells == code)[0])
+
+
+def free_neighbour(proc, pos):
+    for target in (pos - 1, pos + 1, pos - proc.width, pos + proc.width):
+        if 0 <= target < proc.grid.size and proc.grid.cells[target] == env.empty:
+            return target
+    return None
+
+
+def with_room(proc, code):
+    """an animal of this code with an empty cell next to it, and that cell"""
+    for pos in np.flatnonzero(proc.grid.cells == code).tolist():
+        target = free_neighbour(proc, pos)
+        if target is not None:
+            return pos, target
+    raise AssertionError("no room on the grid")
+
+
+def op(proc, code, pos, target):
+    with proc.lock:
+        status = proc.apply_op(code, pos, target)
+    agree(proc)
+    return status
+
+
+def test_ops_keep_the_table_in_step(make_env):
+    proc = make_env("process", width=20, height=20, stripes=2)
+    proc.spawn_animals(env.passive_prey, 30) #animal processes would be started on them
+    proc.spawn_animals(env.predator, 10)
+    agree(proc)
+
+    #move: the record follows, same id
+    pos, target = with_room(proc, env.passive_prey)
+    ident = int(proc.table.id[proc.table.index[pos]])
+    assert op(proc, protocol.MOVE, pos, target) == protocol.OK
+    assert proc.table.id[proc.table.index[target]] == ident
+    assert proc.table.index[pos] == -1
+
+    #reproduce: the newborn gets a record
+    count = proc.table.count()
+    pos, target = with_room(proc, env.passive_prey)
+    assert op(proc, protocol.REPRODUCE, pos, target) == protocol.OK
+    assert proc.table.count() == count + 1
+
+    #eat: the prey's record goes, the predator's moves onto its cell
+    prey, hunter = with_room(proc, env.passive_prey)
+    with proc.lock:
+        proc.grid.set(prey, env.active_prey)
+    with proc.lock:
+        proc.grid.set(hunter, env.predator)
+        proc.table.allocate([hunter], env.predator, env.energy_start)
+    agree(proc)
+    count = proc.table.count()
+    assert op(proc, protocol.EAT, hunter, prey) == protocol.OK
+    assert proc.grid.cells[prey] == env.predator
+    assert proc.table.kind[proc.table.index[prey]] == env.predator
+    assert proc.table.count() == count - 1
+
+    #die: the record goes with the animal
+    assert op(proc, protocol.DIE, prey, prey) == protocol.OK
+    assert proc.table.index[prey] == -1
+
+    #refused ops change nothing
+    assert op(proc, protocol.MOVE, cell_of(proc, env.predator), cell_of(proc, env.passive_prey)) == protocol.E_OCCUPIED
+
+
+def test_full_table_refuses_spawns_and_births(make_env):
+    proc = make_env("process", width=20, height=20, stripes=1, max_animals=12)
+    status, positions = proc.spawn_animals(env.passive_prey, 30)
+    assert status == protocol.E_FULL and len(positions) == 12 #no animal left on the grid without a record
+    agree(proc)
+    pos, target = with_room(proc, env.passive_prey)
+    assert op(proc, protocol.REPRODUCE, pos, target) == protocol.E_FULL
+    assert op(proc, protocol.DIE, pos, pos) == protocol.OK
+    pos, target = with_room(proc, env.passive_prey)
+    assert op(proc, protocol.REPRODUCE, pos, target) == protocol.OK
@@ -0,0 +1,29 @@
+import os
+import re
+import subprocess
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_process_engine_stops_without_hanging():
+    """workers leave between two ticks when the pool stops: none is killed holding a band lock env then waits on"""
+    for seed in (1, 2):
+        done = subprocess.run([sys.executable, "headless.py", "--engine", "process", "--realtime", "--seconds", "2", "--width", "40", "--height", "40",
+                               "--stripes", "4", "--preys", "40", "--predators", "10", "--seed", str(seed), "--set", "PORT=0", "--set", f"shared_mem_name=CircleTest{os.getpid()}_pool"],
+                              cwd=root, capture_output=True, text=True, timeout=60)
+        assert done.returncode == 0, done.stdout + done.stderr
+        assert "<HEADLESS> final population" in done.stdout
+
+
+def test_process_engine_ticks_on_the_wall_clock():
+    """env keeps the pace of the animal processes: one tick every animal_tick of wall time, never back to back"""
+    command = [sys.executable, "headless.py", "--engine", "process", "--seconds", "3", "--width", "30", "--height", "30",
+               "--stripes", "2", "--preys", "10", "--predators", "3", "--seed", "1", "--set", "PORT=0", "--set", f"shared_mem_name=CircleTest{os.getpid()}_pace"]
+    refused = subprocess.run(command, cwd=root, capture_output=True, text=True, timeout=60)
+    assert refused.returncode == 2 and "--engine process needs --realtime" in refused.stderr
+
+    done = subprocess.run(command + ["--realtime"], cwd=root, capture_output=True, text=True, timeout=60)
+    assert done.returncode == 0, done.stdout + done.stderr
+    ticks_per_s = float(re.search(r"\(([0-9.]+) ticks/s\)", done.stdout).group(1))
+    assert 7.0 <= ticks_per_s <= 11.0, done.stdout #1 / env.animal_tick